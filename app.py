@@ -6,13 +6,20 @@ This module should be used to initialize the whole server.
 # !/usr/bin/env python
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 from tornado.options import options
 import logging
+import sys
+from lib import export_worker
+from lib import metrics
+from lib import watchdog
 from lib.scheduled_tasks import Scheduler
+from handlers.static_file_handler import ExportFileHandler
 
 from settings import settings
-from urls import url_patterns
+from urls import export_worker_url_patterns, url_patterns
 
 logger = logging.getLogger('ushop.' + __name__)
 
@@ -21,22 +28,54 @@ class UShopWebServer(tornado.web.Application):
 	"""
 	Wrapper class for the Tornado Application.
 	"""
+	def __init__(self, autoreload):
+		# Static files (including the export files under the static path) are served with the export file types
+		tornado.web.Application.__init__(self, url_patterns, autoreload=autoreload,
+		                                 static_handler_class=ExportFileHandler, **settings)
+
+
+class ExportWorkerServer(tornado.web.Application):
+	"""
+	The Tornado Application of the requests forwarded by the other worker processes to the export worker
+	"""
 	def __init__(self):
-		tornado.web.Application.__init__(self, url_patterns, autoreload=settings['debug'], **settings)
+		tornado.web.Application.__init__(self, url_patterns + export_worker_url_patterns,
+		                                 static_handler_class=ExportFileHandler, **settings)
 
 def main():
 	"""
 	Initialize the UShop Web Server.
+	With --workers different from 1, the socket is bound once and the server is forked into that many worker
+	processes (one per CPU for 0), which are restarted if they exit abnormally. The first worker runs the export jobs
+	of all of them (see export_worker).
 	"""
-	app = UShopWebServer()
+	if settings['CREDENTIALS_SESSION_COOKIE'] is not None and not settings['cookie_secret']:
+		logger.error("The credentials sessions are signed with a secret, set USHOP_COOKIE_SECRET (or disable the "
+		             "sessions with CREDENTIALS_SESSION_COOKIE = None)")
+		sys.exit(1)
+
+	sockets = tornado.netutil.bind_sockets(options.port)
+	task_id = None
+	if options.workers != 1:
+		task_id = tornado.process.fork_processes(options.workers, max_restarts=settings['WORKER_MAX_RESTARTS'])
+
+	# Autoreload restarts a single process, so it is only used without workers
+	app = UShopWebServer(autoreload=settings['debug'] and task_id is None)
 	http_server = tornado.httpserver.HTTPServer(app)
-	http_server.listen(options.port)
-	logger.info("Starting UShop_Web_Server (debug=%s)..." % (app.settings['debug']))
+	http_server.add_sockets(sockets)
+	export_worker.task_id = task_id
+	if task_id == 0:
+		ExportWorkerServer().listen(settings['EXPORT_WORKER_PORT'], address="127.0.0.1")
+	logger.info("Starting UShop_Web_Server (debug=%s, worker=%s)..." % (app.settings['debug'], task_id))
 	main_loop = tornado.ioloop.IOLoop.instance()
 
+	if settings['METRICS_ENABLED']:
+		metrics.start_loop_lag_monitor(main_loop)
+	watchdog.start_watchdog(main_loop)
+
 	# Begin scheduled tasks
 	logger.info("Starting scheduled tasks...")
-	scheduler = Scheduler(main_loop)
+	scheduler = Scheduler(main_loop, task_id)
 	scheduler.run_scheduled_tasks()
 
 	# Begin main loop
@@ -1,4 +1,3 @@
-import base64
 import json
 from urllib import urlencode
 from tornado import httpclient
@@ -6,8 +5,16 @@ from tornado import gen
 from tornado import escape
 import tornado.web
 import logging
+from lib import admission
+from lib import credentials
+from lib import metrics
+from lib import request_timing
+from settings import settings
 
 logger = logging.getLogger('ushop.' + __name__)
+CREDENTIALS_SESSION_COOKIE = settings['CREDENTIALS_SESSION_COOKIE']
+SERVER_TIMING_ENABLED = settings['SERVER_TIMING_ENABLED']
+SLOW_REQUEST_THRESHOLD_MS = settings['SLOW_REQUEST_THRESHOLD_MS']
 
 # Handler result error codes
 RESULT_ERROR_CODES = {
@@ -16,7 +23,8 @@ RESULT_ERROR_CODES = {
 	'0003': "missing url arguments",
 	'0004': "not implemented",
     '0005': "invalid credentials",
-    '0006': "wrong url argument value"
+    '0006': "wrong url argument value",
+    '0007': "server busy"
 }
 
 def construct_error_json(error_code):
@@ -27,19 +35,147 @@ def construct_error_json(error_code):
 	:return: a Json object with the error code and reason
 	"""
 	message = RESULT_ERROR_CODES[error_code]
+	metrics.result_errors.inc(error_code, message)
 	json_object = {'error_code': error_code, 'message': message}
 	return json_object
 
 
+def accepts_encoding(request, encoding):
+	"""
+	Check whether the client of a request accepts a content encoding
+	:param request: the HTTPServerRequest
+	:param encoding: the content encoding, e.g. "gzip"
+	:return: True if the encoding is in the Accept-Encoding header of the request
+	"""
+	accept_encoding = request.headers.get("Accept-Encoding", "")
+	return encoding in [value.split(';')[0].strip() for value in accept_encoding.split(',')]
+
+
+def in_request_context(execute):
+	"""
+	Decorator for the _execute function of a handler, to run it (and its callbacks) with the timeline of the request
+	as the current one (see lib.request_timing). New requests first go through the admission control (see
+	lib.admission), and are rejected with handler.write_overloaded() if the server is overloaded.
+	:param execute: the original _execute function
+	:return: the decorated _execute function
+	"""
+	def _execute(self, transforms, *args, **kwargs):
+		if self.timeline is not None:  # Already admitted (by an outer decorator)
+			with request_timing.context(self.timeline):
+				return execute(self, transforms, *args, **kwargs)
+
+		self.timeline = request_timing.RequestTimeline(request_timing.get_request_id(self.request),
+		                                               self.__class__.__name__, self.get_metrics_route())
+		with request_timing.context(self.timeline):
+			reason = admission.controller.check(self.get_admission_priority())
+			if reason is not None:
+				return self._reject(transforms, reason)
+			return execute(self, transforms, *args, **kwargs)
+
+	return _execute
+
+
 class BaseHandler(tornado.web.RequestHandler):
 	"""
 	A class to collect common handler methods - all other handlers should
     subclass this one.
     """
 
+	credentials = None  # The verified credentials of the user (see require_basic_auth)
+	timeline = None  # The timeline of the request (see lib.request_timing)
+
+	_execute = in_request_context(tornado.web.RequestHandler._execute)
+
 	def data_received(self, chunk):
 		pass
 
+	def prepare(self):
+		# Set before any response is flushed (e.g. a streamed export file), and again by finish after send_error
+		if self.timeline is not None:
+			self.set_header(request_timing.REQUEST_ID_HEADER, self.timeline.request_id)
+
+	def finish(self, chunk=None):
+		# The headers set here are also kept when send_error has cleared the others. Responses flushed before finish
+		# (e.g. streamed export files) have no Server-Timing, since their headers are sent before it is known.
+		if self.timeline is not None and not self._headers_written:
+			self.set_header(request_timing.REQUEST_ID_HEADER, self.timeline.request_id)
+			if SERVER_TIMING_ENABLED:
+				self.set_header("Server-Timing", self.timeline.server_timing(self.request.request_time()))
+		return super(BaseHandler, self).finish(chunk)
+
+	def on_finish(self):
+		# Count the request and its latency (see lib.metrics)
+		route = self.get_metrics_route()
+		request_time = self.request.request_time()
+		metrics.requests.inc(route, self.request.method, self.get_status())
+		metrics.request_duration.observe(request_time, route, self.request.method)
+
+		if SLOW_REQUEST_THRESHOLD_MS is not None and request_time * 1000 >= SLOW_REQUEST_THRESHOLD_MS and \
+				self.timeline is not None:
+			slow_request = {'route': route, 'method': self.request.method, 'status': self.get_status(),
+			                'ms': round(request_time * 1000, 1)}
+			slow_request.update(self.timeline.to_dict())
+			logger.warning("Slow request: {0}".format(json.dumps(slow_request, sort_keys=True)))
+
+	def get_metrics_route(self):
+		"""
+		Get the name of the route of the request in the metrics. Handlers serving several routes can override it, as
+		long as the number of names stays small (e.g. not the url parameters).
+		:return: the name of the route, by default the name of the handler class
+		"""
+		return self.__class__.__name__
+
+	def get_admission_priority(self):
+		"""
+		Get the priority of the request in the admission control. Handlers can override it, e.g. to let cheap requests
+		through.
+		:return: the priority of the route of the request (see lib.admission.get_route_priority)
+		"""
+		return admission.get_route_priority(self.get_metrics_route())
+
+	def write_overloaded(self, retry_after):
+		"""
+		Write the response to a request rejected by the admission control.
+		Handlers can override it to report the error in their own format.
+		:param retry_after: the number of seconds the client should wait before retrying
+		:return:
+		"""
+		self.set_status(503)
+		self.set_header("Retry-After", retry_after)
+		self.finish()
+
+	@gen.coroutine
+	def _reject(self, transforms, reason):
+		"""
+		Reject the request instead of executing it
+		"""
+		self._transforms = transforms
+		admission.shed_requests.inc(self.get_metrics_route(), reason)
+		logger.debug("Request to {0} rejected: {1}".format(self.get_metrics_route(), reason))
+		self.write_overloaded(admission.controller.get_retry_after())
+
+	def write_credentials_unverified(self, retry_after):
+		"""
+		Write the response to a request whose credentials could not be verified, because the WebAccess server is not
+		available (e.g. down, timing out or with its circuit open).
+		Handlers can override it to report the error in their own format.
+		:param retry_after: the number of seconds the client should wait before retrying
+		:return:
+		"""
+		self.set_status(503)
+		self.set_header("Retry-After", retry_after)
+		self.finish()
+
+	def write_credentials_rejected(self):
+		"""
+		Write the response to a request whose credentials have been rejected by the WebAccess server.
+		Handlers can override it to report the error in their own format.
+		:return:
+		"""
+		self.set_status(401)
+		self.set_header('WWW-Authenticate', 'Basic realm=Restricted')
+		self.finish()
+
 	def load_json(self):
 		"""
 	        Load JSON from the request body and store them in
@@ -113,6 +249,10 @@ class BaseHandler(tornado.web.RequestHandler):
 def require_basic_auth(handler_class):
 	"""
     Decorator for requiring basic authentication.
+    The credentials are verified with the WebAccess server (see lib.credentials) before the handler runs, and set in
+    handler.credentials. Rejected credentials are answered with handler.write_credentials_rejected(), and credentials
+    that cannot be verified (WebAccess not available) with handler.write_credentials_unverified(). If the session
+    cookie is enabled, verified users get a signed session cookie, which is accepted when no header is sent.
     :param handler_class: the decorated class
     :return:
     """
@@ -120,14 +260,21 @@ def require_basic_auth(handler_class):
 	# authentication and only calls the inner handler's _execute() if
 	# it's present.
 	def wrap_execute(handler_execute):
-		# I've pulled this out just for clarity, but you could stick
-		# it in _execute if you wanted.  It returns True iff
-		# credentials were provided.  (The end of this function might
-		# be a good place to see if you like their username and
-		# password.)
+		# It returns True iff verified credentials were provided.
+		@gen.coroutine
 		def require_basic_auth(handler, kwargs):
 			auth_header = handler.request.headers.get('Authorization')
-			if auth_header is None or not auth_header.startswith('Basic '):
+			basic_auth = auth_header is not None and auth_header.startswith('Basic ')
+
+			# A valid session is used when the client does not send credentials (the ones it sends always win)
+			if not basic_auth and CREDENTIALS_SESSION_COOKIE is not None:
+				session_id = handler.get_secure_cookie(CREDENTIALS_SESSION_COOKIE)
+				handler.credentials = credentials.cache.get_session(session_id) if session_id else None
+				if handler.credentials is not None:
+					kwargs['basicauth_user'] = handler.credentials.username
+					raise gen.Return(True)
+
+			if not basic_auth:
 				# If the browser didn't send us authorization headers,
 				# send back a response letting it know that we'd like
 				# a username and password (the "Basic" authentication
@@ -140,28 +287,45 @@ def require_basic_auth(handler_class):
 				handler.set_header('WWW-Authenticate', 'Basic realm=Restricted')
 				handler._transforms = []
 				handler.finish()
-				return False
+				raise gen.Return(False)
+
 			# The information that the browser sends us is
 			# base64-encoded, and in the format "username:password".
-			# Keep in mind that either username or password could
-			# still be unset, and that you should check to make sure
-			# they reflect valid credentials!
-			auth_decoded = base64.decodestring(auth_header[6:])
-			username, password = auth_decoded.split(':', 2)
-			kwargs['basicauth_user'], kwargs['basicauth_pass'] = username, password
-			return True
+			# It is only decoded (and checked with the WebAccess Logon
+			# web service) when it is not cached yet.
+			try:
+				handler.credentials = yield credentials.cache.authenticate(auth_header)
+			except Exception, e:
+				# WebAccess could not verify them, and unverified
+				# credentials are never trusted
+				logger.warning("Credentials could not be verified: {0}".format(e))
+				handler.write_credentials_unverified(admission.controller.get_retry_after())
+				raise gen.Return(False)
+
+			if handler.credentials is None:
+				handler.write_credentials_rejected()
+				raise gen.Return(False)
+
+			if CREDENTIALS_SESSION_COOKIE is not None:
+				handler.set_secure_cookie(CREDENTIALS_SESSION_COOKIE, credentials.cache.get_session_id(handler.credentials),
+				                          expires_days=None, httponly=True)
+			kwargs['basicauth_user'] = handler.credentials.username
+			raise gen.Return(True)
 
 		# Since we're going to attach this to a RequestHandler class,
 		# the first argument will wind up being a reference to an
 		# instance of that class.
+		@gen.coroutine
 		def _execute(self, transforms, *args, **kwargs):
-			if not require_basic_auth(self, kwargs):
-				return False
-			return handler_execute(self, transforms, *args, **kwargs)
+			self._transforms = transforms
+			authorized = yield require_basic_auth(self, kwargs)
+			if authorized:
+				yield handler_execute(self, transforms, *args, **kwargs)
 
 		return _execute
 
-	handler_class._execute = wrap_execute(handler_class._execute)
+	# The authentication is also part of the request timeline
+	handler_class._execute = in_request_context(wrap_execute(handler_class._execute))
 	return handler_class
 
 
@@ -0,0 +1,126 @@
+"""
+Module to serve the metrics of the server (see lib.metrics) in the Prometheus text format, with the statistics of the
+caches, the export files, the WebAccess scheduler and circuit breaker, and the DataLog decoder.
+"""
+from handlers.base import BaseHandler
+import logging
+from lib import credentials
+from lib import datalog
+from lib import datalog_decoder
+from lib import export_index
+from lib import export_jobs
+from lib import circuit_breaker
+from lib import metrics
+from lib import response_cache
+from lib import tag_metadata
+from lib import webaccess_client
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metrics read from the statistics of the other modules
+cache_hits = metrics.Counter("ushop_cache_hits_total", "Cache hits, by cache and tier", ('cache', 'tier'))
+cache_misses = metrics.Counter("ushop_cache_misses_total", "Cache misses, by cache and tier", ('cache', 'tier'))
+cache_hit_ratio = metrics.Gauge("ushop_cache_hit_ratio", "Fraction of the cache lookups that were hits",
+                                ('cache', 'tier'))
+cache_evictions = metrics.Counter("ushop_cache_evictions_total", "Entries evicted from the cache to stay in its limit",
+                                  ('cache',))
+cache_bytes = metrics.Gauge("ushop_cache_bytes", "Approximate size of the entries of the cache", ('cache',))
+export_jobs_gauge = metrics.Gauge("ushop_export_jobs", "Export jobs, by status", ('status',))
+export_files = metrics.Gauge("ushop_export_files", "Export files kept on disk")
+export_files_bytes = metrics.Gauge("ushop_export_files_bytes", "Size of the export files kept on disk")
+upstream_running = metrics.Gauge("ushop_upstream_running", "WebAccess requests being sent, by priority class",
+                                 ('priority_class',))
+upstream_queued = metrics.Gauge("ushop_upstream_queued", "WebAccess requests waiting for a slot, by priority class",
+                                ('priority_class',))
+upstream_queue_timeouts = metrics.Counter("ushop_upstream_queue_timeouts_total",
+                                          "WebAccess requests that timed out waiting for a slot")
+circuit_state = metrics.Gauge("ushop_upstream_circuit_state", "1 for the current state of the WebAccess circuit",
+                              ('state',))
+circuit_opens = metrics.Counter("ushop_upstream_circuit_opens_total", "Times the WebAccess circuit was opened")
+circuit_rejections = metrics.Counter("ushop_upstream_circuit_rejections_total",
+                                     "WebAccess requests failed right away because the circuit was open")
+decoded_bytes = metrics.Counter("ushop_datalog_decoded_bytes_total", "Bytes of GetDataLog responses decoded")
+decoded_values = metrics.Counter("ushop_datalog_decoded_values_total", "Values of GetDataLog responses decoded")
+decode_seconds = metrics.Counter("ushop_datalog_decode_seconds_total", "Time spent decoding GetDataLog responses")
+
+
+class MetricsHandler(BaseHandler):
+	"""
+	Handler to serve the metrics of the process in the Prometheus text format
+	"""
+
+	def data_received(self, chunk):
+		pass
+
+	def get(self):
+		self.set_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+		self.set_header("Cache-Control", "no-cache")
+		self.write(metrics.render())
+
+
+def set_cache_metrics(cache_name, tier, stats):
+	"""
+	Set the metrics of a cache from its statistics
+	:param cache_name: the name of the cache
+	:param tier: the tier of the cache, e.g. "local" or "shared"
+	:param stats: a dictionary with the number of hits and misses (and, for an LRUCache, evictions and bytes)
+	:return:
+	"""
+	lookups = stats['hits'] + stats['misses']
+	cache_hits.set(stats['hits'], cache_name, tier)
+	cache_misses.set(stats['misses'], cache_name, tier)
+	cache_hit_ratio.set(float(stats['hits']) / lookups if lookups else 0.0, cache_name, tier)
+	if 'evictions' in stats:
+		cache_evictions.set(stats['evictions'], cache_name)
+		cache_bytes.set(stats['bytes'], cache_name)
+
+
+def collect():
+	"""
+	Update the metrics read from the statistics of the other modules
+	:return:
+	"""
+	for cache in (datalog.cache, response_cache.cache):
+		stats = cache.stats()
+		set_cache_metrics(cache.name, "local", stats)
+		if 'shared' in stats:
+			set_cache_metrics(cache.name, "shared", stats['shared'])
+
+	credentials_stats = credentials.cache.stats()
+	set_cache_metrics("Credentials", "local", credentials_stats['credentials'])
+	set_cache_metrics("Sessions", "local", credentials_stats['sessions'])
+
+	tag_stats = tag_metadata.cache.stats()
+	set_cache_metrics("TagMetadata", "local", {'hits': tag_stats['hits'] + tag_stats['stale_hits'],
+	                                           'misses': tag_stats['misses']})
+
+	queue_stats = export_jobs.queue.stats()
+	export_jobs_gauge.set(queue_stats['queued'], "queued")
+	export_jobs_gauge.set(queue_stats['running'], "running")
+	index_stats = export_index.index.stats()
+	export_files.set(index_stats['files'])
+	export_files_bytes.set(index_stats['bytes'])
+
+	scheduler_stats = webaccess_client.scheduler.stats()
+	for priority_class, running in scheduler_stats['running'].items():
+		upstream_running.set(running, priority_class)
+	for priority_class, queued in scheduler_stats['queued'].items():
+		upstream_queued.set(queued, priority_class)
+	upstream_queue_timeouts.set(scheduler_stats['timeouts'])
+
+	if webaccess_client.breaker is not None:
+		breaker_stats = webaccess_client.breaker.stats()
+		for state in (circuit_breaker.STATE_CLOSED, circuit_breaker.STATE_OPEN, circuit_breaker.STATE_HALF_OPEN):
+			circuit_state.set(1 if breaker_stats['state'] == state else 0, state)
+		circuit_opens.set(breaker_stats['opens'])
+		circuit_rejections.set(breaker_stats['rejections'])
+
+	decoder_stats = datalog_decoder.stats()
+	decoded_bytes.set(decoder_stats['bytes'])
+	decoded_values.set(decoder_stats['values'])
+	decode_seconds.set(decoder_stats['seconds'])
+
+
+metrics.add_collector(collect)
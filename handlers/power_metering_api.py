@@ -3,23 +3,33 @@
 Module to handle access to the WebAccess web services. Includes SUSIAccessHandler and other necessary
 methods and classes.
 """
-import ast
 from calendar import monthrange
+import collections
+import functools
+import hashlib
 import json
 
 import logging
-import base64
 import datetime
-import random
 
+from tornado import gen
 from tornado import httpclient
 from tornado.httputil import HTTPHeaders
 from tornado.options import options
 
 from handlers.base import BaseHandler, callback
-from handlers.base import require_basic_auth, construct_error_json
+from handlers.base import require_basic_auth, construct_error_json, accepts_encoding
+from lib import admission
+from lib import aggregation
+from lib import credentials
+from lib import datalog
+from lib import export_formats
+from lib import export_jobs
+from lib import export_worker
+from lib import request_timing
+from lib import response_cache
+from lib import webaccess_client
 from settings import settings
-import webaccess
 
 # Global variables
 logger = logging.getLogger('ushop.' + __name__)
@@ -29,9 +39,17 @@ PROJECT_NAME = settings['PROJECT_NAME']
 NODE_NAME = settings['NODE_NAME']
 DATA_TYPE = settings['DATA_TYPE']
 WS_DATETIME_FORMAT = '%m/%d/%Y'  # The datetime format for power metering web service calls
-FILE_EXPORT_DATETIME_FORMAT = '%Y/%m/%d'
-FILE_EXPORT_TIME_FORMAT = '%H:%M'
 FILE_EXPORT_PATH = settings['FILE_EXPORT_PATH']
+HISTORY_MAX_AGE_SECONDS = settings['HISTORY_MAX_AGE_SECONDS']
+WA_DATALOG_CACHE_CURRENT_TTL_SECONDS = settings['WA_DATALOG_CACHE_CURRENT_TTL_SECONDS']
+HISTORY_ETAG_VERSION = 1  # Version of the history responses, to be incremented when their content changes
+# The date arguments of the history web services, whose responses are cached
+HISTORY_DATE_ARGUMENTS = {
+	'get_energy_consumption_history': ('date',),
+	'get_energy_consumption_history_comparison': ('date_1', 'date_2'),
+}
+TODAY_WS_NAME = 'get_energy_consumption_today'  # Cached like the day view of today, which is never closed
+TODAY_INTERVALS = (15, 30, 60)  # Intervals of the today responses computed in advance (see cache_today_responses)
 
 @require_basic_auth
 class PowerMeteringHandler(BaseHandler):
@@ -41,6 +59,8 @@ class PowerMeteringHandler(BaseHandler):
 
 	# Private attributes
 	_static_headers = HTTPHeaders({"content-type": "application/json; charset=utf-8"})
+	_file_streamed = False  # Whether a file has started to be streamed
+	_history_etag = None  # The ETag of a history response, known before computing it
 
 	def initialize(self):
 		for header in self._static_headers:
@@ -53,47 +73,204 @@ class PowerMeteringHandler(BaseHandler):
 	def write(self, chunk):
 		super(PowerMeteringHandler, self).write(chunk)
 
+	def stream_file(self, file_name, content_type, content_encoding, chunk):
+		"""
+		Send a chunk of a file to the client right away (with chunked transfer encoding). The headers are sent with
+		the first chunk, so the response has an X-Request-ID but no Server-Timing header.
+		:param file_name: the name of the file, to be saved by the client
+		:param content_type: the content type of the file
+		:param content_encoding: the encoding of the file (e.g. gzip), or None
+		:param chunk: the chunk of the file
+		:return: a Future that resolves when the chunk has been sent
+		"""
+		if not self._file_streamed:
+			self._file_streamed = True
+			if content_encoding is None:
+				self.set_header("content-type", content_type)
+			elif accepts_encoding(self.request, content_encoding):
+				self.set_header("content-type", content_type)
+				self.set_header("content-encoding", content_encoding)
+			else:  # Sent as a compressed file
+				self.set_header("content-type", "application/{0}".format(content_encoding))
+			self.set_header("content-disposition", 'attachment; filename="{0}"'.format(file_name))
+
+		super(PowerMeteringHandler, self).write(chunk)  # Not a Json result, so no JSONP callback
+		return self.flush()
+
+	def compute_etag(self):
+		if self._history_etag is not None:
+			return self._history_etag
+		return super(PowerMeteringHandler, self).compute_etag()
+
+	def write_response(self, response, gzip_accepted):
+		"""
+		Write a serialized response, compressed if the client accepts it. JSONP callbacks are wrapped around the
+		serialized (uncompressed) response.
+		:param response: the CachedResponse
+		:param gzip_accepted: whether the response can be sent compressed (see get_history_etag)
+		:return:
+		"""
+		if response.gzip_body is not None:
+			self.add_header("Vary", "Accept-Encoding")
+		if response.gzip_body is not None and gzip_accepted:
+			self.set_header("Content-Encoding", "gzip")
+			super(PowerMeteringHandler, self).write(response.gzip_body)  # Not wrapped in a JSONP callback
+		else:
+			self.write(response.body)
+
+	def set_history_cache_headers(self, closed):
+		"""
+		Set the Cache-Control header of a history response
+		:param closed: whether the whole range of the response is over (and settled), so the response never changes
+		:return:
+		"""
+		if closed:
+			# Browsers keep the response; shared caches may keep it too, but must revalidate it (with the credentials
+			# of each user) on every request, which is answered with a 304 without computing the response
+			self.set_header("Cache-Control", "max-age={0}, s-maxage=0".format(HISTORY_MAX_AGE_SECONDS))
+		else:
+			# The latest readings are only cached this long by the server too
+			self.set_header("Cache-Control", "private, max-age={0}".format(WA_DATALOG_CACHE_CURRENT_TTL_SECONDS))
+
+	def get_metrics_route(self):
+		return self.request.path[1:]  # The name of the web service, e.g. "get_energy_consumption_today"
+
+	def get_admission_priority(self):
+		# Revalidated and already serialized history responses are cheap, so they are never rejected
+		history_key, closed = get_history_key(self.request.path[1:], self.request.arguments)
+		if history_key is not None and ((closed and self.request.headers.get("If-None-Match") is not None) or
+		                                response_cache.cache.contains(history_key)):
+			return admission.PRIORITY_HIGH
+		return super(PowerMeteringHandler, self).get_admission_priority()
+
+	def write_overloaded(self, retry_after):
+		self.set_status(503)
+		self.set_header("Retry-After", retry_after)
+		self.write(json.dumps(construct_error_json("0007")))
+		self.finish()
+
+	def write_credentials_rejected(self):
+		self.write(json.dumps(construct_error_json("0005")))
+		self.finish()
+
+	@gen.coroutine
+	def forward_to_export_worker(self):
+		"""
+		Send the request to the export worker and write its response, which is already a Json result (wrapped in the
+		JSONP callback, if any). The credentials are sent in the Authorization header, since the sessions of this
+		process are unknown to the export worker.
+		"""
+		headers = {"Authorization": self.credentials.wa_headers["authorization"]}
+		if self.timeline is not None:  # The same correlation id in the logs of both processes
+			headers[request_timing.REQUEST_ID_HEADER] = self.timeline.request_id
+		try:
+			response = yield export_worker.forward(self.request.uri, headers)
+		except Exception, e:
+			logger.error(("Error forwarding the export request:", e), exc_info=True)
+			self.write(json.dumps(construct_error_json("0001")))
+			return
+
+		self.set_status(response.code)
+		for header in ("Content-Type", "Retry-After"):
+			if header in response.headers:
+				self.set_header(header, response.headers[header])
+		super(PowerMeteringHandler, self).write(response.body)
+
+	def write_credentials_unverified(self, retry_after):
+		self.set_status(503)
+		self.set_header("Retry-After", retry_after)
+		self.write(json.dumps(construct_error_json("0001")))
+		self.finish()
+
+	@gen.coroutine
 	def get(self, **kwargs):
 		"""
 		Fetches the required web service from the WebAccess server (or handler) and displays it as a Json object
 		:param ws_name: The name of the web service to fetch
 		:param params: The parameters for the web service
-		:param **kwargs: this includes the basicauth_user and basicauth_pass
+		:param **kwargs: this includes the basicauth_user
 		:return: the result of a web service in Json format
 		"""
 
-		# Basic user authentication (override)
-		wa_basicauth_user = kwargs.get('basicauth_user')
-		wa_basicauth_pass = kwargs.get('basicauth_pass')
-		wa_user_password_enc = base64.b64encode(wa_basicauth_user + ':' + wa_basicauth_pass)
-		wa_headers = HTTPHeaders({"authorization": "Basic {0}".format(wa_user_password_enc)})
+		# Basic user authentication (verified by require_basic_auth)
+		wa_headers = self.credentials.wa_headers
 
 		ws_name = self.request.path[1:]  # original path is like "/get_energy_consumption_today"
 		arguments = self.request.arguments
 
+		# The export jobs only exist in the export worker process
+		if is_export_job_ws(ws_name, arguments) and not export_worker.is_export_worker():
+			yield self.forward_to_export_worker()
+			return
+
+		# The responses of closed history ranges are identified by their arguments, so a client with the same
+		# response gets a 304 right away
+		history_key, closed = get_history_key(ws_name, arguments)
+		callback_name = self.get_argument('callback', None)
+		gzip_accepted = callback_name is None and accepts_encoding(self.request, "gzip")
+		if closed:
+			self._history_etag = get_history_etag(history_key, callback_name, gzip_accepted)
+			self.set_etag_header()
+			if self.check_etag_header():
+				self.set_history_cache_headers(closed)
+				self.set_status(304)
+				return
+
+		# History responses already serialized (even expired ones while the WebAccess server is down)
+		use_response_cache = history_key is not None and credentials.cache.is_verified(wa_headers)
+		if use_response_cache:
+			cached_response = response_cache.cache.get(history_key, webaccess_client.is_circuit_open())
+			if cached_response is not None:
+				self.set_history_cache_headers(closed)
+				self.write_response(cached_response, gzip_accepted)
+				return
+
 		try:
-			result = get_power_metering_ws(wa_headers, ws_name, arguments)
-		except httpclient.HTTPError, e:
-			if e.code == 401:  # Authentication error
+			result = yield get_power_metering_ws(wa_headers, ws_name, arguments, self.stream_file)
+		except Exception, e:
+			if self._file_streamed:  # The error can no longer be sent, so the client must see an incomplete file
+				logger.error(("Error streaming file:", e), exc_info=True)
+				self.request.connection.close()
+				return
+			elif isinstance(e, httpclient.HTTPError) and e.code == 401:  # Authentication error
 				result = construct_error_json("0005")
 			else:
 				result = construct_error_json("0001")
-		except Exception, e:
-				result = construct_error_json("0001")
+
+		if self._file_streamed:  # The result has already been sent
+			return
+
+		if history_key is not None:
+			if 'error_code' in result:  # Errors are not cached
+				self._history_etag = None
+				self.clear_header("Etag")
+			else:
+				self.set_history_cache_headers(closed)
+				with request_timing.phase("serialize"):
+					cached_response = response_cache.CachedResponse(json.dumps(result))
+				if use_response_cache:
+					response_cache.cache.put(history_key, cached_response, cached_response.size(),
+					                         None if closed else WA_DATALOG_CACHE_CURRENT_TTL_SECONDS)
+				self.write_response(cached_response, gzip_accepted)
+				return
 
 		# Convert result to JSON
-		result = json.dumps(result)
+		with request_timing.phase("serialize"):
+			result = json.dumps(result)
 
 		self.write(result)
 
 
-def get_power_metering_ws(wa_headers, ws_name, arguments):
+@gen.coroutine
+def get_power_metering_ws(wa_headers, ws_name, arguments, stream_file=None):
 	"""
 	Get a Power Metering web service
 	:param wa_headers: the headers to send to the WebAccess server
 	:param ws_name: the name of the web service to access
 	:param arguments: the URL arguments for the web service
-	:return: a dictionary with the requested web service information
+	:param stream_file: a function to stream files to the client, used by the export web service when the stream
+	argument is 1 (see PowerMeteringHandler.stream_file), default - None
+	:return: a dictionary with the requested web service information, or None if the result was streamed
 	"""
 
 	# Copy the headers
@@ -101,7 +278,9 @@ def get_power_metering_ws(wa_headers, ws_name, arguments):
 
 	try:
 		if ws_name == "get_power_meter":
-			return get_power_meter()
+			result = get_power_meter()
+		elif ws_name == "get_export_job_status":
+			result = get_export_job_status(arguments['job_id'][0])
 		# For all other web services
 		else:
 			# Common arguments
@@ -115,31 +294,114 @@ def get_power_metering_ws(wa_headers, ws_name, arguments):
 			interval = int(arguments['interval'][0])
 
 			if ws_name == "get_energy_consumption_today":
-				return get_energy_consumption_today(headers, power_meter_ids, interval)
+				result = yield get_energy_consumption_today(headers, power_meter_ids, interval)
 			elif ws_name == "get_energy_consumption_history":
 				date_string = arguments['date'][0]
 				date = datetime.datetime.strptime(date_string, WS_DATETIME_FORMAT)  # =d (d: mm/dd/yyyy represents the user selected date.)
 				data_range = arguments['datarange'][0]
-				return get_energy_consumption_history(headers, power_meter_ids, date, data_range, interval)
+				result = yield get_energy_consumption_history(headers, power_meter_ids, date, data_range, interval)
 			elif ws_name == "get_energy_consumption_history_export":
 				date_string = arguments['date'][0]
 				date = datetime.datetime.strptime(date_string, WS_DATETIME_FORMAT)  # =d (d: mm/dd/yyyy represents the user selected date.)
 				data_range = arguments['datarange'][0]
-				return get_energy_consumption_history_export(headers, power_meter_ids, date, data_range, interval)
+				export_format_name = arguments.get('format', ['csv'])[0]  # =f (f: csv, csv_gz, ndjson or binary)
+				stream = arguments.get('stream', ['0'])[0] == '1'  # =1 to download the file in the same request
+				result = yield get_energy_consumption_history_export(headers, power_meter_ids, date, data_range, interval,
+				                                                     export_format_name, stream_file if stream else None)
+			elif ws_name == "submit_energy_consumption_history_export":
+				date_string = arguments['date'][0]
+				date = datetime.datetime.strptime(date_string, WS_DATETIME_FORMAT)  # =d (d: mm/dd/yyyy represents the user selected date.)
+				data_range = arguments['datarange'][0]
+				export_format_name = arguments.get('format', ['csv'])[0]  # =f (f: csv, csv_gz, ndjson or binary)
+				if export_formats.get_export_format(export_format_name) is None:
+					result = construct_error_json("0006")
+				else:
+					job = submit_energy_consumption_history_export(headers, power_meter_ids, date, data_range,
+					                                               export_format_name)
+					result = get_export_job_status(job.id)
 			elif ws_name == "get_energy_consumption_history_comparison":
 				date_string1 = arguments['date_1'][0]
 				date1 = datetime.datetime.strptime(date_string1, WS_DATETIME_FORMAT)  # =d (d: mm/dd/yyyy represents the user selected date.)
 				date_string2 = arguments['date_2'][0]
 				date2 = datetime.datetime.strptime(date_string2, WS_DATETIME_FORMAT)  # =d (d: mm/dd/yyyy represents the user selected date.)
 				data_range = arguments['datarange'][0]
-				return get_energy_consumption_history_comparison(headers, power_meter_ids, date1, date2, data_range, interval)
+				result = yield get_energy_consumption_history_comparison(headers, power_meter_ids, date1, date2, data_range, interval)
 			else:
-				return construct_error_json("0004")
+				result = construct_error_json("0004")
 	except KeyError, e:
-		return construct_error_json("0003")
+		result = construct_error_json("0003")
 	except Exception, e:
 		raise e
 
+	raise gen.Return(result)
+
+
+def is_export_job_ws(ws_name, arguments):
+	"""
+	Check whether a web service submits, waits for or checks an export job (a streamed export does not use a job)
+	:param ws_name: the name of the web service
+	:param arguments: the URL arguments of the web service
+	:return: True if the web service uses an export job
+	"""
+	if ws_name == "get_energy_consumption_history_export":
+		return arguments.get('stream', ['0'])[0] != '1'
+	return ws_name in ("submit_energy_consumption_history_export", "get_export_job_status")
+
+
+def get_history_key(ws_name, arguments):
+	"""
+	Get the normalized arguments of a history web service (see HISTORY_DATE_ARGUMENTS) or of the today web service
+	(with the date of today), which identify its response
+	:param ws_name: the name of the web service
+	:param arguments: the URL arguments for the web service
+	:return: a tuple with the normalized arguments (without the JSONP callback), or None if the web service is not a
+	history web service or its arguments are not valid; and whether the whole range is over and settled, so that the
+	response never changes
+	"""
+
+	date_argument_names = HISTORY_DATE_ARGUMENTS.get(ws_name)
+	if date_argument_names is None and ws_name != TODAY_WS_NAME:
+		return None, False
+
+	try:
+		power_meter_ids = WA_TAG_NAME_MAP[int(arguments['power_meter_id'][0])]
+		interval = int(arguments['interval'][0])
+		if ws_name == TODAY_WS_NAME:
+			data_range = 'd'
+			dates = [datetime.datetime.combine(datetime.date.today(), datetime.time())]
+		else:
+			data_range = arguments['datarange'][0]
+			dates = [datetime.datetime.strptime(arguments[name][0], WS_DATETIME_FORMAT) for name in date_argument_names]
+	except (KeyError, IndexError, ValueError):
+		return None, False
+
+	closed = True
+	settled_time = datetime.datetime.now() - datetime.timedelta(minutes=datalog.TS_STORE_SETTLE_MINUTES)
+	for date in dates:
+		start_time, no_days = get_export_range(date, data_range)
+		if no_days == 0:
+			return None, False
+		closed = closed and start_time + datetime.timedelta(days=no_days) <= settled_time
+
+	if isinstance(power_meter_ids, str):
+		power_meter_ids = [power_meter_ids]
+	history_key = (PROJECT_NAME, NODE_NAME, DATA_TYPE, ws_name, tuple(power_meter_ids),
+	               tuple([date.strftime('%Y-%m-%d') for date in dates]), data_range, interval)
+	return history_key, closed
+
+
+def get_history_etag(history_key, callback_name, gzip_accepted):
+	"""
+	Get the ETag of the response of a closed history range, so that it is known before computing the response
+	:param history_key: the normalized arguments of the web service (see get_history_key)
+	:param callback_name: the JSONP callback the response is wrapped in, or None
+	:param gzip_accepted: whether the response is sent compressed (if large enough)
+	:return: a strong ETag like '"3f0a...c2"'
+	"""
+
+	etag_key = (HISTORY_ETAG_VERSION, history_key, callback_name, gzip_accepted)
+	return '"{0}"'.format(hashlib.sha1(repr(etag_key)).hexdigest())
+
 
 def get_power_meter():
 	"""
@@ -158,6 +420,7 @@ def get_power_meter():
 	return power_meter_dict
 
 
+@gen.coroutine
 def get_energy_consumption_today(wa_headers, power_meter_ids, interval):
 	"""
 	Function: B11 本日電量
@@ -186,9 +449,37 @@ def get_energy_consumption_today(wa_headers, power_meter_ids, interval):
 
 	# Date is today
 	now = datetime.datetime.now()
-	return get_energy_consumption_day(wa_headers, power_meter_ids, now, interval, values_key='energy_consumption_today')
+	energy_consumption_today = yield get_energy_consumption_day(wa_headers, power_meter_ids, now, interval,
+	                                                            values_key='energy_consumption_today')
+	raise gen.Return(energy_consumption_today)
 
 
+@gen.coroutine
+def cache_today_responses(wa_headers, ttl):
+	"""
+	Compute the responses of get_energy_consumption_today for every power meter at each of TODAY_INTERVALS, and put
+	them in the response cache, e.g. after the readings of today have been warmed
+	:param wa_headers: the headers to send to WebAccess, with verified credentials
+	:param ttl: the number of seconds the responses are cached
+	:return:
+	"""
+	history_keys = []
+	result_futures = []
+	for power_meter_id_index, power_meter_ids in enumerate(WA_TAG_NAME_MAP):
+		if isinstance(power_meter_ids, str):
+			power_meter_ids = [power_meter_ids]
+		for interval in TODAY_INTERVALS:
+			arguments = {'power_meter_id': [str(power_meter_id_index)], 'interval': [str(interval)]}
+			history_keys.append(get_history_key(TODAY_WS_NAME, arguments)[0])
+			result_futures.append(get_energy_consumption_today(wa_headers, power_meter_ids, interval))
+
+	results = yield result_futures
+	for history_key, result in zip(history_keys, results):
+		cached_response = response_cache.CachedResponse(json.dumps(result))
+		response_cache.cache.put(history_key, cached_response, cached_response.size(), ttl)
+
+
+@gen.coroutine
 def get_energy_consumption_history(wa_headers, power_meter_ids, date, data_range, interval):
 	"""
 	Function: B12-1 - 用電趨勢（日） & B12-2 - 用電趨勢（月）
@@ -225,16 +516,20 @@ def get_energy_consumption_history(wa_headers, power_meter_ids, date, data_range
 	"""
 
 	if data_range == 'd':  # day
-		return get_energy_consumption_day(wa_headers, power_meter_ids, date, interval,
-		                                  values_key='energy_consumption_day')
+		energy_consumption_history = yield get_energy_consumption_day(wa_headers, power_meter_ids, date, interval,
+		                                                              values_key='energy_consumption_day')
 	elif data_range == 'm':  # month
-		return get_energy_consumption_month(wa_headers, power_meter_ids, date, interval,
-		                                    values_key='energy_consumption_month')
+		energy_consumption_history = yield get_energy_consumption_month(wa_headers, power_meter_ids, date, interval,
+		                                                                values_key='energy_consumption_month')
 	else:
-		return construct_error_json("0006")
+		energy_consumption_history = construct_error_json("0006")
 
+	raise gen.Return(energy_consumption_history)
 
-def get_energy_consumption_history_export(wa_headers, power_meter_ids, date, data_range, interval):
+
+@gen.coroutine
+def get_energy_consumption_history_export(wa_headers, power_meter_ids, date, data_range, interval,
+                                          export_format_name='csv', stream_file=None):
 	"""
 	Function: B12-1 - 用電趨勢（日）匯出 & B12-2 - 用電趨勢（月）匯出
 	:param wa_headers: the headers to send to WebAccess
@@ -246,65 +541,191 @@ def get_energy_consumption_history_export(wa_headers, power_meter_ids, date, dat
 			=x (x: 15, 30, or 60, representing integer interval value (>0) with the unit of Minute.)
 		if data_range == m:
 			=x (x: 1, representing integer interval value (>0) with the unit of day.)
-	:return: a link to the file like:
+	:param export_format_name: the format of the file: csv, csv_gz, ndjson or binary (see lib.export_formats), default
+	- csv
+	:param stream_file: a function to stream the file to the client instead of writing it to FILE_EXPORT_PATH, called
+	with the file name, content type, content encoding and each chunk of the file, and returning a Future,
+	default - None
+	:return: a link to the file (of any format) like:
 		{ "csv_file_link": "http://host:port/static/exportfiles/XXXX.csv" }
+		or None if the file was streamed
 	"""
 
-	fixed_data_range = 'd'  # Data range will always be days
-	interval = 15  # Interval will always be 15 minutes
+	if export_formats.get_export_format(export_format_name) is None:
+		raise gen.Return(construct_error_json("0006"))
+
+	# Stream the file
+	if stream_file is not None:
+		start_time, no_days = get_export_range(date, data_range)
+		export_format = export_formats.get_export_format(export_format_name, flush_windows=True)
+		file_name = "energy_consumption_{0}{1}".format(start_time.strftime('%Y%m%d') if data_range == 'd'
+		                                                else start_time.strftime('%Y%m'), export_format.extension)
+		yield write_energy_consumption_export(wa_headers, power_meter_ids, start_time, no_days, export_format,
+		                                      functools.partial(stream_file, file_name, export_format.content_type,
+		                                                        export_format.content_encoding))
+		raise gen.Return(None)
+
+	# Or create it with an export job, and wait for it
+	job = submit_energy_consumption_history_export(wa_headers, power_meter_ids, date, data_range, export_format_name)
+	yield job.future
+	if job.status == export_jobs.STATUS_FAILED:
+		raise job.exception
+
+	# Create dictionary to return
+	export_dic = {'csv_file_link': "http://{0}:{1}/{2}".format(options.host, options.port, job.url_path)}
+	raise gen.Return(export_dic)
+
+
+def submit_energy_consumption_history_export(wa_headers, power_meter_ids, date, data_range, export_format_name='csv'):
+	"""
+	Submit an export job for B12-1 - 用電趨勢（日）匯出 & B12-2 - 用電趨勢（月）匯出
+	The file is named by the parameters of the export, so identical exports share the same job and file, and the file of
+	a range that is over (and settled) is reused.
+	:param wa_headers: the headers to send to WebAccess
+	:param power_meter_ids: list of power meters whose energy consumption will be checked
+	:param date: the date in which to retrieve the energy consumption data
+	:param data_range: =r (r: d (day) representing data range is a day, r: m (month) representing data range is a month).
+	:param export_format_name: the format of the file (see lib.export_formats), default - csv
+	:return: the ExportJob
+	"""
+
+	start_time, no_days = get_export_range(date, data_range)
+	extension = export_formats.get_export_format(export_format_name).extension
+	file_name = export_jobs.export_file_name(extension, PROJECT_NAME, NODE_NAME, DATA_TYPE, tuple(power_meter_ids),
+	                                         start_time.strftime('%Y-%m-%d'), no_days)
+	end_time = start_time + datetime.timedelta(days=no_days)
+	settled_time = datetime.datetime.now() - datetime.timedelta(minutes=datalog.TS_STORE_SETTLE_MINUTES)
+
+	run = functools.partial(_write_export_file, wa_headers, power_meter_ids, start_time, no_days, export_format_name)
+	return export_jobs.queue.submit(file_name, run, reusable=end_time <= settled_time)
+
+
+def get_export_job_status(job_id):
+	"""
+	Get the status of an export job
+	:param job_id: the id of the job, as returned by submit_energy_consumption_history_export
+	:return: the status of the job like:
+		{ "job_id": "1f3a...", "status": "running", "progress": 0.25 }
+		{ "job_id": "1f3a...", "status": "done", "progress": 1.0,
+		"csv_file_link": "http://host:port/static/exportfiles/XXXX.csv" }
+		{ "job_id": "1f3a...", "status": "failed", "progress": 0.5, "error_code": "0005" }
+	"""
+
+	job = export_jobs.queue.get(job_id)
+	if job is None:
+		return construct_error_json("0006")
+
+	job_status_dict = {'job_id': job.id, 'status': job.status, 'progress': round(job.progress, 3)}
+	if job.status == export_jobs.STATUS_DONE:
+		job_status_dict['csv_file_link'] = "http://{0}:{1}/{2}".format(options.host, options.port, job.url_path)
+	elif job.status == export_jobs.STATUS_FAILED:
+		authentication_error = isinstance(job.exception, httpclient.HTTPError) and job.exception.code == 401
+		job_status_dict['error_code'] = "0005" if authentication_error else "0001"
+
+	return job_status_dict
+
+
+def get_export_range(date, data_range):
+	"""
+	Get the range of days of an export
+	:param date: the date in which to retrieve the energy consumption data
+	:param data_range: d (day) or m (month)
+	:return: the datetime of the beginning of the first day, and the number of days (0 if data_range is not valid)
+	"""
 
-	energy_consumption_history_list = []
 	if data_range == 'd':
-		energy_consumption_history = get_energy_consumption_history(wa_headers, power_meter_ids, date, fixed_data_range,
-		                                                            interval)
-		energy_consumption_history_list.append(energy_consumption_history)
+		start_time = datetime.datetime(date.year, date.month, date.day)
+		no_days = 1
 	elif data_range == 'm':
+		start_time = datetime.datetime(date.year, date.month, day=1)
 		month_range = monthrange(date.year, date.month)
-		for day in range(1, month_range[1] + 1):
-			current_date = datetime.datetime(date.year, date.month, day=day)
-			energy_consumption_history = get_energy_consumption_history(wa_headers, power_meter_ids, current_date, fixed_data_range,
-		                                                            interval)
-			energy_consumption_history_list.append(energy_consumption_history)
-
-	# Create the file
-	random1 = random.randint(0, 9)
-	random2 = random.randint(0, 9)
-	random3 = random.randint(0, 9)
-	random4 = random.randint(0, 9)
-	file_name = "{0}{1}{2}{3}.csv".format(random1, random2, random3, random4)
-	file_directory = FILE_EXPORT_PATH
-	file_path = file_directory + '/' + file_name
-	csv_file = open(file_path, 'w')
+		no_days = month_range[1]
+	else:
+		start_time = datetime.datetime(date.year, date.month, date.day)
+		no_days = 0
+
+	return start_time, no_days
+
+
+@gen.coroutine
+def write_energy_consumption_export(wa_headers, power_meter_ids, start_time, no_days, export_format, write_chunk,
+                                    set_progress=None, executor=None):
+	"""
+	Write the export of the 15-minute energy consumption of a range of days, window by window
+	:param wa_headers: the headers to send to WebAccess
+	:param power_meter_ids: list of power meters whose energy consumption will be checked
+	:param start_time: the datetime of the beginning of the first day
+	:param no_days: the number of days
+	:param export_format: the format of the file (see lib.export_formats)
+	:param write_chunk: a function called with each chunk of the file, which may return a Future
+	:param set_progress: a function called with the fraction of the file already written, default - None
+	:param executor: an executor in which the windows are aggregated, formatted and compressed, one at a time, instead
+	of the IOLoop, default - None
+	:return:
+	"""
+
+	interval = datalog.BASE_INTERVAL  # Interval will always be 15 minutes
+	records = 24  # Records of each window, the same windows used by the day views
+	delta_hours = records / (60 / interval)
+
+	# The whole range is a single continuous series of windows, starting at the beginning of the first day
+	no_sets = no_days * 24 / delta_hours
+	window_start_times = [start_time + datetime.timedelta(hours=delta_hours * i) for i in range(0, no_sets)]
+
+	# Start retrieving all windows (from the local store, or fetched concurrently in as few requests as possible)
+	data_log_futures = collections.deque(datalog.start_base_windows(wa_headers, power_meter_ids, window_start_times,
+	                                                                DATA_TYPE))
+	window_start_times = collections.deque(window_start_times)
 
 	# File construction
-	# Headers
-	headers = "date,time,electricity consumption\n"
-	csv_file.write(headers)
+	# Headers (written with the first window, so nothing is sent before the first window is available)
+	chunks = [export_format.start(start_time, interval, power_meter_ids)]
 	# Data
-	# Reset date if data range is month
-	if data_range == 'm':
-		date = datetime.datetime(date.year, date.month, day=1)
-	for energy_consumption_history in energy_consumption_history_list:
-		for key in energy_consumption_history:
-			if isinstance(energy_consumption_history[key], list):
-				time_list = energy_consumption_history[key]
-				for data_dict in time_list:
-					for data_dict_key in data_dict:
-						data_list = data_dict[data_dict_key]
-						for data_point in data_list:
-							date_string = date.strftime(FILE_EXPORT_DATETIME_FORMAT)
-							time_string = date.strftime(FILE_EXPORT_TIME_FORMAT)
-							line = "{0},{1},{2}\n".format(date_string, time_string, data_point)
-							csv_file.write(line)
-							date += datetime.timedelta(minutes=interval)
-
-	csv_file.close()
+	# Each window is written as soon as it (and all the previous ones) are available, and then released
+	while data_log_futures:
+		window_tag_readings = yield data_log_futures.popleft()
+		if executor is None:
+			with request_timing.phase("aggregate"):
+				chunks.append(_format_export_window(export_format, power_meter_ids, window_start_times.popleft(),
+				                                    interval, window_tag_readings))
+		else:
+			chunk = yield executor.submit(_format_export_window, export_format, power_meter_ids,
+			                              window_start_times.popleft(), interval, window_tag_readings)
+			chunks.append(chunk)
+		yield _write_chunk(write_chunk, "".join(chunks))
+		chunks = []
+		if set_progress is not None:
+			set_progress(1 - float(len(data_log_futures)) / no_sets)
+	chunks.append(export_format.finish())
+	yield _write_chunk(write_chunk, "".join(chunks))
+
+
+def _format_export_window(export_format, power_meter_ids, window_start_time, interval, window_tag_readings):
+	"""
+	Add up the readings of a window of an export and format them
+	:return: the chunk of the file with the window
+	"""
+	totals = aggregation.sum_tags(aggregation.build_matrix(window_tag_readings, power_meter_ids))
+	return export_format.window(window_start_time, interval, totals, window_tag_readings)
 
-	# Create dictionary to return
-	export_dic = {'csv_file_link': "http://{0}:{1}/{2}".format(options.host, options.port, file_path)}
-	return export_dic
+
+@gen.coroutine
+def _write_export_file(wa_headers, power_meter_ids, start_time, no_days, export_format_name, job):
+	"""
+	Run an export job: write the export file to the temporary path of the job. The windows are formatted (and
+	compressed) and written in the export jobs thread pool, so a large export does not hold the IOLoop.
+	"""
+	export_file = open(job.temp_path, 'wb')
+	try:
+		yield write_energy_consumption_export(wa_headers, power_meter_ids, start_time, no_days,
+		                                      export_formats.get_export_format(export_format_name),
+		                                      export_jobs.write_file(export_file), job.set_progress,
+		                                      export_jobs.executor)
+	finally:
+		export_file.close()
 
 
+@gen.coroutine
 def get_energy_consumption_history_comparison(wa_headers, power_meter_ids, date1, date2, data_range, interval):
 	"""
 	Function: B13 - 用電比較 (日比較) & B14 - 用電比較 (月比較)
@@ -362,26 +783,25 @@ def get_energy_consumption_history_comparison(wa_headers, power_meter_ids, date1
 			}
 	"""
 
+	# Both dates are fetched concurrently
 	if data_range == 'd':  # day
 		values_key1 = 'energy_consumption_date_1'
 		values_key2 = 'energy_consumption_date_2'
-		energy_consumption1 = \
+		energy_consumption1, energy_consumption2 = yield [
 			get_energy_consumption_day(wa_headers, power_meter_ids, date1, interval,
-			                           values_key=values_key1, sum_key='sum_date_1')
-		energy_consumption2 = \
+			                           values_key=values_key1, sum_key='sum_date_1'),
 			get_energy_consumption_day(wa_headers, power_meter_ids, date2, interval,
-			                           values_key=values_key2, sum_key='sum_date_2')
+			                           values_key=values_key2, sum_key='sum_date_2')]
 	elif data_range == 'm':  # month
 		values_key1 = 'energy_consumption_month_1'
 		values_key2 = 'energy_consumption_month_2'
-		energy_consumption1 = \
+		energy_consumption1, energy_consumption2 = yield [
 			get_energy_consumption_month(wa_headers, power_meter_ids, date1, interval,
-			                             values_key=values_key1, sum_key='sum_month_1')
-		energy_consumption2 = \
+			                             values_key=values_key1, sum_key='sum_month_1'),
 			get_energy_consumption_month(wa_headers, power_meter_ids, date2, interval,
-			                             values_key=values_key2, sum_key='sum_month_2')
+			                             values_key=values_key2, sum_key='sum_month_2')]
 	else:
-		return construct_error_json("0006")
+		raise gen.Return(construct_error_json("0006"))
 
 	# Construct final Json object
 	energy_consumption_comparison = {}
@@ -390,9 +810,10 @@ def get_energy_consumption_history_comparison(wa_headers, power_meter_ids, date1
 	for key in energy_consumption2:
 		energy_consumption_comparison[key] = energy_consumption2[key]
 
-	return energy_consumption_comparison
+	raise gen.Return(energy_consumption_comparison)
 
 
+@gen.coroutine
 def get_energy_consumption_day(wa_headers, power_meter_ids, date, interval, **kwargs):
 	"""
 	Get energy consumption web service for a given date
@@ -427,50 +848,32 @@ def get_energy_consumption_day(wa_headers, power_meter_ids, date, interval, **kw
 	sum_key = kwargs.get('sum_key') if kwargs.get('sum_key') is not None else 'sum'
 
 	start_time = datetime.datetime(date.year, date.month, date.day)
-	start_time_string = start_time.strftime(webaccess.WA_DATETIME_FORMAT)
-	interval_type = 'M'  # interval type will always be minutes for a day's records
 	records = 24  # records will always be 24 for a day's records
 
-	# Get data logs depending on the interval
-	no_sets = 60 / interval
+	# The day values are rolled up from the 15-minute readings, so only multiples of 15 minutes can be used
+	if interval not in (15, 30, 60):
+		raise gen.Return(construct_error_json("0006"))
+
+	# Get the 15-minute readings of the whole day (stored, cached or fetched concurrently) and roll them up to the
+	# interval, the same way WebAccess aggregates them for the DataType
 	delta_hours = records / (60 / interval)
+	tag_readings = yield datalog.get_base_series(wa_headers, power_meter_ids, start_time, datalog.BASE_READINGS_PER_DAY,
+	                                             DATA_TYPE)
+	with request_timing.phase("aggregate"):
+		matrix = aggregation.build_matrix(tag_readings, power_meter_ids)
+		matrix = aggregation.rollup(matrix, interval / datalog.BASE_INTERVAL, DATA_TYPE)
+		day_values_list = aggregation.sum_tags(matrix)
+		sum = aggregation.to_number(aggregation.total(day_values_list))
+
+	# Split the day into windows
 	energy_consumption_dict = {values_key: []}
-	sum = 0
-	for i in range(0, no_sets):
-		# Call the data log web service:
-		# start_time - the starting time in the format YYYY-MM-DD HH:mm:ss
-		# interval_type - S (seconds), M (minutes), H (hours), D (days)
-		# interval - Date Time interval, unit as type
-		# records - number of records
-		# data_type - 0 (last), 1 (min), 2 (max), 3 (avg)
-		data_log_string = webaccess.get_data_log(wa_headers,
-		                                         PROJECT_NAME,
-		                                         NODE_NAME,
-		                                         tag_names=power_meter_ids,
-		                                         start_time=start_time_string,
-		                                         interval_type=interval_type,
-		                                         interval=interval,
-		                                         records=records,
-		                                         data_type=DATA_TYPE)
-
+	for i, window_values_list in enumerate(aggregation.split(day_values_list, records)):
 		# Build values list
 		result_values_dict = {}
-		result_values_list = [0] * records
-		data_log_dict = ast.literal_eval(data_log_string)  # Convert str object to dict
-		for data_log in data_log_dict['DataLog']:
-			data_log_values = data_log['Values']
-			j = 0
-			for data_log_string_value in data_log_values:
-				try:
-					value = int(data_log_string_value)
-				except ValueError:
-					value = 0
-				result_values_list[j] += value
-				sum += value
-				j += 1
+		result_values_list = [aggregation.to_number(value) for value in window_values_list]
 
 		# Build key
-		starting_hour = start_time.hour
+		starting_hour = delta_hours * i
 		ending_hour = starting_hour + delta_hours
 		term_key_prefix = "time"
 		term_key = "{0}_{1}_{2}".format(term_key_prefix, starting_hour, ending_hour)
@@ -480,16 +883,13 @@ def get_energy_consumption_day(wa_headers, power_meter_ids, date, interval, **kw
 
 		energy_consumption_dict[values_key].append(result_values_dict)
 
-		# Advance delta_hours
-		start_time += datetime.timedelta(hours=delta_hours)
-		start_time_string = start_time.strftime(webaccess.WA_DATETIME_FORMAT)
-
 	# Finally, place sum of all values
 	energy_consumption_dict[sum_key] = sum
 
-	return energy_consumption_dict
+	raise gen.Return(energy_consumption_dict)
 
 
+@gen.coroutine
 def get_energy_consumption_month(wa_headers, power_meter_ids, date, interval, **kwargs):
 	"""
 	Get energy consumption web service for a given month
@@ -510,64 +910,63 @@ def get_energy_consumption_month(wa_headers, power_meter_ids, date, interval, **
 	sum_key = kwargs.get('sum_key') if kwargs.get('sum_key') is not None else 'sum'
 
 	start_time = datetime.datetime(date.year, date.month, 1)
-	start_time_string = start_time.strftime(webaccess.WA_DATETIME_FORMAT)
-	interval_type = 'd'  # interval type will always be days for a month's records
 	records = 31  # records will always be 31 for a month's records
 
-	# Get data logs depending on the interval
-	no_sets = 1 / interval
+	# The month values are rolled up from the 15-minute readings, one value per day
+	if interval != 1:
+		raise gen.Return(construct_error_json("0006"))
+
+	# When the 15-minute readings of the whole month are stored or cached, they are rolled up to days, the same way
+	# WebAccess aggregates them for the DataType. Otherwise, a single daily GetDataLog request is cheaper for the
+	# WebAccess server than the 15-minute readings of the month (up to 4 requests of WA_MAX_RECORDS_PER_REQUEST).
 	delta_days = 30
+	readings_per_day = datalog.BASE_READINGS_PER_DAY
+	if datalog.has_base_series(wa_headers, power_meter_ids, start_time, records * readings_per_day, DATA_TYPE):
+		tag_readings = yield datalog.get_base_series(wa_headers, power_meter_ids, start_time,
+		                                             records * readings_per_day, DATA_TYPE)
+		factor = readings_per_day
+	else:
+		windows = yield datalog.start_data_log_windows(wa_headers, power_meter_ids, [start_time], 'D', interval, records,
+		                                               DATA_TYPE)
+		tag_readings = dict([(tag_name, windows[0][tag_name].readings() if tag_name in windows[0] else [None] * records)
+		                     for tag_name in power_meter_ids])
+		factor = 1
+	with request_timing.phase("aggregate"):
+		matrix = aggregation.build_matrix(tag_readings, power_meter_ids)
+		matrix = aggregation.rollup(matrix, factor, DATA_TYPE)
+		month_values_list = aggregation.sum_tags(matrix)
+		sum = aggregation.to_number(aggregation.total(month_values_list))
+
+	# Build values list
 	energy_consumption_dict = {values_key: []}
-	sum = 0
-	for i in range(0, no_sets):
-		# Call the data log web service:
-		# start_time - the starting time in the format YYYY-MM-DD HH:mm:ss
-		# interval_type - S (seconds), M (minutes), H (hours), D (days)
-		# interval - Date Time interval, unit as type
-		# records - number of records
-		# data_type - 0 (last), 1 (min), 2 (max), 3 (avg)
-		data_log_string = webaccess.get_data_log(wa_headers,
-		                                         PROJECT_NAME,
-		                                         NODE_NAME,
-		                                         tag_names=power_meter_ids,
-		                                         start_time=start_time_string,
-		                                         interval_type=interval_type,
-		                                         interval=interval,
-		                                         records=records,
-		                                         data_type=DATA_TYPE)
+	result_values_dict = {}
+	result_values_list = [aggregation.to_number(value) for value in month_values_list]
 
-		# Build values list
-		result_values_dict = {}
-		result_values_list = [0] * records
-		data_log_dict = ast.literal_eval(data_log_string)  # Convert str object to dict
-		for data_log in data_log_dict['DataLog']:
-			data_log_values = data_log['Values']
-			j = 0
-			for data_log_string_value in data_log_values:
-				try:
-					value = int(data_log_string_value)
-				except ValueError:
-					value = 0
-				result_values_list[j] += value
-				sum += value
-				j += 1
+	# Build key
+	starting_day = start_time.day
+	ending_day = starting_day + delta_days
+	time_key_prefix = "day"
+	time_key = "{0}_{1}_{2}".format(time_key_prefix, starting_day, ending_day)
 
-		# Build key
-		starting_day = start_time.day
-		ending_day = starting_day + delta_days
-		time_key_prefix = "day"
-		time_key = "{0}_{1}_{2}".format(time_key_prefix, starting_day, ending_day)
+	# Add value set to dictionary
+	result_values_dict[time_key] = result_values_list
 
-		# Add value set to dictionary
-		result_values_dict[time_key] = result_values_list
-
-		energy_consumption_dict[values_key].append(result_values_dict)
-
-		# Advance delta_hours
-		start_time += datetime.timedelta(days=delta_days)
-		start_time_string = start_time.strftime(webaccess.WA_DATETIME_FORMAT)
+	energy_consumption_dict[values_key].append(result_values_dict)
 
 	# Finally, place sum of all values
 	energy_consumption_dict[sum_key] = sum
 
-	return energy_consumption_dict
\ No newline at end of file
+	raise gen.Return(energy_consumption_dict)
+
+
+@gen.coroutine
+def _write_chunk(write_chunk, chunk):
+	"""
+	Write a chunk of a file, waiting until it has been written or sent if write_chunk returns a Future
+	:param write_chunk: the function to write the chunk, which may return a Future
+	:param chunk: the chunk of the file
+	:return:
+	"""
+	result = write_chunk(chunk)
+	if result is not None:
+		yield result
@@ -0,0 +1,48 @@
+"""
+Module to serve the stack-sampling profiler of the server (see lib.profiler) to the users in PROFILER_USERS.
+"""
+from handlers.base import BaseHandler, require_basic_auth
+import logging
+from tornado import gen
+import tornado.web
+from lib import profiler
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+PROFILER_USERS = settings['PROFILER_USERS']
+PROFILER_DEFAULT_SECONDS = 10
+PROFILER_DEFAULT_INTERVAL_MS = 10
+
+
+@require_basic_auth
+class ProfilerHandler(BaseHandler):
+	"""
+	Handler to profile the process for some seconds and return the collapsed stacks.
+	Arguments: seconds (default - 10) and interval_ms, the sampling interval (default - 10).
+	"""
+
+	def data_received(self, chunk):
+		pass
+
+	@gen.coroutine
+	def get(self, **kwargs):
+		if not self.credentials.verified or self.credentials.username not in PROFILER_USERS:
+			raise tornado.web.HTTPError(403)
+
+		try:
+			seconds = float(self.get_argument('seconds', PROFILER_DEFAULT_SECONDS))
+			interval = float(self.get_argument('interval_ms', PROFILER_DEFAULT_INTERVAL_MS)) / 1000
+		except ValueError:
+			raise tornado.web.HTTPError(400, "seconds and interval_ms must be numbers")
+		if seconds <= 0 or interval <= 0:
+			raise tornado.web.HTTPError(400, "seconds and interval_ms must be positive")
+		if profiler.is_running():
+			raise tornado.web.HTTPError(409, "A profile is already running")
+
+		logger.info("Profile requested by {0}".format(self.credentials.username))
+		sampler = yield profiler.profile(seconds, interval)
+		self.set_header("Content-Type", "text/plain; charset=utf-8")
+		self.set_header("Cache-Control", "no-cache")
+		self.set_header("X-Profile-Samples", sampler.samples)
+		self.write(sampler.collapsed())
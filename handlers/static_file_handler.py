@@ -1,12 +1,16 @@
-from handlers.base import BaseHandler
+from handlers.base import BaseHandler, accepts_encoding
 import logging
+import os
+import tornado.web
+from lib import export_formats
+from lib import export_index
+from lib import export_worker
 from settings import settings
-import urls
 
 logger = logging.getLogger('ushop.' + __name__)
 
 # Global variables
-FILE_EXPORT_PATH = settings['FILE_EXPORT_PATH']
+FILE_EXPORT_ROOT = settings['FILE_EXPORT_ROOT']
 
 class StaticFileHandlers(BaseHandler):
 
@@ -22,4 +26,60 @@ class StaticFileHandlers(BaseHandler):
 		Fetches the required file from the static path and serves it as a downloadable file
 		:param file_name: the name of the file that is going to be served
 		"""
-		pass
\ No newline at end of file
+		pass
+
+
+class ExportFileHandler(tornado.web.StaticFileHandler):
+
+	"""
+	Handler to serve the export files, with the content type of their export format.
+	Compressed files (e.g. .csv.gz) are served as they are stored: with their content encoding to clients that accept
+	it, or as a compressed file otherwise.
+	"""
+
+	def data_received(self, chunk):
+		pass
+
+	def get_content_type(self):
+		content_type, content_encoding = export_formats.get_file_type(self.absolute_path)
+		if content_type is None:
+			return super(ExportFileHandler, self).get_content_type()
+		elif content_encoding is not None and not accepts_encoding(self.request, content_encoding):
+			return "application/{0}".format(content_encoding)
+
+		return content_type
+
+	def set_extra_headers(self, path):
+		content_type, content_encoding = export_formats.get_file_type(self.absolute_path)
+		if content_encoding is not None:
+			self.set_header("Vary", "Accept-Encoding")
+			if accepts_encoding(self.request, content_encoding):
+				self.set_header("Content-Encoding", content_encoding)
+
+	def on_finish(self):
+		# Keep the downloaded files in the export file index the longest
+		absolute_path = getattr(self, 'absolute_path', None)  # Not set if the request failed before finding the file
+		if self.get_status() in (200, 206, 304) and absolute_path is not None and \
+				os.path.dirname(absolute_path) == FILE_EXPORT_ROOT:
+			export_worker.touch_export_file(os.path.basename(absolute_path))
+
+
+class ExportFileDownloadedHandler(tornado.web.RequestHandler):
+
+	"""
+	Handler of the export file downloads reported by the other worker processes to the export worker (only served on
+	EXPORT_WORKER_PORT, see export_worker.touch_export_file)
+	"""
+
+	def data_received(self, chunk):
+		pass
+
+	def check_xsrf_cookie(self):
+		pass  # Sent by the other worker processes, not by a browser
+
+	def post(self, file_name):
+		"""
+		Mark an export file as just downloaded in the export file index
+		:param file_name: the name of the file
+		"""
+		export_index.index.touch(file_name)
@@ -8,6 +8,8 @@ from tornado import httpclient
 from tornado.httputil import HTTPHeaders
 from tornado import escape
 from handlers.base import BaseHandler
+from lib import metrics
+from lib import request_timing
 from settings import settings
 import logging
 import base64
@@ -145,11 +147,14 @@ def get_sa_web_service(headers, ws_group, ws_name=None, param_list=None, format_
         return "error: wrong_ws_group"
 
     http_client = httpclient.HTTPClient()
+    ws_label = get_web_service_label(ws_group, ws_name)
     try:
-        http_request = httpclient.HTTPRequest(url, headers=headers)
-        response = http_client.fetch(http_request)
+        with metrics.Timer(metrics.upstream_duration, "susiaccess", ws_label), request_timing.phase("fetch"):
+            http_request = httpclient.HTTPRequest(url, headers=headers)
+            response = http_client.fetch(http_request)
     except httpclient.HTTPError, e:
         logger.error(("Error:", e), exc_info=True)
+        metrics.upstream_errors.inc("susiaccess", ws_label, e.code)
         raise e
     finally:
         http_client.close()
@@ -212,6 +217,7 @@ def post_sa_web_service(headers, ws_group, ws_name=None, data=None, format_xml=F
         return "error: wrong_ws_group"
 
     http_client = httpclient.HTTPClient()
+    ws_label = get_web_service_label(ws_group, ws_name)
     try:
         '''
         post_data = {'data': data}  # A dictionary of your post data
@@ -222,9 +228,11 @@ def post_sa_web_service(headers, ws_group, ws_name=None, data=None, format_xml=F
         '''
         req = urllib2.Request(url)
         req.headers = headers
-        response = urllib2.urlopen(req, data).read()
-    except httpclient.HTTPError, e:
+        with metrics.Timer(metrics.upstream_duration, "susiaccess", ws_label), request_timing.phase("fetch"):
+            response = urllib2.urlopen(req, data).read()
+    except (httpclient.HTTPError, urllib2.HTTPError), e:
         logger.error(("Error:", e), exc_info=True)
+        metrics.upstream_errors.inc("susiaccess", ws_label, e.code)
         raise e
     finally:
         http_client.close()
@@ -238,4 +246,14 @@ def post_sa_web_service(headers, ws_group, ws_name=None, data=None, format_xml=F
     else:
         result = response
 
-    return result, ws_group, ws_name
\ No newline at end of file
+    return result, ws_group, ws_name
+
+
+def get_web_service_label(ws_group, ws_name=None):
+    """
+    Get the name of a SUSIAccess web service for the metrics
+    :param ws_group: the web service group (already checked)
+    :param ws_name: the name of the web service (already checked), default - None
+    :return: the name, e.g. "apiinfomgmt/getencryptpwd" (without the parameters, which may be passwords)
+    """
+    return "{0}/{1}".format(ws_group.lower(), ws_name.lower() if ws_name is not None else "")
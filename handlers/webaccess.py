@@ -3,15 +3,19 @@ Module to handle access to the WebAccess web services. Includes SUSIAccessHandle
 methods and classes.
 """
 
-import urllib2
 from datetime import datetime
 from datetime import timedelta
+import functools
+from tornado import gen
 from tornado import httpclient
 from tornado.httputil import HTTPHeaders
 from handlers.base import BaseHandler, require_basic_auth
 import logging
 import base64
 from xml.etree import ElementTree
+from lib import tag_metadata
+from lib import webaccess_client
+from lib.single_flight import SingleFlight
 from settings import settings
 import json
 
@@ -20,6 +24,7 @@ logger = logging.getLogger('ushop.' + __name__)
 WA_ROOT_URL = settings['WA_ROOT_URL']
 WA_TAG_NAMES = settings['WA_TAG_NAMES'][0]
 WA_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # The datetime format required by WebAccess web services
+post_flights = SingleFlight("WebAccess POST")  # Identical POST requests in flight are only sent once
 
 
 @require_basic_auth
@@ -38,9 +43,13 @@ class WebAccessHandler(BaseHandler):
 	def initialize(self):
 		pass
 
+	def write_credentials_rejected(self):
+		self.send_error(status_code=401, reason="Wrong user name and/or password")
+
 	def data_received(self, chunk):
 		pass
 
+	@gen.coroutine
 	def get(self, ws_type, ws_name, params, trash, **kwargs):  # TODO: Get rid of the 'trash' parameter
 		"""
 		When using the get method, the WebAccessHandler fetches the required WebAccess web service and
@@ -49,7 +58,7 @@ class WebAccessHandler(BaseHandler):
 		:param ws_name: The name of the web service to fetch
 		:param params: The parameters for the web service
 		:param trash: Trash argument that appears for no reason
-		:param **kwargs: this includes the basicauth_user and basicauth_pass
+		:param **kwargs: this includes the basicauth_user
 		:return:
 		"""
 
@@ -65,14 +74,11 @@ class WebAccessHandler(BaseHandler):
 		if len(param_list) >= 1:
 			del param_list[0]  # First parameter is empty
 
-		# Basic user authentication (override)
-		wa_basicauth_user = kwargs['basicauth_user']
-		wa_basicauth_pass = kwargs['basicauth_pass']
-		wa_user_password_enc = base64.b64encode(wa_basicauth_user + ':' + wa_basicauth_pass)
-		self._wa_headers = HTTPHeaders({"authorization": "Basic {0}".format(wa_user_password_enc)})
+		# Basic user authentication (verified by require_basic_auth)
+		self._wa_headers = self.credentials.wa_headers
 
 		try:
-			result = get_wa_web_service(self._wa_headers, ws_name, param_list if param_list else None, get_json)
+			result = yield get_wa_web_service(self._wa_headers, ws_name, param_list if param_list else None, get_json)
 			if "error" not in result:
 				self.write(result)
 			else:
@@ -91,9 +97,10 @@ class WebAccessHandler(BaseHandler):
 		logger.info("testing __logon()...")
 
 
+@gen.coroutine
 def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True):
 	"""
-	Fetches a GET web service from the WebAccess url
+	Fetches a GET web service from the WebAccess url without blocking the IOLoop
 	:param original_headers: the original headers needed to make the request to the WebAccess server. This object
 	will be immutable, so its value will remain unchanged. These headers should be passed if another call to
 	this function or to post_wa_web_service() is performed.
@@ -122,7 +129,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# ProjectDetail
 	elif ws_name.lower() == "projectdetail":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "ProjectDetail"
 			project_name = param_list[0]
@@ -130,7 +137,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# NodeList
 	elif ws_name.lower() == "nodelist":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "NodeList"
 			project_name = param_list[0]
@@ -138,7 +145,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# NodeDetail
 	elif ws_name.lower() == "nodedetail":
 		if len(param_list) < 2:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "NodeDetail"
 			project_name = param_list[0]
@@ -147,7 +154,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# PortList
 	elif ws_name.lower() == "portlist":
 		if len(param_list) < 2:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "PortList"
 			project_name = param_list[0]
@@ -156,7 +163,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# PortDetail
 	elif ws_name.lower() == "portdetail":
 		if len(param_list) < 3:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "PortDetail"
 			project_name = param_list[0]
@@ -166,7 +173,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# DeviceList
 	elif ws_name.lower() == "devicelist":
 		if len(param_list) < 3:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "DeviceList"
 			project_name = param_list[0]
@@ -176,7 +183,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# DeviceDetail
 	elif ws_name.lower() == "devicedetail":
 		if len(param_list) < 4:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "DeviceDetail"
 			project_name = param_list[0]
@@ -187,7 +194,7 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# TagList (can have additional NODE_NAME, port_number, and device_name parameters)
 	elif ws_name.lower() == "taglist":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "TagList"
 			project_name = param_list[0]
@@ -204,48 +211,48 @@ def get_wa_web_service(original_headers, ws_name, param_list=None, get_json=True
 	# TagDetail
 	elif ws_name.lower() == "tagdetail":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			project_name = param_list[0]
-			response = get_tag_details(original_headers, project_name, get_json=get_json)
-			return response
+			response = yield get_tag_details(original_headers, project_name, get_json=get_json)
+			raise gen.Return(response)
 	# GetTagValue
 	elif ws_name.lower() == "gettagvalue":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			project_name = param_list[0]
-			response = get_tag_values(original_headers, project_name, WA_TAG_NAMES, get_json)
-			return response
+			response = yield get_tag_values(original_headers, project_name, WA_TAG_NAMES, get_json)
+			raise gen.Return(response)
 	# GetDataLog
 	elif ws_name.lower() == "getdatalog":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			project_name = param_list[0]
 			if len(param_list) > 1:
 				node_name = param_list[1]
 			else:
 				node_name = None
-			response = get_data_log(original_headers, project_name, node_name, WA_TAG_NAMES, get_json)
-			return response
+			response = yield get_data_log(original_headers, project_name, node_name, WA_TAG_NAMES, get_json)
+			raise gen.Return(response)
 	# Wrong web service name
 	else:
-		return "error: wrong_name"
+		raise gen.Return("error: wrong_name")
 
-	http_client = httpclient.HTTPClient()
 	try:
-		http_request = httpclient.HTTPRequest(url, headers=headers)
-		response = http_client.fetch(http_request)
+		response = yield webaccess_client.fetch(url, headers)
 	except httpclient.HTTPError, e:
 		logger.error(("Error:", e), exc_info=True)
 		raise e
-	finally:
-		http_client.close()
 
-	return response.body
+	if ws_name.lower() == "taglist" and len(param_list) == 1:  # All the Tags of the Project
+		_update_tag_metadata(tag_metadata.cache.put_tag_list, param_list[0], response, get_json)
+
+	raise gen.Return(response)
 
 
+@gen.coroutine
 def get_tag_values(original_headers, project_name, tag_names=None, get_json=True):
 	"""
 	This method calls a series of web services from the WebAccess in order to retrieve the Tag Values of a project.
@@ -284,7 +291,7 @@ def get_tag_values(original_headers, project_name, tag_names=None, get_json=True
 
 	# 1. Get TagList (names) for the given project
 	if tag_names is None:
-		tag_names = get_tag_names(original_headers, project_name, get_json)
+		tag_names = yield get_tag_names(original_headers, project_name, get_json)
 
 	# 2. Create POST request
 	if get_json:
@@ -315,11 +322,12 @@ def get_tag_values(original_headers, project_name, tag_names=None, get_json=True
 	# 3. Send POST request and get Tag Values
 	# post_wa_web_service(WA_ROOT_URL, original_headers, ws_name, slash_param_list=None, data=None, get_json=True)
 	response, ws_name = \
-		post_wa_web_service(original_headers, "GetTagValue", [project_name], request_body, get_json)
+		yield post_wa_web_service(original_headers, "GetTagValue", [project_name], request_body, get_json)
 
-	return response
+	raise gen.Return(response)
 
 
+@gen.coroutine
 def get_data_log(original_headers, project_name, node_name=None, tag_names=None, get_json=True, **kwargs):
 	"""
 	This method calls a series of web services from the WebAccess in order to retrieve the Data Log of the Tags
@@ -378,7 +386,7 @@ def get_data_log(original_headers, project_name, node_name=None, tag_names=None,
 
 	# 1. Get TagList (names) for the given project
 	if tag_names is None:
-		tag_names = get_tag_names(original_headers, project_name, get_json)
+		tag_names = yield get_tag_names(original_headers, project_name, get_json)
 
 	# 2. Create POST request
 	start_time = kwargs.get('start_time')
@@ -444,12 +452,17 @@ def get_data_log(original_headers, project_name, node_name=None, tag_names=None,
 	param_list = [project_name]
 	if node_name is not None:
 		param_list.append(node_name)
+	# The normalized request, so that concurrent identical requests are coalesced
+	request_key = ("getdatalog", project_name, node_name, tuple(tag_names), start_time, interval_type, str(interval),
+	               str(records), data_type, get_json)
 	response, ws_name = \
-		post_wa_web_service(original_headers, "GetDataLog", param_list, request_body, get_json)
+		yield post_wa_web_service(original_headers, "GetDataLog", param_list, request_body, get_json,
+		                          request_key=request_key)
 
-	return response
+	raise gen.Return(response)
 
 
+@gen.coroutine
 def get_tag_details(original_headers, project_name, tag_names=None, get_json=True):
 	"""
 	This method calls a series of web services from the WebAccess in order to retrieve the Tag Details of each
@@ -494,7 +507,7 @@ def get_tag_details(original_headers, project_name, tag_names=None, get_json=Tru
 
 	# 1. Get TagList (names) for the given project
 	if tag_names is None:
-		tag_names = get_tag_names(original_headers, project_name, get_json)
+		tag_names = yield get_tag_names(original_headers, project_name, get_json)
 
 	# 2. Define attribute name list
 	attribute_names = ['NAME', 'DESCRP', 'TYPE']
@@ -545,77 +558,57 @@ def get_tag_details(original_headers, project_name, tag_names=None, get_json=Tru
 	# 4. Send POST request and get Tag Details
 	# post_wa_web_service(WA_ROOT_URL, original_headers, ws_name, slash_param_list=None, data=None, get_json=True)
 	response, ws_name = \
-		post_wa_web_service(original_headers, "TagDetail", [project_name], request_body, get_json)
+		yield post_wa_web_service(original_headers, "TagDetail", [project_name], request_body, get_json)
+	_update_tag_metadata(tag_metadata.cache.put_tag_details, project_name, response, get_json)
 
-	return response
+	raise gen.Return(response)
 
 
+@gen.coroutine
 def get_tag_names(original_headers, project_name, get_json=True):
 	"""
 	Get a list of all Tag Names for the given project.
+	The Tags are kept in the Tag metadata cache, which is shared by the Json and XML web services, so the TagList
+	web service is only called when the Tags of the project are not cached (or have expired).
 	:param original_headers: the original headers needed to make the request to the WebAccess server. This object
 	will be immutable, so its value will remain unchanged. These headers should be passed if another call to
 	this function or to post_wa_web_service() is performed.
 	:param project_name: the name of the Project whose Tag names will be retrieved
-	:param get_json: whether to get the JSON web service (True) or the XML version (False), default - True
+	:param get_json: whether the caller uses the JSON web services (True) or the XML version (False), default - True.
+	The Tag names are the same for both.
 	:return: the list of tag names from the given project
 	"""
 
-	tag_list = get_wa_web_service(original_headers, "TagList", [project_name], get_json)
-	tag_names = []
-	# Check if it is Json or XML
-	if get_json:
-		# Json string will look like this:
-		# {
-		# "Result": {"Ret": 0, "Total": 2},
-		# "Tags":[
-		#       {
-		#       "Name": "kw",
-		#       "Description": "Description"
-		#       },
-		#       {
-		#       "Name": "kw1",
-		#       "Description": "Analog Output"
-		#       }
-		#   ]
-		# }
-		json_tag_list = json.loads(tag_list)
-		result = json_tag_list['Result']
-		total = int(result['Total'])
-		if total > 0:
-			for tag in json_tag_list['Tags']:
-				tag_names.append(tag['Name'])
-	else:
-		# XML string will look like this:
-		# <TagList xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
-		# <Result>
-		# <Ret>0</Ret>
-		#         <Total>2</Total>
-		#     </Result>
-		#     <Tags>
-		#         <Tag>
-		#             <Name>kw</Name>
-		#             <Description>Description</Description>
-		#         </Tag>
-		#         <Tag>
-		#             <Name>kw1</Name>
-		#             <Description>Analog Output</Description>
-		#         </Tag>
-		#     </Tags>
-		# </TagList>
-		xml_root = ElementTree.fromstring(tag_list)
-		result = xml_root.find('Result')
-		total = int(result.find('Total').text)
-		if total > 0:
-			for tag_name in xml_root.iter('Name'):
-				tag_names.append(tag_name.text)
-
-	return tag_names
-
-
-def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, get_json=True):
+	tags = yield tag_metadata.cache.get_tags(original_headers, project_name, _fetch_tag_list)
+	raise gen.Return([tag.name for tag in tags])
+
+
+def _fetch_tag_list(original_headers, project_name):
+	"""
+	Fetch the Json TagList web service of a Project, for the Tag metadata cache
+	:return: a Future with the web service result as a string object
 	"""
-	Fetches a POST web service from the WebAccess url. Returns a success or fail response.
+	headers = original_headers.copy()
+	headers.add("content-type", "application/json; charset=utf-8", )
+	return webaccess_client.fetch(WA_ROOT_URL + "Json/TagList/{0}".format(project_name), headers)
+
+
+def _update_tag_metadata(update, project_name, response, get_json):
+	"""
+	Update the Tag metadata cache with a TagList or TagDetail response. A response that cannot be parsed (e.g. an
+	error message) leaves the cache unchanged.
+	"""
+	try:
+		update(project_name, response, get_json)
+	except (ValueError, KeyError, TypeError, AttributeError, ElementTree.ParseError), e:
+		logger.debug("Tag metadata of Project {0} not updated: {1}".format(project_name, e))
+
+
+@gen.coroutine
+def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, get_json=True, request_key=None):
+	"""
+	Fetches a POST web service from the WebAccess url without blocking the IOLoop. Returns a success or fail response.
+	Concurrent identical requests (same credentials and same request key) share a single call to the WebAccess server.
 	:rtype : str, str
 	:param original_headers: the original headers needed to make the request to the WebAccess server. This object
 	will be immutable, so its value will remain unchanged. These headers should be passed if another call to
@@ -624,6 +617,8 @@ def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, g
 	:param param_list: the list of parameters for the web service being called, default - None
 	:param data: the data string for the POST request, default - None
 	:param get_json: whether to get the JSON web service (True) or the XML version (False), default - True
+	:param request_key: a hashable object identifying the normalized request, default - None (the web service name,
+	parameters, data and format are used)
 	:return the web service result as a string object
 	"""
 
@@ -640,7 +635,7 @@ def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, g
 	# TagDetail of given Project
 	if ws_name.lower() == "tagdetail":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "TagDetail"
 			project_name = param_list[0]
@@ -648,7 +643,7 @@ def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, g
 	# GetTagValue of Tags in given Project
 	elif ws_name.lower() == "gettagvalue":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "GetTagValue"
 			project_name = param_list[0]
@@ -656,7 +651,7 @@ def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, g
 	# GetTagValueText of Tags in given Project
 	elif ws_name.lower() == "gettagvaluetext":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "GetTagValueText"
 			project_name = param_list[0]
@@ -664,7 +659,7 @@ def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, g
 	# GetDataLog of Tags in given Project
 	elif ws_name.lower() == "getdatalog":
 		if len(param_list) < 1:
-			return "error: missing_parameters"
+			raise gen.Return("error: missing_parameters")
 		else:
 			url += "GetDataLog"
 			project_name = param_list[0]
@@ -674,19 +669,21 @@ def post_wa_web_service(original_headers, ws_name, param_list=None, data=None, g
 				url += "/{0}".format(node_name)
 	# Wrong web service name
 	else:
-		return "error: wrong_name"
+		raise gen.Return("error: wrong_name")
+
+	if request_key is None:
+		request_key = (ws_name.lower(), tuple(param_list), data, get_json)
+	flight_key = (original_headers.get("authorization"), request_key)
 
-	http_client = httpclient.HTTPClient()
 	try:
-		req = urllib2.Request(url)
-		req.headers = headers
-		response = urllib2.urlopen(req, data).read()
+		# All of these web services only read, so their requests can be hedged
+		response = yield post_flights.do(flight_key,
+		                                 functools.partial(webaccess_client.fetch, url, headers, method='POST', body=data,
+		                                                   idempotent=True))
 	except httpclient.HTTPError, e:
 		logger.error(("Error:", e), exc_info=True)
 		raise e
-	finally:
-		http_client.close()
 
 	result = response
 
-	return result, ws_name
\ No newline at end of file
+	raise gen.Return((result, ws_name))
\ No newline at end of file
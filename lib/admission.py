@@ -0,0 +1,90 @@
+"""
+Module with the admission control of the server: when the IOLoop lags behind or too many WebAccess requests are in
+flight, new requests are rejected right away with a 503 and a Retry-After header, instead of queueing until the clients
+time out (and retry). Each route has a priority (see ADMISSION_ROUTE_PRIORITIES): cheap requests are never rejected,
+and heavy ones (e.g. exports) are rejected first, at a fraction of the limits.
+"""
+import logging
+import random
+from lib import metrics
+from lib import watchdog
+from lib import webaccess_client
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+ADMISSION_MAX_LOOP_LAG_MS = settings['ADMISSION_MAX_LOOP_LAG_MS']
+ADMISSION_MAX_UPSTREAM_IN_FLIGHT = settings['ADMISSION_MAX_UPSTREAM_IN_FLIGHT']
+ADMISSION_LOW_PRIORITY_FRACTION = settings['ADMISSION_LOW_PRIORITY_FRACTION']
+ADMISSION_RETRY_AFTER_SECONDS = settings['ADMISSION_RETRY_AFTER_SECONDS']
+ADMISSION_ROUTE_PRIORITIES = settings['ADMISSION_ROUTE_PRIORITIES']
+
+# Route priorities
+PRIORITY_HIGH = 0  # Never rejected (cheap requests)
+PRIORITY_NORMAL = 1  # Rejected when the load is over the limits
+PRIORITY_LOW = 2  # Rejected first, when the load is over ADMISSION_LOW_PRIORITY_FRACTION of the limits
+
+# Rejection reasons
+REASON_LOOP_LAG = "loop_lag"
+REASON_UPSTREAM_BACKLOG = "upstream_backlog"
+
+shed_requests = metrics.Counter("ushop_shed_requests_total", "Requests rejected by the admission control",
+                                ('route', 'reason'))
+
+
+class AdmissionController(object):
+	"""
+	Class to decide whether a new request is admitted, from the lag of the IOLoop and the WebAccess requests in flight
+	"""
+
+	def __init__(self, max_loop_lag, max_upstream_in_flight, low_priority_fraction, retry_after):
+		"""
+		:param max_loop_lag: the maximum lag of the IOLoop in seconds, or None (no limit)
+		:param max_upstream_in_flight: the maximum number of WebAccess requests in flight, or None (no limit)
+		:param low_priority_fraction: the fraction of the limits at which low priority requests are rejected
+		:param retry_after: the number of seconds rejected clients are asked to wait (randomly up to twice as long, so
+		their retries are spread)
+		:return:
+		"""
+		self.max_loop_lag = max_loop_lag
+		self.max_upstream_in_flight = max_upstream_in_flight
+		self.low_priority_fraction = low_priority_fraction
+		self.retry_after = retry_after
+
+	def check(self, priority):
+		"""
+		Check whether a new request can be admitted
+		:param priority: the priority of the request (PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW)
+		:return: None if the request is admitted, or the reason of the rejection
+		"""
+		if priority == PRIORITY_HIGH:
+			return None
+
+		fraction = self.low_priority_fraction if priority == PRIORITY_LOW else 1.0
+		if self.max_loop_lag is not None and watchdog.get_loop_lag() > self.max_loop_lag * fraction:
+			return REASON_LOOP_LAG
+		if self.max_upstream_in_flight is not None and \
+				webaccess_client.in_flight > self.max_upstream_in_flight * fraction:
+			return REASON_UPSTREAM_BACKLOG
+		return None
+
+	def get_retry_after(self):
+		"""
+		Get the Retry-After of a rejected request
+		:return: a number of seconds
+		"""
+		return random.randint(self.retry_after, 2 * self.retry_after)
+
+
+def get_route_priority(route):
+	"""
+	Get the priority of a route
+	:param route: the name of the route (see BaseHandler.get_metrics_route)
+	:return: the priority in ADMISSION_ROUTE_PRIORITIES, or PRIORITY_NORMAL if the route is not listed
+	"""
+	return ADMISSION_ROUTE_PRIORITIES.get(route, PRIORITY_NORMAL)
+
+
+controller = AdmissionController(ADMISSION_MAX_LOOP_LAG_MS / 1000.0 if ADMISSION_MAX_LOOP_LAG_MS is not None else None,
+                                 ADMISSION_MAX_UPSTREAM_IN_FLIGHT, ADMISSION_LOW_PRIORITY_FRACTION,
+                                 ADMISSION_RETRY_AFTER_SECONDS)
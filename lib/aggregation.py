@@ -0,0 +1,136 @@
+"""
+Module to aggregate the 15-minute series of a set of Tags, kept as a matrix with a row of readings for each Tag:
+sums across Tags, rollups to longer intervals, totals and window splits.
+NumPy is used for vectorized operations when it is installed; otherwise, the same operations are done in Python.
+"""
+try:
+	import numpy
+except ImportError:  # Optional dependency
+	numpy = None
+from settings import settings
+
+# Global variables
+METER_VALUE_DECIMALS = settings['METER_VALUE_DECIMALS']
+
+
+def build_matrix(tag_readings, tag_names):
+	"""
+	Build the matrix of readings of a set of Tags
+	:param tag_readings: a dictionary with the list of readings of each Tag, where each reading is a float value or
+	None if missing. All the lists must have the same length.
+	:param tag_names: the names of the Tags, in the order of the rows of the matrix
+	:return: the matrix: a NumPy array where missing readings are NaN if NumPy is installed, or a list with the list of
+	readings of each Tag otherwise
+	"""
+	rows = [tag_readings[tag_name] for tag_name in tag_names]
+	if numpy is None:
+		return rows
+
+	return numpy.array(rows, dtype=numpy.float64)  # None becomes NaN
+
+
+def rollup(matrix, factor, data_type):
+	"""
+	Roll up each group of consecutive readings of each Tag into a single reading, the same way the WebAccess server
+	aggregates the values of a longer interval for the given DataType. Missing readings are ignored.
+	:param matrix: the matrix of readings (see build_matrix)
+	:param factor: the number of readings of each group, e.g. 4 for 60-minute values from 15-minute readings
+	:param data_type: 0 (last), 1 (min), 2 (max), 3 (avg)
+	:return: the matrix of rolled up readings, where a reading is missing if its whole group is missing
+	"""
+	if factor == 1:
+		return matrix
+	if numpy is None:
+		return [_rollup_row(row, factor, data_type) for row in matrix]
+
+	# Group the readings in a third dimension, padding the last group with missing readings
+	tags, readings = matrix.shape
+	groups = (readings + factor - 1) / factor
+	if groups * factor != readings:
+		padding = numpy.empty((tags, groups * factor - readings))
+		padding.fill(numpy.nan)
+		matrix = numpy.hstack((matrix, padding))
+	grouped = matrix.reshape(tags, groups, factor)
+	present = ~numpy.isnan(grouped)
+	counts = present.sum(axis=2)
+
+	if data_type == '0':  # last
+		last_indexes = factor - 1 - present[:, :, ::-1].argmax(axis=2)
+		rolled_up = grouped.reshape(-1, factor)[numpy.arange(tags * groups), last_indexes.ravel()].reshape(tags, groups)
+	elif data_type == '1':  # min
+		rolled_up = numpy.where(present, grouped, numpy.inf).min(axis=2)
+	elif data_type == '2':  # max
+		rolled_up = numpy.where(present, grouped, -numpy.inf).max(axis=2)
+	else:  # avg
+		rolled_up = numpy.where(present, grouped, 0).sum(axis=2) / numpy.maximum(counts, 1)
+	rolled_up[counts == 0] = numpy.nan
+
+	return rolled_up
+
+
+def sum_tags(matrix):
+	"""
+	Add up the readings of all the Tags, reading by reading. Missing readings count as 0.
+	:param matrix: the matrix of readings (see build_matrix)
+	:return: a list with the sum of each reading, as float values
+	"""
+	if numpy is None:
+		sums = [0.0] * (len(matrix[0]) if matrix else 0)
+		for row in matrix:
+			for j, reading in enumerate(row):
+				if reading is not None:
+					sums[j] += reading
+		return sums
+
+	return numpy.nansum(matrix, axis=0).tolist()
+
+
+def total(values):
+	"""
+	Add up a list of values
+	:param values: a list of float values, such as the result of sum_tags
+	:return: the sum of all values
+	"""
+	return sum(values)
+
+
+def to_number(value):
+	"""
+	Round a value to METER_VALUE_DECIMALS, so the floating point error of sums and averages (e.g. 305.40000000000003)
+	is not shown, and convert it to an int if it has no fractional part, so integral values are shown without decimals
+	:param value: a float value
+	:return: the value as an int or a float
+	"""
+	value = round(value, METER_VALUE_DECIMALS)
+	return int(value) if value == int(value) else value
+
+
+def split(values, size):
+	"""
+	Split a list of values into consecutive windows
+	:param values: the list of values
+	:param size: the number of values of each window
+	:return: a list with the list of values of each window
+	"""
+	return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def _rollup_row(readings, factor, data_type):
+	"""
+	Roll up the readings of a single Tag in Python (see rollup)
+	"""
+	rolled_up = []
+	for i in range(0, len(readings), factor):
+		group = [reading for reading in readings[i:i + factor] if reading is not None]
+		if not group:
+			rolled_up.append(None)
+		elif data_type == '0':  # last
+			rolled_up.append(group[-1])
+		elif data_type == '1':  # min
+			rolled_up.append(min(group))
+		elif data_type == '2':  # max
+			rolled_up.append(max(group))
+		else:  # avg
+			rolled_up.append(sum(group) / len(group))
+
+	return rolled_up
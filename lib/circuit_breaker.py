@@ -0,0 +1,92 @@
+"""
+Module with a circuit breaker for the requests to an upstream server (see webaccess_client.fetch).
+After failure_threshold consecutive failures (timeouts, connection errors or 5xx responses), the circuit opens and the
+requests fail right away instead of waiting for the server to time out. Every reset_timeout seconds, a single request
+is let through to probe the server: if it succeeds the circuit closes again, otherwise it stays open.
+"""
+import time
+
+# Circuit states
+STATE_CLOSED = "closed"  # Requests are sent
+STATE_OPEN = "open"  # Requests fail right away
+STATE_HALF_OPEN = "half_open"  # A probe request was sent, the others fail right away
+
+
+class CircuitBreaker(object):
+	"""
+	Class to stop sending requests to an upstream server that keeps failing, and to detect when it recovers
+	"""
+
+	def __init__(self, name, failure_threshold, reset_timeout):
+		"""
+		:param name: the name of the upstream server, e.g. for the logs
+		:param failure_threshold: the number of consecutive failures that open the circuit
+		:param reset_timeout: the number of seconds between the probes of an open circuit
+		:return:
+		"""
+		self.name = name
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.state = STATE_CLOSED
+		self.failures = 0  # Consecutive failures
+		self.opens = 0
+		self.rejections = 0
+		self._probe_time = None  # When the next probe can be sent, if the circuit is not closed
+
+	def allow_request(self):
+		"""
+		Check whether a request can be sent. When the circuit is not closed, it lets a probe request through every
+		reset_timeout seconds (so a probe that never reports back does not keep the circuit open forever).
+		:return: True if the request can be sent, False if it must fail right away
+		"""
+		if self.state == STATE_CLOSED:
+			return True
+
+		now = time.time()
+		if now >= self._probe_time:
+			self.state = STATE_HALF_OPEN
+			self._probe_time = now + self.reset_timeout
+			return True
+
+		self.rejections += 1
+		return False
+
+	def is_closed(self):
+		"""
+		:return: True if the requests are being sent normally
+		"""
+		return self.state == STATE_CLOSED
+
+	def record_success(self):
+		"""
+		Record a request that got a response from the server, which closes the circuit
+		:return:
+		"""
+		self.state = STATE_CLOSED
+		self.failures = 0
+		self._probe_time = None
+
+	def record_failure(self):
+		"""
+		Record a request that failed, which opens the circuit after failure_threshold consecutive failures (or right
+		away, if the circuit is not closed)
+		:return: True if the circuit was opened by this failure
+		"""
+		self.failures += 1
+		if self.state == STATE_CLOSED and self.failures < self.failure_threshold:
+			return False
+
+		opened = self.state == STATE_CLOSED
+		if opened:
+			self.opens += 1
+		self.state = STATE_OPEN
+		self._probe_time = time.time() + self.reset_timeout
+		return opened
+
+	def stats(self):
+		"""
+		Get the state of the circuit breaker
+		:return: a dictionary with the state, the consecutive failures, and the number of times the circuit was opened
+		and of requests rejected while open
+		"""
+		return {'state': self.state, 'failures': self.failures, 'opens': self.opens, 'rejections': self.rejections}
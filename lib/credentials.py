@@ -0,0 +1,210 @@
+"""
+Module to verify the credentials of the API users against the WebAccess server.
+The credentials of a Basic Authorization header are checked once with the WebAccess Logon web service, and the result
+is cached for CREDENTIALS_TTL_SECONDS (rejected credentials for CREDENTIALS_REJECTED_TTL_SECONDS), so that repeated
+requests neither decode the header again nor wait for WebAccess to find out that the credentials are wrong.
+The cache is keyed by a salted hash of the header, so the plaintext credentials are never used as keys. A verified user
+can also be given a session (a signed cookie), which identifies the cached credentials without the header.
+"""
+import base64
+import binascii
+import functools
+import hashlib
+import hmac
+import logging
+import os
+import uuid
+from tornado import gen
+from tornado import httpclient
+from tornado.httputil import HTTPHeaders
+from lib import webaccess_client
+from lib.lru_cache import LRUCache
+from lib.single_flight import SingleFlight
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+WA_ROOT_URL = settings['WA_ROOT_URL']
+CREDENTIALS_TTL_SECONDS = settings['CREDENTIALS_TTL_SECONDS']
+CREDENTIALS_REJECTED_TTL_SECONDS = settings['CREDENTIALS_REJECTED_TTL_SECONDS']
+CACHE_MAX_BYTES = 4 * 1024 * 1024  # Memory limit of the cached credentials and sessions
+ENTRY_BYTES = 512  # Approximate size of a cached entry
+REJECTED = False  # Value cached for rejected credentials
+
+
+class Credentials(object):
+	"""
+	Class with the verified credentials of a user, and the headers to send them to the WebAccess server
+	"""
+
+	def __init__(self, username, wa_headers, digest, verified=False):
+		"""
+		:param username: the user name
+		:param wa_headers: the HTTPHeaders with the authorization for the WebAccess server. They must not be modified
+		(copy them to add headers).
+		:param digest: the salted hash of the authorization
+		:param verified: whether the WebAccess server accepted the credentials, default - False
+		:return:
+		"""
+		self.username = username
+		self.wa_headers = wa_headers
+		self.digest = digest
+		self.verified = verified
+		self.session_id = None
+
+
+class CredentialCache(object):
+	"""
+	Class to verify credentials with the WebAccess server and cache the result
+	"""
+
+	def __init__(self, ttl, rejected_ttl):
+		"""
+		:param ttl: the number of seconds accepted credentials are cached
+		:param rejected_ttl: the number of seconds rejected credentials are cached
+		:return:
+		"""
+		self.ttl = ttl
+		self.rejected_ttl = rejected_ttl
+		self.logons = 0  # Number of Logon calls to the WebAccess server
+		self._salt = os.urandom(16)
+		self._cache = LRUCache("Credentials", CACHE_MAX_BYTES)  # Digest -> Credentials or REJECTED
+		self._sessions = LRUCache("Sessions", CACHE_MAX_BYTES)  # Session id -> digest
+		self._logon_flights = SingleFlight("Logon")
+
+	def digest(self, authorization):
+		"""
+		Get the salted hash of an authorization
+		:param authorization: the value of a Basic Authorization header
+		:return: a hexadecimal string
+		"""
+		return hmac.new(self._salt, authorization, hashlib.sha256).hexdigest()
+
+	@gen.coroutine
+	def authenticate(self, authorization):
+		"""
+		Verify the credentials of a Basic Authorization header, with the WebAccess Logon web service unless the result
+		is cached. Concurrent verifications of the same credentials share a single Logon call.
+		:param authorization: the value of the Authorization header, e.g. "Basic YWRtaW46"
+		:return: the Credentials, or None if the credentials are rejected
+		:raise HTTPError: if the WebAccess server could not verify the credentials (other than rejecting them)
+		"""
+		digest = self.digest(authorization)
+		cached = self._cache.get(digest)
+		if cached is REJECTED:
+			raise gen.Return(None)
+		elif cached is not None:
+			raise gen.Return(cached)
+
+		credentials = yield self._logon_flights.do(digest, functools.partial(self._logon, authorization, digest))
+		raise gen.Return(credentials)
+
+	def is_verified(self, wa_headers):
+		"""
+		Check whether the credentials of some WebAccess headers have been accepted by the WebAccess server
+		:param wa_headers: the headers with the authorization for the WebAccess server
+		:return: True if the credentials are cached as accepted
+		"""
+		cached = self._cache.get(self.digest(wa_headers.get("authorization", "")))
+		return cached is not None and cached is not REJECTED
+
+	def set_verified(self, wa_headers):
+		"""
+		Cache the credentials of some WebAccess headers as accepted, e.g. after a successful WebAccess request
+		:param wa_headers: the headers with the authorization for the WebAccess server
+		:return:
+		"""
+		authorization = wa_headers.get("authorization", "")
+		credentials = parse_authorization(authorization, self.digest(authorization))
+		if credentials is not None and not self.is_verified(wa_headers):
+			credentials.verified = True
+			self._cache.put(credentials.digest, credentials, ENTRY_BYTES, self.ttl)
+
+	def get_session_id(self, credentials):
+		"""
+		Get the session of verified credentials, creating it the first time. The session is valid while the
+		credentials are cached.
+		:param credentials: the Credentials
+		:return: the session id, to be sent to the client in a signed cookie
+		"""
+		if credentials.session_id is None:
+			credentials.session_id = uuid.uuid4().hex
+			self._sessions.put(credentials.session_id, credentials.digest, ENTRY_BYTES, self.ttl)
+		return credentials.session_id
+
+	def get_session(self, session_id):
+		"""
+		Get the credentials of a session
+		:param session_id: the session id
+		:return: the Credentials, or None if the session does not exist or its credentials are no longer cached
+		"""
+		digest = self._sessions.get(session_id)
+		if digest is None:
+			return None
+
+		cached = self._cache.get(digest)
+		return cached if cached is not REJECTED else None
+
+	def stats(self):
+		"""
+		Get the statistics of the cache
+		:return: a dictionary with the number of Logon calls, and the statistics of the credentials and sessions
+		"""
+		return {'logons': self.logons, 'credentials': self._cache.stats(), 'sessions': self._sessions.stats(),
+		        'logon_flights': self._logon_flights.stats()}
+
+	@gen.coroutine
+	def _logon(self, authorization, digest):
+		"""
+		Verify credentials with the WebAccess Logon web service, and cache the result
+		"""
+		credentials = parse_authorization(authorization, digest)
+		if credentials is None:  # Not valid Basic credentials, so WebAccess would reject them
+			self._cache.put(digest, REJECTED, ENTRY_BYTES, self.rejected_ttl)
+			raise gen.Return(None)
+
+		self.logons += 1
+		headers = credentials.wa_headers.copy()
+		headers.add("content-type", "application/json; charset=utf-8", )
+		try:
+			yield webaccess_client.fetch(WA_ROOT_URL + "Json/Logon", headers)
+		except httpclient.HTTPError, e:
+			if e.code != 401:
+				raise e
+			logger.debug("Credentials of user {0} rejected".format(credentials.username))
+			self._cache.put(digest, REJECTED, ENTRY_BYTES, self.rejected_ttl)
+			raise gen.Return(None)
+
+		credentials.verified = True
+		self._cache.put(digest, credentials, ENTRY_BYTES, self.ttl)
+		raise gen.Return(credentials)
+
+
+def basic_headers(username, password):
+	"""
+	Build the headers to send Basic credentials to the WebAccess server
+	:param username: the user name
+	:param password: the password
+	:return: the HTTPHeaders with the authorization
+	"""
+	return HTTPHeaders({"authorization": "Basic {0}".format(base64.b64encode(username + ':' + password))})
+
+
+def parse_authorization(authorization, digest=None):
+	"""
+	Decode a Basic Authorization header
+	:param authorization: the value of the Authorization header
+	:param digest: the salted hash of the authorization, default - None (credentials that are not cached)
+	:return: the Credentials (not verified), or None if the header does not have Basic credentials
+	"""
+	if not authorization.startswith('Basic '):
+		return None
+	try:
+		username, password = base64.b64decode(authorization[6:]).split(':', 1)
+	except (TypeError, binascii.Error, ValueError):
+		return None
+
+	return Credentials(username, basic_headers(username, password), digest)
+
+
+cache = CredentialCache(CREDENTIALS_TTL_SECONDS, CREDENTIALS_REJECTED_TTL_SECONDS)
@@ -0,0 +1,386 @@
+"""
+Module to retrieve the DataLog series of the power meter Tags from the WebAccess server.
+Every series is divided into fixed windows (for example, the 6-hour windows of a day at 15 minutes), which are
+cached per Tag. This way, the day views, the month exports and the comparisons share the windows they have in common,
+and only the missing windows are requested to the WebAccess server.
+The 15-minute readings are also kept in a local time series store, which is read before going to the cache or the
+WebAccess server. The readings are written to the store in a background thread, so the IOLoop never waits on the disk,
+and each settled reading is only written once.
+"""
+import datetime
+import functools
+import logging
+from tornado import gen
+from concurrent.futures import ThreadPoolExecutor
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from handlers import webaccess
+from lib import credentials
+from lib import datalog_decoder
+from lib.datalog_decoder import DataLogSeries
+from lib import export_planner
+from lib import webaccess_client
+from lib.lru_cache import LRUCache
+from lib.shared_cache import TieredCache
+from lib.timeseries_store import TimeSeriesStore, MISSING, SLOT_MINUTES
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+PROJECT_NAME = settings['PROJECT_NAME']
+NODE_NAME = settings['NODE_NAME']
+WA_MAX_RECORDS_PER_REQUEST = settings['WA_MAX_RECORDS_PER_REQUEST']
+WA_DATALOG_CACHE_MAX_MB = settings['WA_DATALOG_CACHE_MAX_MB']
+WA_DATALOG_CACHE_CURRENT_TTL_SECONDS = settings['WA_DATALOG_CACHE_CURRENT_TTL_SECONDS']
+TS_STORE_PATH = settings['TS_STORE_PATH']
+TS_STORE_SETTLE_MINUTES = settings['TS_STORE_SETTLE_MINUTES']
+INTERVAL_TYPE_MINUTES = {'M': 1, 'H': 60, 'D': 24 * 60}  # Minutes of each WebAccess interval type
+BASE_INTERVAL = SLOT_MINUTES  # Minutes of each reading of the base series
+BASE_WINDOW_RECORDS = 24  # Readings of each window of the base series (6 hours)
+BASE_READINGS_PER_DAY = 24 * 60 / BASE_INTERVAL  # Readings of the base series in a day
+STORED_WINDOWS_MAX_BYTES = 1024 * 1024  # Memory limit of the record of the readings written to the store
+STORED_WINDOW_ENTRY_BYTES = 128  # Approximate size of each entry of that record
+
+cache = TieredCache("DataLog", WA_DATALOG_CACHE_MAX_MB * 1024 * 1024, DataLogSeries.to_string,
+                    DataLogSeries.from_string)
+store = TimeSeriesStore(TS_STORE_PATH)
+store_executor = ThreadPoolExecutor(max_workers=1)  # The only thread writing to the store
+stored_windows = LRUCache("StoredWindows", STORED_WINDOWS_MAX_BYTES)  # (series, window start) -> readings written
+
+
+def start_data_log_windows(wa_headers, tag_names, window_start_times, interval_type, interval, records, data_type,
+                           refresh_ttl=None):
+	"""
+	Start retrieving the DataLog of the given Tags for a list of windows.
+	Cached windows are resolved right away (even expired ones, while the WebAccess circuit is open, since the server
+	cannot be reached to refresh them). Contiguous missing windows are merged into the fewest GetDataLog requests
+	allowed by WA_MAX_RECORDS_PER_REQUEST, which are sent concurrently.
+	:param wa_headers: the headers to send to WebAccess
+	:param tag_names: the names of the Tags whose Data Log will be retrieved
+	:param window_start_times: list with the starting datetime of each window, in order
+	:param interval_type: S (seconds), M (minutes), H (hours), D (days)
+	:param interval: Date Time interval, unit as type
+	:param records: number of records of each window
+	:param data_type: 0 (last), 1 (min), 2 (max), 3 (avg)
+	:param refresh_ttl: if given, the windows that are not over yet are fetched again even if they are cached, and
+	cached for refresh_ttl seconds instead of WA_DATALOG_CACHE_CURRENT_TTL_SECONDS, default - None
+	:return: a list with one Future for each window, in the same order as the given windows. The result of each Future
+	is a dictionary with the DataLogSeries of each Tag in the window.
+	"""
+
+	interval_minutes = interval * INTERVAL_TYPE_MINUTES[interval_type.upper()]
+	window_duration = datetime.timedelta(minutes=interval_minutes * records)
+	use_cache = credentials.cache.is_verified(wa_headers)
+	now = datetime.datetime.now()
+	current_ttl = refresh_ttl if refresh_ttl is not None else WA_DATALOG_CACHE_CURRENT_TTL_SECONDS
+	stale = webaccess_client.is_circuit_open()
+
+	# 1. Resolve the cached windows, and group the missing ones into runs of contiguous windows
+	window_futures = [Future() for _ in window_start_times]
+	missing_runs = []
+	for index, window_start_time in enumerate(window_start_times):
+		window_tag_values = None
+		if use_cache and (refresh_ttl is None or stale or window_start_time + window_duration <= now):
+			window_tag_values = _get_cached_window(tag_names, window_start_time, interval_type, interval, records,
+			                                       data_type, stale)
+		if window_tag_values is not None:
+			window_futures[index].set_result(window_tag_values)
+		elif missing_runs and missing_runs[-1][-1] == index - 1 and \
+				window_start_times[index - 1] + window_duration == window_start_time:
+			missing_runs[-1].append(index)
+		else:
+			missing_runs.append([index])
+
+	# 2. Plan the requests for each run of missing windows (each request covers a whole number of windows)
+	max_records = max(WA_MAX_RECORDS_PER_REQUEST / records, 1) * records
+	request_windows = []
+	data_log_tasks = []
+	for missing_run in missing_runs:
+		run_start_time = window_start_times[missing_run[0]]
+		data_log_requests = export_planner.plan_data_log_requests(run_start_time, len(missing_run) * records,
+		                                                          interval_minutes, max_records)
+		for request_start_time, request_records in data_log_requests:
+			request_window_indexes = missing_run[:request_records / records]
+			missing_run = missing_run[request_records / records:]
+			request_windows.append(request_window_indexes)
+			data_log_tasks.append(functools.partial(_fetch_windows, wa_headers, tag_names,
+			                                        [window_start_times[i] for i in request_window_indexes],
+			                                        interval_type, interval, records, data_type, current_ttl))
+
+	# 3. Send the requests concurrently, and resolve their windows when each request is done
+	request_futures = webaccess_client.start_tasks(data_log_tasks)
+	for request_window_indexes, request_future in zip(request_windows, request_futures):
+		request_future.add_done_callback(functools.partial(_resolve_windows, request_window_indexes, window_futures))
+
+	return window_futures
+
+
+def start_base_windows(wa_headers, tag_names, window_start_times, data_type, refresh_ttl=None):
+	"""
+	Start retrieving the 15-minute readings of the given Tags for a list of base windows (BASE_WINDOW_RECORDS readings
+	each, aligned to the beginning of the day).
+	Windows found in the local store are resolved right away. The rest are retrieved with start_data_log_windows, and
+	their settled readings (older than TS_STORE_SETTLE_MINUTES) are written to the store.
+	:param wa_headers: the headers to send to WebAccess
+	:param tag_names: the names of the Tags whose readings will be retrieved
+	:param window_start_times: list with the starting datetime of each window, in order
+	:param data_type: 0 (last), 1 (min), 2 (max), 3 (avg)
+	:param refresh_ttl: see start_data_log_windows, default - None
+	:return: a list with one Future for each window, in the same order as the given windows. The result of each Future
+	is a dictionary with the list of readings of each Tag in the window, where each reading is a float value or None
+	if the reading is missing.
+	"""
+
+	use_store = credentials.cache.is_verified(wa_headers)
+
+	# 1. Resolve the windows found in the store
+	window_futures = [Future() for _ in window_start_times]
+	missing_window_indexes = []
+	for index, window_start_time in enumerate(window_start_times):
+		window_tag_readings = None
+		if use_store:
+			window_tag_readings = _get_stored_window(tag_names, window_start_time, data_type)
+		if window_tag_readings is not None:
+			window_futures[index].set_result(window_tag_readings)
+		else:
+			missing_window_indexes.append(index)
+
+	# 2. Retrieve the rest from the cache or the WebAccess server
+	data_log_futures = start_data_log_windows(wa_headers, tag_names,
+	                                          [window_start_times[i] for i in missing_window_indexes],
+	                                          'M', BASE_INTERVAL, BASE_WINDOW_RECORDS, data_type, refresh_ttl)
+	for index, data_log_future in zip(missing_window_indexes, data_log_futures):
+		data_log_future.add_done_callback(functools.partial(_store_window, window_start_times[index], data_type,
+		                                                    window_futures[index]))
+
+	return window_futures
+
+
+def has_base_series(wa_headers, tag_names, start_time, readings, data_type):
+	"""
+	Check whether the 15-minute readings of the given Tags for a range of time are all in the store or the cache, so
+	they can be rolled up without any request to the WebAccess server
+	:param wa_headers: the headers to send to WebAccess
+	:param tag_names: the names of the Tags
+	:param start_time: the datetime of the first reading, aligned to a base window (e.g. the beginning of a day)
+	:param readings: the number of readings
+	:param data_type: 0 (last), 1 (min), 2 (max), 3 (avg)
+	:return: True if every base window of the range is stored or cached
+	"""
+	if not credentials.cache.is_verified(wa_headers):
+		return False
+
+	window_duration = datetime.timedelta(minutes=BASE_INTERVAL * BASE_WINDOW_RECORDS)
+	for i in range(0, (readings + BASE_WINDOW_RECORDS - 1) / BASE_WINDOW_RECORDS):
+		window_start_time = start_time + window_duration * i
+		if _get_stored_window(tag_names, window_start_time, data_type) is None and \
+				not all(cache.contains(_window_key(tag_name, window_start_time, 'M', BASE_INTERVAL, BASE_WINDOW_RECORDS,
+				                                   data_type)) for tag_name in tag_names):
+			return False
+
+	return True
+
+
+def get_base_window_start_time(reading_time):
+	"""
+	Get the start of the base window containing a time
+	:param reading_time: the datetime
+	:return: the starting datetime of the window (windows are aligned to the beginning of the day)
+	"""
+	day_start_time = datetime.datetime.combine(reading_time.date(), datetime.time())
+	window_minutes = BASE_INTERVAL * BASE_WINDOW_RECORDS
+	minutes = (reading_time - day_start_time).seconds // 60
+	return day_start_time + datetime.timedelta(minutes=minutes - minutes % window_minutes)
+
+
+@gen.coroutine
+def get_base_series(wa_headers, tag_names, start_time, readings, data_type, refresh_ttl=None):
+	"""
+	Get the 15-minute readings of the given Tags for a range of time (see start_base_windows)
+	:param wa_headers: the headers to send to WebAccess
+	:param tag_names: the names of the Tags whose readings will be retrieved
+	:param start_time: the datetime of the first reading, aligned to a base window (e.g. the beginning of a day)
+	:param readings: the number of readings
+	:param data_type: 0 (last), 1 (min), 2 (max), 3 (avg)
+	:param refresh_ttl: see start_data_log_windows, default - None
+	:return: a dictionary with the list of readings of each Tag, where each reading is a float value or None if the
+	reading is missing
+	"""
+
+	window_duration = datetime.timedelta(minutes=BASE_INTERVAL * BASE_WINDOW_RECORDS)
+	no_windows = (readings + BASE_WINDOW_RECORDS - 1) / BASE_WINDOW_RECORDS
+	window_start_times = [start_time + window_duration * i for i in range(0, no_windows)]
+	windows = yield start_base_windows(wa_headers, tag_names, window_start_times, data_type, refresh_ttl)
+
+	# Concatenate the windows of each Tag
+	tag_readings = {}
+	for tag_name in tag_names:
+		series = []
+		for window_tag_readings in windows:
+			series.extend(window_tag_readings.get(tag_name, [None] * BASE_WINDOW_RECORDS))
+		tag_readings[tag_name] = series[:readings]
+
+	raise gen.Return(tag_readings)
+
+
+@gen.coroutine
+def _fetch_windows(wa_headers, tag_names, window_start_times, interval_type, interval, records, data_type,
+                   current_ttl):
+	"""
+	Fetch a series of contiguous windows with a single GetDataLog request, and cache each window
+	:return: a list with a dictionary for each window, with the DataLogSeries of each Tag in the window
+	"""
+
+	start_time_string = window_start_times[0].strftime(webaccess.WA_DATETIME_FORMAT)
+	data_log_string = yield webaccess.get_data_log(wa_headers,
+	                                               PROJECT_NAME,
+	                                               NODE_NAME,
+	                                               tag_names=tag_names,
+	                                               start_time=start_time_string,
+	                                               interval_type=interval_type,
+	                                               interval=interval,
+	                                               records=len(window_start_times) * records,
+	                                               data_type=data_type)
+	credentials.cache.set_verified(wa_headers)
+
+	# Split the values of each Tag into the windows
+	windows = [{} for _ in window_start_times]
+	for tag_name, tag_series in datalog_decoder.decode_data_log(data_log_string).items():
+		for i, window_tag_values in enumerate(windows):
+			window_tag_values[tag_name] = tag_series.slice(i * records, (i + 1) * records)
+
+	# Cache the windows
+	now = datetime.datetime.now()
+	window_duration = datetime.timedelta(minutes=interval * INTERVAL_TYPE_MINUTES[interval_type.upper()] * records)
+	for window_start_time, window_tag_values in zip(window_start_times, windows):
+		# Windows fully in the past never change; windows touching "now" are only valid for a short time
+		ttl = current_ttl if window_start_time + window_duration > now else None
+		for tag_name, tag_series in window_tag_values.items():
+			key = _window_key(tag_name, window_start_time, interval_type, interval, records, data_type)
+			cache.put(key, tag_series, tag_series.size(), ttl)
+
+	raise gen.Return(windows)
+
+
+def _resolve_windows(window_indexes, window_futures, request_future):
+	"""
+	Resolve the Futures of the windows covered by a finished request
+	:param window_indexes: the indexes of the windows covered by the request
+	:param window_futures: the Futures of all the windows
+	:param request_future: the finished request Future
+	:return:
+	"""
+	if request_future.exception() is not None:
+		for window_index in window_indexes:
+			window_futures[window_index].set_exc_info(request_future.exc_info())
+	else:
+		for window_index, window_tag_values in zip(window_indexes, request_future.result()):
+			window_futures[window_index].set_result(window_tag_values)
+
+
+def _store_window(window_start_time, data_type, window_future, data_log_future):
+	"""
+	Convert a base window retrieved from the cache or the WebAccess server into readings, resolve the Future of the
+	window and write its settled readings to the store (in the thread of store_executor). Only the readings settled
+	since the last write of the window are written, so a window that is not over yet and keeps being served from the
+	cache does not write the same readings again.
+	:param window_start_time: the starting datetime of the window
+	:param data_type: 0 (last), 1 (min), 2 (max), 3 (avg)
+	:param window_future: the Future of the window
+	:param data_log_future: the finished Future with the DataLogSeries of each Tag in the window
+	:return:
+	"""
+	if data_log_future.exception() is not None:
+		window_future.set_exc_info(data_log_future.exc_info())
+		return
+
+	settled_time = datetime.datetime.now() - datetime.timedelta(minutes=TS_STORE_SETTLE_MINUTES)
+	settled_readings = (settled_time - window_start_time).total_seconds() // (BASE_INTERVAL * 60)
+	settled_readings = int(min(max(settled_readings, 0), BASE_WINDOW_RECORDS))
+
+	window_tag_readings = {}
+	settled_tag_readings = {}
+	for tag_name, tag_series in data_log_future.result().items():
+		readings = tag_series.readings()
+		window_tag_readings[tag_name] = readings
+		key = (_series(tag_name, data_type), window_start_time)
+		written_readings = stored_windows.get(key) or 0
+		if settled_readings > written_readings:
+			stored_windows.put(key, settled_readings, STORED_WINDOW_ENTRY_BYTES)
+			new_readings = readings[written_readings:settled_readings]
+			settled_tag_readings[tag_name] = (written_readings, [MISSING if reading is None else reading
+			                                                     for reading in new_readings])
+
+	window_future.set_result(window_tag_readings)
+	if settled_tag_readings:
+		store_executor.submit(_write_stored_window, settled_tag_readings, window_start_time, data_type,
+		                      IOLoop.current())
+
+
+def _write_stored_window(tag_readings, window_start_time, data_type, io_loop):
+	"""
+	Write the readings of a base window to the store. If a write fails, the readings of the window are forgotten in
+	stored_windows (in the IOLoop), so they are written again the next time the window is retrieved.
+	:param tag_readings: a dictionary with the index of the first reading and the list of readings of each Tag, where
+	each reading is a float value or MISSING
+	:param window_start_time: the starting datetime of the window
+	:param data_type: 0 (last), 1 (min), 2 (max), 3 (avg)
+	:param io_loop: the IOLoop owning stored_windows
+	:return:
+	"""
+	for tag_name, (first_reading, readings) in tag_readings.items():
+		series = _series(tag_name, data_type)
+		try:
+			store.write(series, window_start_time + datetime.timedelta(minutes=BASE_INTERVAL * first_reading),
+			            readings)
+		except (IOError, OSError), e:
+			logger.error(("Error writing to the time series store:", e), exc_info=True)
+			io_loop.add_callback(stored_windows.delete, (series, window_start_time))
+
+
+def _get_stored_window(tag_names, window_start_time, data_type):
+	"""
+	Get a base window from the store
+	:return: a dictionary with the list of readings of each Tag in the window, or None if any reading is not stored
+	"""
+	window_tag_readings = {}
+	for tag_name in tag_names:
+		readings = store.read(_series(tag_name, data_type), window_start_time, BASE_WINDOW_RECORDS)
+		if None in readings:
+			return None
+		window_tag_readings[tag_name] = [None if reading is MISSING else reading for reading in readings]
+
+	return window_tag_readings
+
+
+def _series(tag_name, data_type):
+	"""
+	Build the identifier of the stored series of a Tag
+	"""
+	return PROJECT_NAME, NODE_NAME, data_type, tag_name
+
+
+def _get_cached_window(tag_names, window_start_time, interval_type, interval, records, data_type, stale=False):
+	"""
+	Get a window from the cache
+	:param stale: whether expired windows are returned too, default - False
+	:return: a dictionary with the DataLogSeries of each Tag in the window, or None if any Tag is missing
+	"""
+	window_tag_values = {}
+	for tag_name in tag_names:
+		tag_series = cache.get(_window_key(tag_name, window_start_time, interval_type, interval, records, data_type),
+		                       stale)
+		if tag_series is None:
+			return None
+		window_tag_values[tag_name] = tag_series
+
+	return window_tag_values
+
+
+def _window_key(tag_name, window_start_time, interval_type, interval, records, data_type):
+	"""
+	Build the cache key of a window of a Tag, from its GetDataLog parameters
+	"""
+	return (PROJECT_NAME, NODE_NAME, tag_name, data_type, interval_type.upper(), int(interval),
+	        window_start_time.strftime(webaccess.WA_DATETIME_FORMAT), int(records))
+
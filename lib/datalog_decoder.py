@@ -0,0 +1,168 @@
+"""
+Module to decode the GetDataLog responses of the WebAccess server.
+The JSON response is parsed once, and the (string) values of each Tag are converted into a typed array of doubles,
+together with a mask of the values reported as missing by the WebAccess server ("#") or that are not finite numbers.
+"""
+from array import array
+import logging
+import math
+import struct
+import sys
+import time
+from lib import request_timing
+
+try:
+	import ujson as json  # Faster JSON parser, used if installed
+except ImportError:
+	import json
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+MISSING_VALUE = float('nan')  # Value kept in the array for missing readings
+
+# Decode statistics
+decoded_bytes = 0
+decoded_values = 0
+decode_seconds = 0.0
+
+
+class DataLogSeries(object):
+	"""
+	Class with the values of a Tag in a DataLog response: a typed array of values and a mask where missing values
+	are marked with 1.
+	"""
+
+	def __init__(self, values, missing):
+		"""
+		:param values: an array('d') with the values, where missing values are MISSING_VALUE
+		:param missing: a bytearray of the same length, with 1 for missing values and 0 otherwise
+		:return:
+		"""
+		self.values = values
+		self.missing = missing
+
+	def __len__(self):
+		return len(self.values)
+
+	def slice(self, start, end):
+		"""
+		Get a part of the series
+		:param start: the index of the first value
+		:param end: the index after the last value
+		:return: a new DataLogSeries with the values from start to end
+		"""
+		return DataLogSeries(self.values[start:end], self.missing[start:end])
+
+	def readings(self):
+		"""
+		Get the values of the series as a list
+		:return: a list where each reading is a float value, or None if the value is missing
+		"""
+		if not any(self.missing):
+			return self.values.tolist()
+		return [None if is_missing else value for value, is_missing in zip(self.values, self.missing)]
+
+	def size(self):
+		"""
+		Get the approximate size of the series in memory
+		:return: the size in bytes
+		"""
+		return len(self.values) * (self.values.itemsize + 1) + 128
+
+	def to_string(self):
+		"""
+		Convert the series to a string, e.g. for the shared cache. The number of values and the values are little-endian
+		whatever the byte order of this machine, so the string can be read on any machine.
+		:return: the number of values, followed by the values and the mask
+		"""
+		values = self.values
+		if sys.byteorder != 'little':
+			values = array('d', values)
+			values.byteswap()
+		return struct.pack('<I', len(values)) + values.tostring() + str(self.missing)
+
+	@staticmethod
+	def from_string(data):
+		"""
+		Convert a string made by to_string back to a series
+		:param data: the string
+		:return: a DataLogSeries
+		"""
+		length = struct.unpack_from('<I', data)[0]
+		values_end = 4 + length * array('d').itemsize
+		values = array('d')
+		values.fromstring(data[4:values_end])
+		if sys.byteorder != 'little':
+			values.byteswap()
+		return DataLogSeries(values, bytearray(data[values_end:values_end + length]))
+
+
+def decode_data_log(data_log_string):
+	"""
+	Decode a GetDataLog JSON response
+	:param data_log_string: the response of the WebAccess server, as a string
+	:return: a dictionary with the DataLogSeries of each Tag (by Tag name)
+	"""
+	global decoded_bytes, decoded_values, decode_seconds
+
+	start = time.time()
+	data_log_dict = json.loads(data_log_string)
+	tag_series = {}
+	values_count = 0
+	for data_log in data_log_dict['DataLog']:
+		tag_series[str(data_log['Name'])] = decode_values(data_log['Values'])
+		values_count += len(data_log['Values'])
+	elapsed = time.time() - start
+
+	decoded_bytes += len(data_log_string)
+	decoded_values += values_count
+	decode_seconds += elapsed
+	request_timing.record("decode", elapsed)
+	# Formatted by the logging module only if debug messages are enabled, since this runs for every GetDataLog
+	logger.debug("Decoded DataLog of %d values (%d bytes) in %.2f ms", values_count, len(data_log_string),
+	             elapsed * 1000)
+	return tag_series
+
+
+def decode_values(values):
+	"""
+	Convert the (string) values of a Tag into a DataLogSeries
+	:param values: the list of values, e.g. ["12.5", "13", "#"], where values that are not finite numbers (e.g. "#",
+	"nan" or "inf") are missing
+	:return: a DataLogSeries
+	"""
+	try:
+		# Fast path: all the values are numbers, and their sum is finite only if all of them are
+		typed_values = array('d', map(float, values))
+		if _is_finite(sum(typed_values)):
+			return DataLogSeries(typed_values, bytearray(len(values)))
+	except ValueError:
+		pass
+
+	typed_values = array('d', [MISSING_VALUE]) * len(values)
+	missing = bytearray(len(values))
+	for i, value in enumerate(values):
+		try:
+			typed_values[i] = float(value)
+		except ValueError:
+			missing[i] = 1
+			continue
+		if not _is_finite(typed_values[i]):
+			typed_values[i] = MISSING_VALUE
+			missing[i] = 1
+
+	return DataLogSeries(typed_values, missing)
+
+
+def _is_finite(value):
+	return not math.isinf(value) and not math.isnan(value)
+
+
+def stats():
+	"""
+	Get the decode statistics
+	:return: a dictionary with the total of decoded bytes, values and seconds, and the decode throughput
+	"""
+	return {'bytes': decoded_bytes, 'values': decoded_values, 'seconds': decode_seconds,
+	        'values_per_second': decoded_values / decode_seconds if decode_seconds else 0,
+	        'bytes_per_second': decoded_bytes / decode_seconds if decode_seconds else 0}
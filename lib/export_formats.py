@@ -0,0 +1,209 @@
+"""
+Module with the file formats of the energy consumption exports.
+Every format is written in a single pass, window by window: start() gives the beginning of the file, window() the
+rows of each window and finish() the end of the file, so a file can be streamed or written without keeping it in
+memory.
+Formats:
+	csv - date,time,electricity consumption rows
+	csv_gz - the csv format, gzip-compressed
+	ndjson - one Json object per row
+	binary - a compact columnar format, with a column for the total and one for each Tag (see BinaryExportFormat)
+"""
+from array import array
+import calendar
+import datetime
+import struct
+import sys
+import zlib
+from lib import aggregation
+
+# Global variables
+DATETIME_FORMAT = '%Y/%m/%d'
+TIME_FORMAT = '%H:%M'
+
+
+class CSVExportFormat(object):
+	"""
+	Class to write CSV export files
+	"""
+	name = "csv"
+	extension = ".csv"
+	content_type = "text/csv; charset=utf-8"
+	content_encoding = None
+
+	def start(self, start_time, interval, tag_names):
+		"""
+		Get the beginning of the file
+		:param start_time: the datetime of the first reading
+		:param interval: the minutes between two readings
+		:param tag_names: the names of the Tags of the export
+		:return: a string
+		"""
+		return "date,time,electricity consumption\n"
+
+	def window(self, window_start_time, interval, totals, tag_readings):
+		"""
+		Get the rows of a window
+		:param window_start_time: the datetime of the first reading of the window
+		:param interval: the minutes between two readings
+		:param totals: the list of the sums of the readings of all the Tags
+		:param tag_readings: a dictionary with the list of readings of each Tag, where missing readings are None
+		:return: a string
+		"""
+		return "".join(["{0},{1},{2}\n".format(reading_time.strftime(DATETIME_FORMAT),
+		                                       reading_time.strftime(TIME_FORMAT), aggregation.to_number(total))
+		                for reading_time, total in zip(_reading_times(window_start_time, interval, len(totals)), totals)])
+
+	def finish(self):
+		"""
+		Get the end of the file
+		:return: a string
+		"""
+		return ""
+
+
+class NDJSONExportFormat(CSVExportFormat):
+	"""
+	Class to write newline-delimited Json export files, with one object per reading like:
+	{"date": "2015/05/03", "time": "00:15", "electricity_consumption": 12.5}
+	"""
+	name = "ndjson"
+	extension = ".ndjson"
+	content_type = "application/x-ndjson; charset=utf-8"
+
+	def start(self, start_time, interval, tag_names):
+		return ""
+
+	def window(self, window_start_time, interval, totals, tag_readings):
+		return "".join(['{{"date": "{0}", "time": "{1}", "electricity_consumption": {2}}}\n'.format(
+			reading_time.strftime(DATETIME_FORMAT), reading_time.strftime(TIME_FORMAT),
+			repr(aggregation.to_number(total)))
+			for reading_time, total in zip(_reading_times(window_start_time, interval, len(totals)), totals)])
+
+
+class BinaryExportFormat(CSVExportFormat):
+	"""
+	Class to write binary columnar export files. All numbers are little-endian.
+	Header:
+		4 bytes - "USCE" (UShop consumption export)
+		uint8 - version (1)
+		int64 - the time of the first reading, in seconds since 1970-01-01 00:00 (local time of the server)
+		uint32 - the seconds between two readings
+		uint16 - the number of columns, followed by the name of each column as a uint16 length and UTF-8 bytes. The
+		first column is the total ("total"), followed by a column for each Tag.
+	Blocks (one for each window), until the end of the file:
+		uint32 - the number of readings of the block
+		float64 x readings - the readings of each column, column after column. Missing Tag readings are NaN.
+	"""
+	name = "binary"
+	extension = ".bin"
+	content_type = "application/octet-stream"
+	magic = "USCE"
+	version = 1
+
+	def __init__(self):
+		self._tag_names = []
+
+	def start(self, start_time, interval, tag_names):
+		self._tag_names = list(tag_names)
+		column_names = ["total"] + self._tag_names
+		header = [struct.pack('<4sBqIH', self.magic, self.version, calendar.timegm(start_time.timetuple()),
+		                      interval * 60, len(column_names))]
+		for column_name in column_names:
+			encoded_name = column_name.encode('utf-8')
+			header.append(struct.pack('<H', len(encoded_name)) + encoded_name)
+
+		return "".join(header)
+
+	def window(self, window_start_time, interval, totals, tag_readings):
+		columns = [array('d', totals)]
+		for tag_name in self._tag_names:
+			columns.append(array('d', [float('nan') if reading is None else reading
+			                           for reading in tag_readings[tag_name]]))
+		if sys.byteorder != 'little':
+			for column in columns:
+				column.byteswap()
+
+		return struct.pack('<I', len(totals)) + "".join([column.tostring() for column in columns])
+
+
+class GzipExportFormat(object):
+	"""
+	Class to write gzip-compressed export files of another format
+	"""
+	content_encoding = "gzip"
+
+	def __init__(self, export_format, flush_windows=False):
+		"""
+		:param export_format: the export format of the uncompressed file
+		:param flush_windows: whether each window is flushed, so it can be decompressed as soon as it is received
+		(for streaming), default - False
+		:return:
+		"""
+		self.export_format = export_format
+		self.name = export_format.name + "_gz"
+		self.extension = export_format.extension + ".gz"
+		self.content_type = export_format.content_type
+		self.flush_windows = flush_windows
+		self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+
+	def start(self, start_time, interval, tag_names):
+		return self._compressor.compress(self.export_format.start(start_time, interval, tag_names))
+
+	def window(self, window_start_time, interval, totals, tag_readings):
+		data = self._compressor.compress(self.export_format.window(window_start_time, interval, totals, tag_readings))
+		if self.flush_windows:
+			data += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+		return data
+
+	def finish(self):
+		return self._compressor.compress(self.export_format.finish()) + self._compressor.flush()
+
+
+# Export formats by name (functions creating a new writer, given whether each window is flushed)
+EXPORT_FORMATS = {
+	'csv': lambda flush_windows: CSVExportFormat(),
+	'csv_gz': lambda flush_windows: GzipExportFormat(CSVExportFormat(), flush_windows),
+	'ndjson': lambda flush_windows: NDJSONExportFormat(),
+	'binary': lambda flush_windows: BinaryExportFormat(),
+}
+
+
+def get_export_format(name, flush_windows=False):
+	"""
+	Get a new writer of an export format
+	:param name: the name of the format (see EXPORT_FORMATS)
+	:param flush_windows: whether compressed formats flush each window (for streaming), default - False
+	:return: the export format, or None if there is no format with that name
+	"""
+	create_export_format = EXPORT_FORMATS.get(name)
+	if create_export_format is None:
+		return None
+
+	return create_export_format(flush_windows)
+
+
+def get_file_type(file_name):
+	"""
+	Get the content type and encoding of an export file, by its extension
+	:param file_name: the name or path of the file
+	:return: the content type and the content encoding (None if not compressed), or (None, None) if the file is not of
+	an export format
+	"""
+	content_encoding = None
+	if file_name.endswith(".gz"):
+		content_encoding = "gzip"
+		file_name = file_name[:-len(".gz")]
+
+	for export_format in (CSVExportFormat, NDJSONExportFormat, BinaryExportFormat):
+		if file_name.endswith(export_format.extension):
+			return export_format.content_type, content_encoding
+
+	return None, None
+
+
+def _reading_times(start_time, interval, readings):
+	"""
+	Get the datetime of each reading of a window
+	"""
+	return [start_time + datetime.timedelta(minutes=interval * i) for i in range(0, readings)]
@@ -0,0 +1,202 @@
+"""
+Module with the index of the export files, used to delete them without scanning the export directory.
+Every export file is added to the index when it is created, with its size and expiration time. The expired files are
+found with a heap ordered by expiration time and, when the files take more than FILE_EXPORT_MAX_MB, the least recently
+downloaded files are deleted first. The files are deleted (and the directory scanned at startup) in a background
+thread, so the IOLoop never waits on the disk. A file is only deleted if it is still the one that was indexed (same
+inode and modification time), so a deletion queued before the file was exported again never removes the new file.
+"""
+from collections import OrderedDict
+import heapq
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from lib import export_formats
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+FILE_EXPORT_ROOT = settings['FILE_EXPORT_ROOT']
+FILE_EXPORT_LIFETIME_HOURS = settings['FILE_EXPORT_LIFETIME_HOURS']
+FILE_EXPORT_MAX_MB = settings['FILE_EXPORT_MAX_MB']
+
+executor = ThreadPoolExecutor(max_workers=1)  # The thread deleting the files
+
+
+class ExportFileIndex(object):
+	"""
+	Class to keep track of the export files of a directory, their expiration time and their last download
+	"""
+
+	def __init__(self, directory, lifetime_seconds, max_bytes):
+		"""
+		:param directory: the directory of the export files
+		:param lifetime_seconds: the number of seconds a file is kept after it is created
+		:param max_bytes: the maximum number of bytes of all the files
+		:return:
+		"""
+		self.directory = directory
+		self.lifetime_seconds = lifetime_seconds
+		self.max_bytes = max_bytes
+		self.expired_files = 0  # Number of files deleted because they expired
+		self.evicted_files = 0  # Number of files deleted to keep the files within max_bytes
+		self._files = OrderedDict()  # File name -> (size, expiration time, file id), least recently downloaded first
+		self._expirations = []  # Heap of (expiration time, file name), with stale entries of replaced files
+		self._bytes = 0
+
+	def add(self, file_name, size, creation_time=None, file_id=None):
+		"""
+		Add a new (or replaced) file to the index. If the files then take more than max_bytes, the least recently
+		downloaded files (but not the new one) are deleted.
+		:param file_name: the name of the file
+		:param size: the size of the file in bytes
+		:param creation_time: the time the file was created, in seconds since the epoch, default - None (now)
+		:param file_id: the id of the file (see get_file_id), which must match for the file to be deleted, default -
+		None (deleted whatever file has the name)
+		:return:
+		"""
+		self._discard(file_name)
+		creation_time = creation_time if creation_time is not None else time.time()
+		expiration_time = creation_time + self.lifetime_seconds
+		self._files[file_name] = (size, expiration_time, file_id)
+		self._bytes += size
+
+		heapq.heappush(self._expirations, (expiration_time, file_name))
+		if len(self._expirations) > 2 * len(self._files) + 64:  # Drop the stale entries
+			self._expirations = [(entry[1], name) for name, entry in self._files.items()]
+			heapq.heapify(self._expirations)
+
+		evicted_files = self._evict_files()
+		if evicted_files:
+			self._delete_files(evicted_files, expired=False)
+
+	def touch(self, file_name):
+		"""
+		Mark a file as just downloaded
+		:param file_name: the name of the file
+		:return:
+		"""
+		entry = self._files.pop(file_name, None)
+		if entry is not None:
+			self._files[file_name] = entry
+
+	def contains(self, file_name):
+		"""
+		Check whether a file is in the index (i.e. exists and has not expired)
+		:param file_name: the name of the file
+		:return: True if the file is in the index
+		"""
+		entry = self._files.get(file_name)
+		return entry is not None and entry[1] > time.time()
+
+	def cleanup(self):
+		"""
+		Delete the expired files, and then the least recently downloaded files while the files take more than max_bytes
+		:return: a Future that resolves when the files have been deleted
+		"""
+		now = time.time()
+		expired_files = []
+		while self._expirations and self._expirations[0][0] <= now:
+			expiration_time, file_name = heapq.heappop(self._expirations)
+			entry = self._files.get(file_name)
+			if entry is not None and entry[1] == expiration_time:  # Not replaced since
+				self._discard(file_name)
+				expired_files.append((file_name, entry[2]))
+
+		self._delete_files(expired_files, expired=True)
+		return self._delete_files(self._evict_files(), expired=False)
+
+	@gen.coroutine
+	def load(self):
+		"""
+		Add the export files already in the directory (e.g. from before a restart) to the index
+		:return:
+		"""
+		files = yield executor.submit(_scan_directory, self.directory, time.time() - self.lifetime_seconds)
+		for file_name, size, creation_time, file_id in sorted(files, key=lambda file_info: file_info[2]):
+			if file_name not in self._files:
+				self.add(file_name, size, creation_time, file_id)
+		logger.debug("Export file index loaded: {0}".format(self.stats()))
+
+	def stats(self):
+		"""
+		Get the statistics of the index
+		:return: a dictionary with the number of files and bytes, and the number of expired and evicted files
+		"""
+		return {'files': len(self._files), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+		        'expired_files': self.expired_files, 'evicted_files': self.evicted_files}
+
+	def _evict_files(self):
+		"""
+		Remove the least recently downloaded files from the index (except the most recent one) while the files take
+		more than max_bytes
+		:return: a list with the name and id of the removed files
+		"""
+		evicted_files = []
+		while self._bytes > self.max_bytes and len(self._files) > 1:
+			file_name = next(iter(self._files))
+			evicted_files.append((file_name, self._files[file_name][2]))
+			self._discard(file_name)
+
+		return evicted_files
+
+	def _discard(self, file_name):
+		entry = self._files.pop(file_name, None)
+		if entry is not None:
+			self._bytes -= entry[0]
+
+	def _delete_files(self, files, expired):
+		if expired:
+			self.expired_files += len(files)
+		else:
+			self.evicted_files += len(files)
+
+		return executor.submit(_remove_files, [(os.path.join(self.directory, file_name), file_id)
+		                                       for file_name, file_id in files])
+
+
+def get_file_id(file_stat):
+	"""
+	Get the id of a file, which changes when the file is replaced by another one with the same name
+	:param file_stat: the result of os.stat of the file
+	:return: a tuple with the inode and the modification time of the file
+	"""
+	return file_stat.st_ino, file_stat.st_mtime
+
+
+def _scan_directory(directory, expired_time):
+	"""
+	List the export files of a directory, deleting the temporary files left by unfinished jobs
+	:return: a list of (file name, size, creation time, file id) tuples
+	"""
+	files = []
+	for file_name in os.listdir(directory):
+		file_path = os.path.join(directory, file_name)
+		try:
+			if file_name.endswith(".tmp"):
+				if os.path.getmtime(file_path) < expired_time:
+					os.remove(file_path)
+			elif export_formats.get_file_type(file_name)[0] is not None:
+				file_stat = os.stat(file_path)
+				files.append((file_name, file_stat.st_size, file_stat.st_ctime, get_file_id(file_stat)))
+		except OSError:  # Deleted in the meantime
+			pass
+
+	return files
+
+
+def _remove_files(files):
+	for file_path, file_id in files:
+		try:
+			if file_id is not None and get_file_id(os.stat(file_path)) != file_id:
+				logger.debug("Export file {0} was replaced, not deleted".format(file_path))
+				continue
+			os.remove(file_path)
+			logger.debug("Deleted export file {0}".format(file_path))
+		except OSError, e:
+			logger.debug("Export file {0} could not be deleted: {1}".format(file_path, e))
+
+
+index = ExportFileIndex(FILE_EXPORT_ROOT, FILE_EXPORT_LIFETIME_HOURS * 60 * 60, FILE_EXPORT_MAX_MB * 1024 * 1024)
@@ -0,0 +1,207 @@
+"""
+Module to run the jobs that write the export files of the web server.
+Each export file is named by a hash of the parameters of the export, so that the same export is never written twice
+at the same time: a job submitted while an identical job is queued or running gets the existing job, and a finished
+file can be returned right away when its data can no longer change.
+Only EXPORT_MAX_JOBS jobs run at the same time, and the formatting, compression and writes of their files are done in
+a pool of threads (executor) instead of the IOLoop.
+"""
+import collections
+import functools
+import hashlib
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.concurrent import Future
+from lib import export_index
+from lib import metrics
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+FILE_EXPORT_PATH = settings['FILE_EXPORT_PATH']
+FILE_EXPORT_ROOT = settings['FILE_EXPORT_ROOT']
+FILE_EXPORT_LIFETIME_HOURS = settings['FILE_EXPORT_LIFETIME_HOURS']
+EXPORT_MAX_JOBS = settings['EXPORT_MAX_JOBS']
+
+# Job status values
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+executor = ThreadPoolExecutor(max_workers=EXPORT_MAX_JOBS)
+
+
+class ExportJob(object):
+	"""
+	Class with the state of a job writing an export file
+	"""
+
+	def __init__(self, file_name, run):
+		"""
+		:param file_name: the name of the export file
+		:param run: a function called with the job, returning a Future that resolves when the file has been written to
+		the temporary path of the job
+		:return:
+		"""
+		self.id = uuid.uuid4().hex
+		self.file_name = file_name
+		self.file_path = os.path.join(FILE_EXPORT_ROOT, file_name)
+		self.url_path = FILE_EXPORT_PATH + '/' + file_name  # Path of the link to the file
+		self.temp_path = "{0}.{1}.tmp".format(self.file_path, self.id)
+		self.status = STATUS_QUEUED
+		self.progress = 0.0
+		self.exception = None
+		self.finish_time = None
+		self.future = Future()  # Resolves (with the job itself) when the job is done or failed
+		self._run = run
+
+	def set_progress(self, progress):
+		"""
+		Set the fraction of the file already written
+		:param progress: a float value from 0 to 1
+		:return:
+		"""
+		self.progress = progress
+
+	def _finish(self, status, exception=None):
+		self.status = status
+		self.exception = exception
+		self.progress = 1.0 if status == STATUS_DONE else self.progress
+		self.finish_time = time.time()
+		self.future.set_result(self)
+
+
+class ExportJobQueue(object):
+	"""
+	Class to queue and run export jobs, with at most max_jobs jobs running at the same time
+	"""
+
+	def __init__(self, max_jobs):
+		"""
+		:param max_jobs: the maximum number of jobs running at the same time
+		:return:
+		"""
+		self.max_jobs = max_jobs
+		self._jobs = {}  # Job id -> job, kept for FILE_EXPORT_LIFETIME_HOURS after finishing
+		self._active_jobs = {}  # File name -> queued or running job
+		self._queue = collections.deque()
+		self._running = 0
+
+	def submit(self, file_name, run, reusable=False):
+		"""
+		Submit a job to write an export file
+		:param file_name: the name of the export file (see export_file_name)
+		:param run: a function called with the job, returning a Future that resolves when the file has been written to
+		job.temp_path
+		:param reusable: whether an existing file with the same name can be returned without running the job (i.e. its
+		data can no longer change), default - False
+		:return: the ExportJob, which may be an identical job already queued or running
+		"""
+		self._prune_jobs()
+
+		job = self._active_jobs.get(file_name)
+		if job is not None:
+			logger.debug("Export job {0} reused for {1}".format(job.id, file_name))
+			return job
+
+		job = ExportJob(file_name, run)
+		self._jobs[job.id] = job
+		if reusable and export_index.index.contains(file_name):
+			export_index.index.touch(file_name)
+			job._finish(STATUS_DONE)
+			return job
+
+		self._active_jobs[file_name] = job
+		self._queue.append(job)
+		self._start_jobs()
+		return job
+
+	def get(self, job_id):
+		"""
+		Get a job
+		:param job_id: the id of the job
+		:return: the ExportJob, or None if there is no such job
+		"""
+		return self._jobs.get(job_id)
+
+	def stats(self):
+		"""
+		Get the counters of the queue
+		:return: a dictionary with the number of queued, running and known jobs
+		"""
+		return {'queued': len(self._queue), 'running': self._running, 'jobs': len(self._jobs)}
+
+	def _start_jobs(self):
+		while self._queue and self._running < self.max_jobs:
+			self._running += 1
+			self._run_job(self._queue.popleft())
+
+	@gen.coroutine
+	def _run_job(self, job):
+		"""
+		Run a job, and move its file to the final path once it is complete
+		"""
+		job.status = STATUS_RUNNING
+		status = STATUS_DONE
+		exception = None
+		try:
+			yield job._run(job)
+			file_stat = yield executor.submit(_replace_file, job.temp_path, job.file_path)
+			export_index.index.add(job.file_name, file_stat.st_size, file_id=export_index.get_file_id(file_stat))
+			metrics.export_file_bytes.observe(file_stat.st_size, job.file_name.split('.', 1)[-1])  # e.g. "csv.gz"
+		except Exception, e:
+			logger.error(("Export job failed:", e), exc_info=True)
+			if os.path.exists(job.temp_path):
+				os.remove(job.temp_path)
+			status = STATUS_FAILED
+			exception = e
+		finally:
+			self._running -= 1
+			del self._active_jobs[job.file_name]
+
+		job._finish(status, exception)
+		self._start_jobs()
+
+	def _prune_jobs(self):
+		expired_time = time.time() - FILE_EXPORT_LIFETIME_HOURS * 60 * 60
+		for job_id, job in self._jobs.items():
+			if job.finish_time is not None and job.finish_time < expired_time:
+				del self._jobs[job_id]
+
+
+def export_file_name(extension, *parameters):
+	"""
+	Build the name of an export file from the parameters of the export
+	:param extension: the extension of the file, e.g. ".csv"
+	:param parameters: the parameters (strings, numbers or tuples of them) that define the content of the file
+	:return: the file name, e.g. "3f0a...c2.csv"
+	"""
+	return hashlib.sha1(repr(parameters)).hexdigest()[:20] + extension
+
+
+def write_file(export_file):
+	"""
+	Get a function to write chunks to a file in the thread pool
+	:param export_file: the open file
+	:return: a function called with a chunk, returning a Future that resolves when the chunk has been written
+	"""
+	return functools.partial(executor.submit, export_file.write)
+
+
+def _replace_file(source_path, destination_path):
+	"""
+	Move a file to its final path, replacing any existing file
+	:return: the result of os.stat of the file
+	"""
+	if os.name == 'nt' and os.path.exists(destination_path):  # rename does not replace files on Windows
+		os.remove(destination_path)
+	os.rename(source_path, destination_path)
+	return os.stat(destination_path)
+
+
+queue = ExportJobQueue(EXPORT_MAX_JOBS)
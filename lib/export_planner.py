@@ -0,0 +1,31 @@
+"""
+Module to plan the WebAccess DataLog requests needed to retrieve a long series of records, such as the
+15-minute series of a whole month for an export file.
+"""
+import datetime
+from settings import settings
+
+# Global variables
+WA_MAX_RECORDS_PER_REQUEST = settings['WA_MAX_RECORDS_PER_REQUEST']
+
+
+def plan_data_log_requests(start_time, records, interval, max_records=WA_MAX_RECORDS_PER_REQUEST):
+	"""
+	Split a continuous series of records into the fewest DataLog requests allowed by max_records.
+	Every request starts exactly where the previous one ends, so the concatenation of their results in order
+	is the whole series.
+	:param start_time: the datetime of the first record of the series
+	:param records: the total number of records of the series
+	:param interval: the time between two records, in minutes
+	:param max_records: the maximum number of records of a single request, default - WA_MAX_RECORDS_PER_REQUEST
+	:return: a list of (start_time, records) tuples, one for each request, in series order
+	"""
+
+	requests = []
+	while records > 0:
+		request_records = min(records, max_records)
+		requests.append((start_time, request_records))
+		start_time += datetime.timedelta(minutes=interval * request_records)
+		records -= request_records
+
+	return requests
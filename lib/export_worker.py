@@ -0,0 +1,76 @@
+"""
+Module to run the export jobs of all the worker processes (see the --workers option) in the first one.
+The export jobs, the identical jobs they are deduplicated against and the export file index only exist in the process
+that runs them, so the other workers forward the requests that submit, wait for or check an export job to the first
+worker, which also listens on EXPORT_WORKER_PORT of the loopback interface. The downloads of the export files served by
+the other workers are reported to it too, so the least recently downloaded files are the ones it deletes.
+"""
+import logging
+from tornado import gen
+from tornado import httpclient
+from lib import export_index
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+EXPORT_WORKER_PORT = settings['EXPORT_WORKER_PORT']
+EXPORT_WORKER_TIMEOUT_SECONDS = settings['EXPORT_WORKER_TIMEOUT_SECONDS']
+
+task_id = None  # The number of this worker process, None - single process (set at startup)
+_http_client = None  # Not shared with the WebAccess requests, so a long export never takes one of their connections
+
+
+def is_export_worker():
+	"""
+	:return: True if the export jobs run in this process
+	"""
+	return task_id in (None, 0) or EXPORT_WORKER_PORT is None
+
+
+def forward(uri, headers, method="GET"):
+	"""
+	Send a request to the export worker
+	:param uri: the path and query of the request, e.g. "/get_export_job_status?job_id=j"
+	:param headers: a dictionary with the headers of the request
+	:param method: the HTTP method, default - "GET"
+	:return: a Future that resolves with the HTTPResponse of the export worker (also for error status codes)
+	:raise HTTPError: (in the Future) 599 if the export worker did not respond
+	"""
+	global _http_client
+	if _http_client is None:
+		_http_client = httpclient.AsyncHTTPClient(force_instance=True)
+
+	request = httpclient.HTTPRequest("http://127.0.0.1:{0}{1}".format(EXPORT_WORKER_PORT, uri), method=method,
+	                                 headers=headers, body="" if method == "POST" else None,
+	                                 request_timeout=EXPORT_WORKER_TIMEOUT_SECONDS)
+	return _fetch(request)
+
+
+@gen.coroutine
+def _fetch(request):
+	try:
+		response = yield _http_client.fetch(request)
+	except httpclient.HTTPError, e:
+		if e.response is None:
+			raise
+		response = e.response
+	raise gen.Return(response)
+
+
+@gen.coroutine
+def touch_export_file(file_name):
+	"""
+	Mark an export file as just downloaded in the export file index of the export worker
+	:param file_name: the name of the file
+	:return:
+	"""
+	if is_export_worker():
+		export_index.index.touch(file_name)
+		return
+
+	try:
+		response = yield forward("/export_file_downloaded/{0}".format(file_name), {}, method="POST")
+		if response.code != 200:
+			raise httpclient.HTTPError(response.code)
+	except Exception, e:
+		logger.warning("Export file download not reported to the export worker: {0}".format(e))
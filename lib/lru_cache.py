@@ -0,0 +1,103 @@
+"""
+Module with a memory-bounded LRU (least recently used) cache, with optional expiration time per entry.
+"""
+from collections import OrderedDict
+import time
+
+
+class LRUCache(object):
+	"""
+	Class to keep a bounded number of bytes of cached values in memory.
+	When the cache is full, the least recently used entries are evicted first.
+	Each entry can have a time to live (TTL), after which it is considered expired and no longer returned (unless a
+	stale value is asked for, e.g. while the WebAccess server is down). Expired entries are kept until they are evicted
+	or replaced.
+	"""
+
+	def __init__(self, name, max_bytes):
+		"""
+		:param name: the name of the cache, used for statistics
+		:param max_bytes: the maximum (approximate) number of bytes of the values kept in the cache
+		:return:
+		"""
+		self.name = name
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._bytes = 0
+		self._entries = OrderedDict()  # key -> (value, size, expiration time or None), least recently used first
+
+	def get(self, key, stale=False):
+		"""
+		Get a value from the cache
+		:param key: the key of the entry
+		:param stale: whether an expired value is returned too, default - False
+		:return: the cached value, or None if the entry is not in the cache or is expired
+		"""
+		entry = self._entries.get(key)
+		if entry is None or (not stale and entry[2] is not None and entry[2] <= time.time()):
+			self.misses += 1
+			return None
+
+		del self._entries[key]
+		self._entries[key] = entry  # Mark as most recently used
+		self.hits += 1
+		return entry[0]
+
+	def contains(self, key):
+		"""
+		Check whether a value is in the cache, without counting a hit or a miss or marking it as used
+		:param key: the key of the entry
+		:return: True if the entry is in the cache and not expired
+		"""
+		entry = self._entries.get(key)
+		return entry is not None and (entry[2] is None or entry[2] > time.time())
+
+	def put(self, key, value, size, ttl=None):
+		"""
+		Put a value in the cache, evicting the least recently used entries if needed
+		:param key: the key of the entry
+		:param value: the value to cache
+		:param size: the (approximate) size of the value in bytes
+		:param ttl: the number of seconds the value is valid, default - None (never expires)
+		:return:
+		"""
+		if size > self.max_bytes:
+			return
+
+		self.delete(key)
+		expiration_time = time.time() + ttl if ttl is not None else None
+		self._entries[key] = (value, size, expiration_time)
+		self._bytes += size
+
+		while self._bytes > self.max_bytes:
+			evicted_value, evicted_size, evicted_expiration_time = self._entries.popitem(last=False)[1]
+			self._bytes -= evicted_size
+			self.evictions += 1
+
+	def delete(self, key):
+		"""
+		Remove an entry from the cache, if it exists
+		:param key: the key of the entry
+		:return:
+		"""
+		entry = self._entries.pop(key, None)
+		if entry is not None:
+			self._bytes -= entry[1]
+
+	def clear(self):
+		"""
+		Remove all entries from the cache
+		:return:
+		"""
+		self._entries.clear()
+		self._bytes = 0
+
+	def stats(self):
+		"""
+		Get the statistics of the cache
+		:return: a dictionary with the number of hits, misses, evictions, entries and bytes of the cache
+		"""
+		return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+		        'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,296 @@
+"""
+Module with the counters and latency histograms of the server, exposed in the Prometheus text format (see
+handlers.metrics).
+The metrics are kept in memory by each process, and updating them only increments a few numbers, so they can be
+recorded on every request. With --workers, each scrape is answered by one of the workers with its own metrics.
+"""
+import bisect
+import logging
+import time
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+METRICS_LOOP_LAG_INTERVAL_SECONDS = settings['METRICS_LOOP_LAG_INTERVAL_SECONDS']
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+metrics = []  # All the metrics of the process, in the order they are rendered
+collectors = []  # Functions called before rendering, to update the metrics read from the statistics of other modules
+
+
+class Metric(object):
+	"""
+	Base class of the metrics, with a value (or set of values) for each combination of label values
+	"""
+	metric_type = "untyped"
+
+	def __init__(self, name, description, label_names=()):
+		"""
+		:param name: the name of the metric, e.g. "ushop_requests_total"
+		:param description: the help text of the metric
+		:param label_names: the names of the labels of the metric, default - no labels
+		:return:
+		"""
+		self.name = name
+		self.description = description
+		self.label_names = tuple(label_names)
+		self._values = {}  # Tuple of label values -> value
+		metrics.append(self)
+
+	def render(self):
+		"""
+		Render the metric in the Prometheus text format
+		:return: the list of lines of the metric
+		"""
+		lines = ["# HELP {0} {1}".format(self.name, self.description),
+		         "# TYPE {0} {1}".format(self.name, self.metric_type)]
+		for label_values in sorted(self._values):
+			lines.append("{0}{1} {2}".format(self.name, format_labels(self.label_names, label_values),
+			                                 format_value(self._values[label_values])))
+		return lines
+
+
+class Counter(Metric):
+	"""
+	Class with a value that only increases
+	"""
+	metric_type = "counter"
+
+	def inc(self, *label_values, **kwargs):
+		"""
+		Increment the counter
+		:param label_values: the values of the labels
+		:param amount: the increment, default - 1
+		:return:
+		"""
+		self._values[label_values] = self._values.get(label_values, 0) + kwargs.get('amount', 1)
+
+	def set(self, value, *label_values):
+		"""
+		Set the total of a counter kept by another module
+		:param value: the total
+		:param label_values: the values of the labels
+		:return:
+		"""
+		self._values[label_values] = value
+
+
+class Gauge(Metric):
+	"""
+	Class with a value that can go up and down
+	"""
+	metric_type = "gauge"
+
+	def set(self, value, *label_values):
+		"""
+		Set the value of the gauge
+		:param value: the value
+		:param label_values: the values of the labels
+		:return:
+		"""
+		self._values[label_values] = value
+
+
+class Histogram(Metric):
+	"""
+	Class counting observed values (e.g. latencies) in buckets, with their count and sum
+	"""
+	metric_type = "histogram"
+
+	def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+		"""
+		:param name: the name of the metric, e.g. "ushop_request_duration_seconds"
+		:param description: the help text of the metric
+		:param label_names: the names of the labels of the metric, default - no labels
+		:param buckets: the sorted upper bounds of the buckets, default - LATENCY_BUCKETS
+		:return:
+		"""
+		super(Histogram, self).__init__(name, description, label_names)
+		self.buckets = tuple(buckets)
+
+	def observe(self, value, *label_values):
+		"""
+		Count an observed value
+		:param value: the value, e.g. a number of seconds
+		:param label_values: the values of the labels
+		:return:
+		"""
+		counts = self._values.get(label_values)
+		if counts is None:
+			counts = self._values[label_values] = [0] * (len(self.buckets) + 3)  # Buckets, +Inf, count and sum
+		counts[bisect.bisect_left(self.buckets, value)] += 1
+		counts[-2] += 1
+		counts[-1] += value
+
+	def render(self):
+		lines = ["# HELP {0} {1}".format(self.name, self.description),
+		         "# TYPE {0} {1}".format(self.name, self.metric_type)]
+		label_names = self.label_names + ('le',)
+		for label_values in sorted(self._values):
+			counts = self._values[label_values]
+			cumulative_count = 0
+			for i, upper_bound in enumerate(self.buckets + (float('inf'),)):
+				cumulative_count += counts[i]
+				lines.append("{0}_bucket{1} {2}".format(
+					self.name, format_labels(label_names, label_values + (format_value(upper_bound),)), cumulative_count))
+			labels = format_labels(self.label_names, label_values)
+			lines.append("{0}_count{1} {2}".format(self.name, labels, counts[-2]))
+			lines.append("{0}_sum{1} {2}".format(self.name, labels, format_value(counts[-1])))
+		return lines
+
+
+class LoopLagMonitor(object):
+	"""
+	Class to measure how late the IOLoop runs its callbacks: a timeout is added every interval, and the time between
+	its deadline and the moment it runs is the time the IOLoop was busy with other callbacks.
+	"""
+
+	def __init__(self, io_loop, interval):
+		"""
+		:param io_loop: the IOLoop
+		:param interval: the number of seconds between measures
+		:return:
+		"""
+		self.io_loop = io_loop
+		self.interval = interval
+		self._deadline = None
+
+	def start(self):
+		"""
+		Start measuring the lag of the IOLoop
+		:return:
+		"""
+		self._deadline = self.io_loop.time() + self.interval
+		self.io_loop.add_timeout(self._deadline, self._measure)
+
+	def _measure(self):
+		lag = max(self.io_loop.time() - self._deadline, 0)
+		loop_lag.observe(lag)
+		loop_last_lag.set(lag)
+		self.start()
+
+
+class Timer(object):
+	"""
+	Class to measure the time of a block of code (with the with statement) into a Histogram
+	"""
+
+	def __init__(self, histogram, *label_values):
+		"""
+		:param histogram: the Histogram
+		:param label_values: the values of the labels of the histogram
+		:return:
+		"""
+		self.histogram = histogram
+		self.label_values = label_values
+		self.start_time = None
+
+	def __enter__(self):
+		self.start_time = time.time()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.histogram.observe(time.time() - self.start_time, *self.label_values)
+
+
+def format_labels(label_names, label_values):
+	"""
+	Format the labels of a metric in the Prometheus text format
+	:param label_names: the names of the labels
+	:param label_values: the values of the labels
+	:return: the labels, e.g. '{route="get_power_meter",method="GET"}', or an empty string if there are no labels
+	"""
+	if not label_names:
+		return ""
+	return "{" + ",".join(['{0}="{1}"'.format(name, escape_label_value(value))
+	                       for name, value in zip(label_names, label_values)]) + "}"
+
+
+def escape_label_value(value):
+	"""
+	Escape a label value for the Prometheus text format
+	:param value: the value
+	:return: the value as a string, with backslashes, double quotes and line feeds escaped
+	"""
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+	"""
+	Format a value for the Prometheus text format
+	:param value: a number
+	:return: the number as a string, e.g. "0.25" or "+Inf"
+	"""
+	if value == float('inf'):
+		return "+Inf"
+	elif isinstance(value, float):
+		return repr(value)
+	return str(value)
+
+
+def add_collector(collector):
+	"""
+	Add a function that updates some metrics before they are rendered, e.g. from the statistics of a cache
+	:param collector: a function without arguments
+	:return:
+	"""
+	collectors.append(collector)
+
+
+def render():
+	"""
+	Render all the metrics of the process in the Prometheus text format
+	:return: the metrics, as a string
+	"""
+	for collector in collectors:
+		try:
+			collector()
+		except Exception, e:
+			logger.warning("Metrics collector failed: {0}".format(e))
+
+	lines = []
+	for metric in metrics:
+		lines.extend(metric.render())
+	return "\n".join(lines) + "\n"
+
+
+def start_loop_lag_monitor(io_loop):
+	"""
+	Start measuring the lag of the IOLoop, every METRICS_LOOP_LAG_INTERVAL_SECONDS
+	:param io_loop: the IOLoop
+	:return:
+	"""
+	LoopLagMonitor(io_loop, METRICS_LOOP_LAG_INTERVAL_SECONDS).start()
+
+
+# Metrics of the server
+requests = Counter("ushop_requests_total", "Requests handled, by route and status code", ('route', 'method', 'status'))
+request_duration = Histogram("ushop_request_duration_seconds", "Time to handle a request, by route",
+                             ('route', 'method'))
+result_errors = Counter("ushop_result_errors_total", "Error results returned, by error code (see RESULT_ERROR_CODES)",
+                        ('error_code', 'message'))
+upstream_duration = Histogram("ushop_upstream_request_duration_seconds",
+                              "Time of the requests to the WebAccess and SUSIAccess servers, by web service",
+                              ('upstream', 'web_service'))
+upstream_queue_wait = Histogram("ushop_upstream_queue_wait_seconds",
+                                "Time the WebAccess requests waited for a slot of the scheduler, by priority class",
+                                ('priority_class',))
+upstream_errors = Counter("ushop_upstream_errors_total",
+                          "Failed requests to the WebAccess and SUSIAccess servers, by web service and status code",
+                          ('upstream', 'web_service', 'code'))
+upstream_hedges = Counter("ushop_upstream_hedged_requests_total",
+                          "Duplicate WebAccess requests sent after the hedge delay, by web service and winner",
+                          ('web_service', 'winner'))
+export_file_bytes = Histogram("ushop_export_file_bytes", "Size of the written export files, by file extension",
+                              ('extension',),
+                              buckets=(1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 100 * 1024 * 1024))
+loop_lag = Histogram("ushop_ioloop_lag_seconds", "Delay of the IOLoop callbacks behind their deadline",
+                     buckets=LOOP_LAG_BUCKETS)
+loop_last_lag = Gauge("ushop_ioloop_last_lag_seconds", "Last measured delay of the IOLoop callbacks")
+loop_stalls = Counter("ushop_ioloop_stalls_total", "IOLoop stalls detected by the watchdog, by route of the request",
+                      ('route',))
+loop_stall_duration = Histogram("ushop_ioloop_stall_seconds", "Duration of the IOLoop stalls detected by the watchdog",
+                                buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
@@ -0,0 +1,113 @@
+"""
+Module with a stack-sampling profiler for the running server (see handlers.profiler).
+A background thread takes the stack of every other thread (the IOLoop thread and the thread pools) at a fixed
+interval, so the profiled code runs unchanged and the overhead only depends on the sampling interval. The samples are
+returned as collapsed stacks, one line per distinct stack with its number of samples, ready for flame graph tools
+(e.g. flamegraph.pl or speedscope):
+MainThread;tornado.ioloop.start;handlers.power_metering_api.get_energy_consumption_day 12
+"""
+from collections import Counter
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+PROFILER_MAX_SECONDS = 60  # Maximum duration of a profile
+PROFILER_MIN_INTERVAL_SECONDS = 0.001  # Minimum sampling interval
+
+executor = ThreadPoolExecutor(max_workers=1)  # The sampling thread, so only one profile runs at a time
+_running = False
+
+
+class StackSampler(object):
+	"""
+	Class to sample the stacks of all the threads of the process (except its own) and count them
+	"""
+
+	def __init__(self, interval):
+		"""
+		:param interval: the number of seconds between samples
+		:return:
+		"""
+		self.interval = interval
+		self.samples = 0
+		self.stacks = Counter()  # Collapsed stack -> number of samples
+		self._frame_names = {}  # Code object -> name of its frames in the stacks
+
+	def run(self, seconds):
+		"""
+		Sample the stacks for some time, in the calling thread
+		:param seconds: the duration of the profile
+		:return: the sampler
+		"""
+		sampler_thread_id = threading.current_thread().ident
+		end_time = time.time() + seconds
+		while time.time() < end_time:
+			thread_names = dict([(thread.ident, thread.name) for thread in threading.enumerate()])
+			for thread_id, frame in sys._current_frames().items():
+				if thread_id != sampler_thread_id:
+					self.stacks[self._collapse(thread_names.get(thread_id, str(thread_id)), frame)] += 1
+			self.samples += 1
+			time.sleep(self.interval)
+		return self
+
+	def collapsed(self):
+		"""
+		Get the sampled stacks in the collapsed format
+		:return: a string with one line per stack (root first, frames separated by ';') and its number of samples,
+		most sampled stacks first
+		"""
+		return "".join(["{0} {1}\n".format(stack, count) for stack, count in self.stacks.most_common()])
+
+	def _collapse(self, thread_name, frame):
+		names = []
+		while frame is not None:
+			code = frame.f_code
+			name = self._frame_names.get(code)
+			if name is None:
+				name = self._frame_names[code] = "{0}.{1}".format(frame.f_globals.get('__name__', '?'),
+				                                                  code.co_name).replace(';', ':').replace(' ', '_')
+			names.append(name)
+			frame = frame.f_back
+		names.append(thread_name.replace(';', ':').replace(' ', '_'))
+		names.reverse()
+		return ";".join(names)
+
+
+def is_running():
+	"""
+	Check whether a profile is running
+	:return: True if a profile is running
+	"""
+	return _running
+
+
+def profile(seconds, interval):
+	"""
+	Profile the process in the sampling thread
+	:param seconds: the duration of the profile (at most PROFILER_MAX_SECONDS)
+	:param interval: the number of seconds between samples (at least PROFILER_MIN_INTERVAL_SECONDS)
+	:return: a Future resolving to the StackSampler with the samples
+	"""
+	global _running
+
+	seconds = min(seconds, PROFILER_MAX_SECONDS)
+	interval = max(interval, PROFILER_MIN_INTERVAL_SECONDS)
+	logger.info("Profiling for {0} s every {1} ms".format(seconds, interval * 1000))
+	_running = True
+	return executor.submit(_run_profile, StackSampler(interval), seconds)
+
+
+def _run_profile(sampler, seconds):
+	"""
+	Run a profile in the sampling thread, and mark it as over before its Future is resolved (a done callback would only
+	run after the threads waiting for the result are woken up)
+	"""
+	global _running
+	try:
+		return sampler.run(seconds)
+	finally:
+		_running = False
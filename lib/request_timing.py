@@ -0,0 +1,191 @@
+"""
+Module to collect the timeline of each request: its upstream calls and its processing phases (fetch, decode,
+aggregate and serialize). It is returned in the Server-Timing header and logged for slow requests (see BaseHandler).
+The timeline of the request being handled is kept in a StackContext, so the code called by the handler (and the
+callbacks it schedules) can add to it without passing it around. Outside of a request nothing is recorded.
+Each request has a correlation id, taken from its X-Request-ID header (if valid) or generated, which is sent back to
+the client and forwarded to the WebAccess server.
+"""
+from collections import OrderedDict
+import functools
+import re
+import time
+import uuid
+from tornado import stack_context
+
+# Global variables
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID_REGEX = re.compile(r"^[a-zA-Z0-9._-]{1,64}$")  # Ids accepted from the clients
+MAX_UPSTREAM_CALLS = 100  # Upstream calls kept in detail for the slow request log (the rest are only counted)
+
+_current = None  # The timeline of the request whose callbacks are running
+
+
+class RequestTimeline(object):
+	"""
+	Class with the time spent by a request in each phase, and the detail of its upstream calls.
+	Phases may overlap (e.g. concurrent upstream calls), so their durations can add up to more than the request.
+	"""
+
+	def __init__(self, request_id, handler_name=None, route=None):
+		"""
+		:param request_id: the correlation id of the request
+		:param handler_name: the name of the handler class of the request, default - None
+		:param route: the name of the route of the request (see BaseHandler.get_metrics_route), default - None
+		:return:
+		"""
+		self.request_id = request_id
+		self.handler_name = handler_name
+		self.route = route
+		self.phases = OrderedDict()  # Phase name -> [seconds, count]
+		self.upstream_calls = []  # (upstream, web service, seconds, status code), at most MAX_UPSTREAM_CALLS
+
+	def record(self, name, seconds):
+		"""
+		Add time to a phase
+		:param name: the name of the phase, e.g. "decode"
+		:param seconds: the time spent
+		:return:
+		"""
+		phase = self.phases.get(name)
+		if phase is None:
+			self.phases[name] = [seconds, 1]
+		else:
+			phase[0] += seconds
+			phase[1] += 1
+
+	def add_upstream_call(self, upstream, web_service, seconds, status):
+		"""
+		Add an upstream call, which also adds its time to the "fetch" phase
+		:param upstream: the upstream server, e.g. "webaccess"
+		:param web_service: the name of the web service, e.g. "GetDataLog"
+		:param seconds: the time of the call
+		:param status: the status code of the response, or "error"
+		:return:
+		"""
+		self.record("fetch", seconds)
+		if len(self.upstream_calls) < MAX_UPSTREAM_CALLS:
+			self.upstream_calls.append((upstream, web_service, seconds, status))
+
+	def server_timing(self, total_seconds):
+		"""
+		Build the value of the Server-Timing header
+		:param total_seconds: the total time of the request so far
+		:return: the header value, e.g. 'fetch;dur=123.4;desc="8 calls", decode;dur=2.1, total;dur=130.2'
+		"""
+		metrics = []
+		for name, (seconds, count) in self.phases.items():
+			metric = "{0};dur={1:.1f}".format(name, seconds * 1000)
+			if count > 1:
+				metric += ';desc="{0} calls"'.format(count)
+			metrics.append(metric)
+		metrics.append("total;dur={0:.1f}".format(total_seconds * 1000))
+		return ", ".join(metrics)
+
+	def to_dict(self):
+		"""
+		Get the timeline as a dictionary, e.g. for a structured log record
+		:return: a dictionary with the request id, the phases and the upstream calls (times in milliseconds)
+		"""
+		return {'request_id': self.request_id,
+		        'phases': OrderedDict([(name, {'ms': round(seconds * 1000, 1), 'count': count})
+		                               for name, (seconds, count) in self.phases.items()]),
+		        'upstream_calls': [{'upstream': upstream, 'web_service': web_service, 'ms': round(seconds * 1000, 1),
+		                            'status': status}
+		                           for upstream, web_service, seconds, status in self.upstream_calls],
+		        'upstream_calls_total': self.phases['fetch'][1] if 'fetch' in self.phases else 0}
+
+
+class _TimelineContext(object):
+	"""
+	Context manager to make a timeline the current one, for a StackContext
+	"""
+
+	def __init__(self, timeline):
+		self.timeline = timeline
+		self._previous = None
+
+	def __enter__(self):
+		global _current
+		self._previous = _current
+		_current = self.timeline
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		global _current
+		_current = self._previous
+
+
+class PhaseTimer(object):
+	"""
+	Context manager to add the time of a block of code to a phase of the current request (see phase)
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.start_time = None
+
+	def __enter__(self):
+		self.start_time = time.time()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		record(self.name, time.time() - self.start_time)
+
+
+def context(timeline):
+	"""
+	Get a StackContext that makes a timeline the current one, for the code run inside it and its callbacks
+	:param timeline: the RequestTimeline
+	:return: the StackContext, to use in a with statement
+	"""
+	return stack_context.StackContext(functools.partial(_TimelineContext, timeline))
+
+
+def phase(name):
+	"""
+	Measure the time of a block of code into a phase of the current request, e.g.
+	with request_timing.phase("aggregate"):
+		...
+	:param name: the name of the phase
+	:return: the PhaseTimer, to use in a with statement
+	"""
+	return PhaseTimer(name)
+
+
+def current():
+	"""
+	Get the timeline of the current request
+	:return: the RequestTimeline, or None outside of a request
+	"""
+	return _current
+
+
+def record(name, seconds):
+	"""
+	Add time to a phase of the current request, if any
+	:param name: the name of the phase
+	:param seconds: the time spent
+	:return:
+	"""
+	if _current is not None:
+		_current.record(name, seconds)
+
+
+def add_upstream_call(upstream, web_service, seconds, status):
+	"""
+	Add an upstream call to the current request, if any (see RequestTimeline.add_upstream_call)
+	"""
+	if _current is not None:
+		_current.add_upstream_call(upstream, web_service, seconds, status)
+
+
+def get_request_id(request):
+	"""
+	Get the correlation id of a request
+	:param request: the HTTPServerRequest
+	:return: the X-Request-ID header of the request if it is a valid id, or a new id
+	"""
+	request_id = request.headers.get(REQUEST_ID_HEADER)
+	if request_id is not None and REQUEST_ID_REGEX.match(request_id):
+		return request_id
+	return uuid.uuid4().hex
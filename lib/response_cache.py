@@ -0,0 +1,70 @@
+"""
+Module with the cache of the serialized responses of the power metering web services.
+Each response is kept as its Json string and, when it is large enough to be worth compressing, as a gzip-compressed
+copy, so that a popular response is serialized and compressed only once. The cache is bounded in memory, evicting the
+least recently used responses first.
+"""
+import struct
+import zlib
+from lib.shared_cache import TieredCache
+from settings import settings
+
+# Global variables
+RESPONSE_CACHE_MAX_MB = settings['RESPONSE_CACHE_MAX_MB']
+GZIP_MIN_BYTES = 256  # Smaller responses are not compressed (gzip adds about 20 bytes)
+GZIP_LEVEL = 6
+
+
+class CachedResponse(object):
+	"""
+	Class with the serialized body of a response, and its gzip-compressed copy
+	"""
+
+	def __init__(self, body):
+		"""
+		:param body: the Json string of the response
+		:return:
+		"""
+		self.body = body
+		self.gzip_body = compress(body) if len(body) >= GZIP_MIN_BYTES else None
+
+	def size(self):
+		"""
+		Get the approximate size of the response in memory
+		:return: the size in bytes
+		"""
+		return len(self.body) + (len(self.gzip_body) if self.gzip_body is not None else 0) + 128
+
+	def to_string(self):
+		"""
+		Convert the response to a string, e.g. for the shared cache
+		:return: the length of the body, followed by the body and the compressed body
+		"""
+		return struct.pack('<I', len(self.body)) + self.body + (self.gzip_body or "")
+
+	@staticmethod
+	def from_string(data):
+		"""
+		Convert a string made by to_string back to a response
+		:param data: the string
+		:return: a CachedResponse
+		"""
+		body_end = 4 + struct.unpack_from('<I', data)[0]
+		response = CachedResponse.__new__(CachedResponse)
+		response.body = data[4:body_end]
+		response.gzip_body = data[body_end:] or None
+		return response
+
+
+def compress(data):
+	"""
+	Compress a string in the gzip format
+	:param data: the string
+	:return: the gzip-compressed string
+	"""
+	compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+	return compressor.compress(data) + compressor.flush()
+
+
+cache = TieredCache("Responses", RESPONSE_CACHE_MAX_MB * 1024 * 1024, CachedResponse.to_string,
+                    CachedResponse.from_string)
@@ -4,54 +4,194 @@ Module to maintain all scheduled tasks in the UShop web server.
 import logging
 from settings import settings
 import tornado.ioloop
+from tornado import gen
 import time
-import glob
-import os
+import datetime
+import functools
+from handlers import power_metering_api
+from lib import credentials
+from lib import datalog
+from lib import export_index
+from lib import shared_cache
 
 logger = logging.getLogger('ushop.' + __name__)
 
 FILE_DELETE_INTERVAL_HOURS = settings['FILE_DELETE_INTERVAL_HOURS']
-FILE_EXPORT_LIFETIME_HOURS = settings['FILE_EXPORT_LIFETIME_HOURS']
-FILE_EXPORT_PATH = settings['FILE_EXPORT_PATH']
+WA_TAG_NAMES = settings['WA_TAG_NAMES']
+DATA_TYPE = settings['DATA_TYPE']
+WA_DATALOG_CACHE_CURRENT_TTL_SECONDS = settings['WA_DATALOG_CACHE_CURRENT_TTL_SECONDS']
+WARM_WA_USERNAME = settings['WARM_WA_USERNAME']
+WARM_WA_PASSWORD = settings['WARM_WA_PASSWORD']
+WARM_INTERVAL_MINUTES = settings['WARM_INTERVAL_MINUTES']
+WARM_DELAY_SECONDS = settings['WARM_DELAY_SECONDS']
+SHARED_CACHE_CLEANUP_MINUTES = settings['SHARED_CACHE_CLEANUP_MINUTES']
 
 class Scheduler(object):
 	"""
 	Class to handle the execution of all scheduled tasks in the server
 	"""
 
-	def __init__(self, main_loop):
+	def __init__(self, main_loop, task_id=None):
 		"""
 		:param main_loop: the main loop of the Tornado application instance
+		:param task_id: the number of the worker process, default - None (single process)
 		:return:
 		"""
 		self.main_loop = main_loop
+		self.task_id = task_id
 
 	def run_scheduled_tasks(self):
 		"""
-		Run all scheduled tasks
+		Run all scheduled tasks. With several worker processes, they only run in the first one.
 		:return:
 		"""
+		if self.task_id not in (None, 0):
+			return
+
 		# Delete export files
 		self.run_delete_export_files()
+		# Warm the DataLog caches
+		self.run_warm_caches()
+		# Delete old entries of the shared caches
+		self.run_clean_shared_caches()
 
 	def run_delete_export_files(self):
+		"""
+		Load the export files left from before startup into the export file index, and then delete the expired files
+		every FILE_DELETE_INTERVAL_HOURS
+		:return:
+		"""
+		self.main_loop.add_callback(export_index.index.load)
+
 		interval_ms = FILE_DELETE_INTERVAL_HOURS * 60 * 60 * 1000
+		# The other worker processes never write export files (see export_worker), so they are all in the index
 		scheduler = tornado.ioloop.PeriodicCallback(delete_export_files, interval_ms, io_loop=self.main_loop)
 		scheduler.start()
 
+	def run_clean_shared_caches(self):
+		"""
+		Delete the expired (and oldest) entries of the shared caches every SHARED_CACHE_CLEANUP_MINUTES, when the caches
+		are shared by several worker processes
+		:return:
+		"""
+		if self.task_id is None:
+			return
+
+		interval_ms = SHARED_CACHE_CLEANUP_MINUTES * 60 * 1000
+		scheduler = tornado.ioloop.PeriodicCallback(clean_shared_caches, interval_ms, io_loop=self.main_loop)
+		scheduler.start()
+
+	def run_warm_caches(self):
+		"""
+		Warm the DataLog caches with the whole month at startup, and then refresh the latest readings every
+		WARM_INTERVAL_MINUTES, shortly after each new reading is due
+		:return:
+		"""
+		if WARM_WA_USERNAME is None:
+			logger.debug("Cache warming is disabled")
+			return
+
+		self.main_loop.add_callback(warm_caches, startup=True)
+
+		interval_seconds = WARM_INTERVAL_MINUTES * 60
+		scheduler = tornado.ioloop.PeriodicCallback(warm_caches, interval_seconds * 1000, io_loop=self.main_loop)
+		now = time.time()
+		first_run_time = now - now % interval_seconds + interval_seconds + WARM_DELAY_SECONDS
+		self.main_loop.add_timeout(first_run_time, functools.partial(self._start_warm_caches, scheduler))
+
+	@staticmethod
+	def _start_warm_caches(scheduler):
+		warm_caches()
+		scheduler.start()
+
 
+@gen.coroutine
 def delete_export_files():
 	"""
-	Delete expired export files found in the FILE_EXPORT_PATH
+	Delete expired export files found in the FILE_EXPORT_PATH, and the least recently downloaded files while the
+	export files take more than FILE_EXPORT_MAX_MB. The files are found in the export file index, without scanning the
+	directory.
 	Expiration time is defined in the settings for FILE_EXPORT_LIFETIME_HOURS
 	:return:
 	"""
 	logger.debug("Deleting export files...")
-	files = glob.glob(FILE_EXPORT_PATH + "/*.csv") if glob.glob(FILE_EXPORT_PATH + "/*.csv") is not None else []
-	for file in files:
-		now = time.time()
-		creation_time = os.path.getctime(file)
-		delta_seconds = now - creation_time
-		delta_hours = (delta_seconds) / (60 * 60)
-		if delta_hours > FILE_EXPORT_LIFETIME_HOURS:
-			os.remove(file)
\ No newline at end of file
+	yield export_index.index.cleanup()
+
+
+@gen.coroutine
+def clean_shared_caches():
+	"""
+	Delete the expired entries of the shared caches, and the oldest entries of the caches over SHARED_CACHE_MAX_MB, in
+	the background thread of the export file index
+	:return:
+	"""
+	deleted = yield export_index.executor.submit(shared_cache.cleanup)
+	logger.debug("Shared caches cleaned up: {0} entries deleted".format(deleted))
+
+
+@gen.coroutine
+def warm_caches(startup=False):
+	"""
+	Retrieve the 15-minute readings of all the Tags in WA_TAG_NAMES, so that the day, today and month views are served
+	from the store and the caches, and cache the today responses of every power meter (see cache_today_responses).
+	At startup, the readings of the whole current month (the range of the month view, which includes today) are
+	retrieved, and yesterday's when yesterday is in the previous month. Every other run only fetches again the windows
+	with the readings due since the previous run, which are kept until the next run.
+	The store and the caches are only used with verified credentials, so the WARM_WA_USERNAME credentials are verified
+	(with the WebAccess Logon unless they are cached) on every run.
+	:param startup: whether this is the run at startup, default - False
+	:return:
+	"""
+	logger.debug("Warming DataLog caches...")
+
+	tag_names = get_all_tag_names()
+	now = datetime.datetime.now()
+	today = datetime.datetime.combine(now.date(), datetime.time())
+	month_start_time = today.replace(day=1)
+	yesterday = today - datetime.timedelta(days=1)
+	refresh_ttl = WARM_INTERVAL_MINUTES * 60 + WARM_DELAY_SECONDS + WA_DATALOG_CACHE_CURRENT_TTL_SECONDS
+
+	try:
+		authorization = credentials.basic_headers(WARM_WA_USERNAME, WARM_WA_PASSWORD)['authorization']
+		warm_credentials = yield credentials.cache.authenticate(authorization)
+		if warm_credentials is None:
+			logger.error("Error warming DataLog caches: the credentials of {0} were rejected".format(WARM_WA_USERNAME))
+			return
+		wa_headers = warm_credentials.wa_headers
+
+		if startup:
+			series_futures = [datalog.get_base_series(wa_headers, tag_names, month_start_time,
+			                                          31 * datalog.BASE_READINGS_PER_DAY, DATA_TYPE, refresh_ttl)]
+			if yesterday < month_start_time:
+				series_futures.append(datalog.get_base_series(wa_headers, tag_names, yesterday,
+				                                              datalog.BASE_READINGS_PER_DAY, DATA_TYPE))
+		else:
+			# From the window of the first reading due since the previous run, to the window of now
+			previous_run_time = now - datetime.timedelta(minutes=WARM_INTERVAL_MINUTES, seconds=WARM_DELAY_SECONDS)
+			start_time = datalog.get_base_window_start_time(previous_run_time)
+			readings = int((now - start_time).total_seconds() // (datalog.BASE_INTERVAL * 60)) + 1
+			series_futures = [datalog.get_base_series(wa_headers, tag_names, start_time, readings, DATA_TYPE,
+			                                          refresh_ttl)]
+		yield series_futures
+		yield power_metering_api.cache_today_responses(wa_headers, refresh_ttl)
+	except Exception, e:
+		logger.error(("Error warming DataLog caches:", e), exc_info=True)
+		return
+
+	logger.debug("DataLog caches warmed: {0}".format(datalog.cache.stats()))
+
+
+def get_all_tag_names():
+	"""
+	Get the names of all the Tags in WA_TAG_NAMES, without repetitions
+	:return: a list of Tag names
+	"""
+	tag_names = []
+	for power_meter_tag_names in WA_TAG_NAMES:
+		if isinstance(power_meter_tag_names, str):
+			power_meter_tag_names = [power_meter_tag_names]
+		for tag_name in power_meter_tag_names:
+			if tag_name not in tag_names:
+				tag_names.append(tag_name)
+
+	return tag_names
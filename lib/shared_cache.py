@@ -0,0 +1,245 @@
+"""
+Module with a file-backed cache shared by the worker processes of the server (see the --workers option).
+Each entry is a small file named by a hash of its key, with a header holding the expiration time of the entry. Entries
+are written (in a background thread, so the IOLoop never waits on the disk) to a temporary file and renamed, so a
+process reading an entry (while another one replaces it) always gets a complete entry. The files are read through the
+page cache of the operating system, so all the workers share a single copy of the cached data instead of each warming
+its own.
+The in-memory caches keep using their LRUCache, and go to the shared cache on a miss (see TieredCache).
+"""
+import hashlib
+import logging
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lib.lru_cache import LRUCache
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+SHARED_CACHE_PATH = settings['SHARED_CACHE_PATH']
+SHARED_CACHE_MAX_MB = settings['SHARED_CACHE_MAX_MB']
+ENTRY_MAGIC = "USSC0001"  # Entry format identifier and version
+ENTRY_HEADER = struct.Struct('<8sd')  # Magic and expiration time (0 - never expires)
+ENTRY_EXTENSION = ".entry"
+
+caches = []  # All the TieredCaches of the process
+executor = ThreadPoolExecutor(max_workers=1)  # The thread writing the entries
+
+
+class SharedCache(object):
+	"""
+	Class to keep cached strings in files of a directory, shared by several processes.
+	The directory is bounded by cleanup(), which deletes the expired entries and then the oldest entries while the
+	entries take more than max_bytes.
+	"""
+
+	def __init__(self, name, directory, max_bytes):
+		"""
+		:param name: the name of the cache, used for statistics and as the subdirectory of its entries
+		:param directory: the directory of all the shared caches
+		:param max_bytes: the maximum number of bytes of the entries kept in the directory
+		:return:
+		"""
+		self.name = name
+		self.directory = os.path.join(directory, name)
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self.errors = 0
+		if not os.path.isdir(self.directory):
+			try:
+				os.makedirs(self.directory)
+			except OSError:  # Created by another process in the meantime
+				pass
+
+	def get(self, key):
+		"""
+		Get an entry from the cache
+		:param key: the key of the entry (its repr identifies it)
+		:return: the cached string and its remaining time to live in seconds (None if it never expires), or None if
+		the entry is not in the cache or is expired
+		"""
+		try:
+			with open(self._path(key), 'rb') as entry_file:
+				data = entry_file.read()
+		except IOError:
+			self.misses += 1
+			return None
+
+		if len(data) < ENTRY_HEADER.size:
+			self.misses += 1
+			return None
+		magic, expiration_time = ENTRY_HEADER.unpack_from(data)
+		ttl = expiration_time - time.time() if expiration_time else None
+		if magic != ENTRY_MAGIC or (ttl is not None and ttl <= 0):
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		return data[ENTRY_HEADER.size:], ttl
+
+	def put(self, key, data, ttl=None):
+		"""
+		Put an entry in the cache, replacing any existing entry. The entry is written in the thread of the executor.
+		:param key: the key of the entry (its repr identifies it)
+		:param data: the string to cache
+		:param ttl: the number of seconds the entry is valid, default - None (never expires)
+		:return: a Future that resolves when the entry has been written
+		"""
+		expiration_time = time.time() + ttl if ttl is not None else 0
+		return executor.submit(self._write, self._path(key), data, expiration_time)
+
+	def _write(self, path, data, expiration_time):
+		temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+		try:
+			with open(temp_path, 'wb') as entry_file:
+				entry_file.write(ENTRY_HEADER.pack(ENTRY_MAGIC, expiration_time))
+				entry_file.write(data)
+			if os.name == 'nt' and os.path.exists(path):  # rename does not replace files on Windows
+				os.remove(path)
+			os.rename(temp_path, path)
+		except (IOError, OSError), e:
+			self.errors += 1
+			logger.debug("Shared cache {0}: entry not written: {1}".format(self.name, e))
+
+	def cleanup(self):
+		"""
+		Delete the expired entries, and then the oldest entries while the entries take more than max_bytes.
+		It reads the whole directory, so it should run in a background thread of a single process.
+		:return: the number of deleted entries
+		"""
+		now = time.time()
+		entries = []
+		deleted = 0
+		for file_name in os.listdir(self.directory):
+			path = os.path.join(self.directory, file_name)
+			try:
+				if file_name.endswith(ENTRY_EXTENSION):
+					with open(path, 'rb') as entry_file:
+						header = entry_file.read(ENTRY_HEADER.size)
+					expiration_time = ENTRY_HEADER.unpack(header)[1] if len(header) == ENTRY_HEADER.size else now
+					if not expiration_time or expiration_time > now:
+						file_stat = os.stat(path)
+						entries.append((file_stat.st_mtime, file_stat.st_size, path))
+						continue
+				elif os.path.getmtime(path) > now - 60 * 60:  # Temporary file being written
+					continue
+				os.remove(path)
+				deleted += 1
+			except (IOError, OSError):  # Replaced or deleted in the meantime
+				pass
+
+		total_bytes = sum([size for modification_time, size, path in entries])
+		for modification_time, size, path in sorted(entries):
+			if total_bytes <= self.max_bytes:
+				break
+			try:
+				os.remove(path)
+				deleted += 1
+			except OSError:
+				pass
+			total_bytes -= size
+
+		return deleted
+
+	def stats(self):
+		"""
+		Get the statistics of the cache
+		:return: a dictionary with the number of hits, misses and write errors of this process
+		"""
+		return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
+
+	def _path(self, key):
+		return os.path.join(self.directory, hashlib.sha1(repr(key)).hexdigest() + ENTRY_EXTENSION)
+
+
+class TieredCache(object):
+	"""
+	Class with the same interface as LRUCache, keeping the values in an LRUCache of the process and, when the shared
+	cache is enabled, in a SharedCache for the other processes. Values are converted to and from strings for the
+	shared cache.
+	"""
+
+	def __init__(self, name, max_bytes, to_string, from_string):
+		"""
+		:param name: the name of the cache
+		:param max_bytes: the maximum number of bytes of the values kept in the memory of the process
+		:param to_string: a function converting a value to a string
+		:param from_string: a function converting a string back to a value
+		:return:
+		"""
+		self.name = name
+		self.local = LRUCache(name, max_bytes)
+		self.shared = SharedCache(name, SHARED_CACHE_PATH, SHARED_CACHE_MAX_MB * 1024 * 1024) \
+			if SHARED_CACHE_PATH is not None else None
+		self._to_string = to_string
+		self._from_string = from_string
+		caches.append(self)
+
+	def get(self, key, stale=False):
+		"""
+		Get a value from the cache of the process or, if not found, from the shared cache
+		:param key: the key of the entry
+		:param stale: whether an expired value of the cache of the process is returned too, default - False
+		:return: the cached value, or None if the entry is not in the cache or is expired
+		"""
+		value = self.local.get(key, stale)
+		if value is not None or self.shared is None:
+			return value
+
+		entry = self.shared.get(key)
+		if entry is None:
+			return None
+		data, ttl = entry
+		value = self._from_string(data)
+		self.local.put(key, value, len(data), ttl)
+		return value
+
+	def contains(self, key):
+		"""
+		Check whether a value is in the cache of the process (the shared cache is not read)
+		:param key: the key of the entry
+		:return: True if the entry is in the cache of the process and not expired
+		"""
+		return self.local.contains(key)
+
+	def put(self, key, value, size, ttl=None):
+		"""
+		Put a value in the cache of the process and in the shared cache
+		:param key: the key of the entry
+		:param value: the value to cache
+		:param size: the (approximate) size of the value in bytes
+		:param ttl: the number of seconds the value is valid, default - None (never expires)
+		:return:
+		"""
+		self.local.put(key, value, size, ttl)
+		if self.shared is not None:
+			self.shared.put(key, self._to_string(value), ttl)
+
+	def delete(self, key):
+		"""
+		Remove an entry from the cache of the process (the shared entry expires by itself)
+		:param key: the key of the entry
+		:return:
+		"""
+		self.local.delete(key)
+
+	def stats(self):
+		"""
+		Get the statistics of the cache
+		:return: the statistics of the LRUCache, with those of the shared cache (if enabled) under 'shared'
+		"""
+		stats = self.local.stats()
+		if self.shared is not None:
+			stats['shared'] = self.shared.stats()
+		return stats
+
+
+def cleanup():
+	"""
+	Clean up the directories of all the shared caches (see SharedCache.cleanup)
+	:return: the number of deleted entries
+	"""
+	return sum([cache.shared.cleanup() for cache in caches if cache.shared is not None])
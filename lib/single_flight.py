@@ -0,0 +1,52 @@
+"""
+Module to coalesce identical asynchronous calls that are in flight at the same time, so that only one of them
+actually runs and all the callers share its result (single-flight).
+"""
+import logging
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+
+
+class SingleFlight(object):
+	"""
+	Class to keep track of the in-flight calls of a group of identical requests.
+	Each call is identified by a key; while a call is running, any other call with the same key gets the Future
+	of the running call instead of starting a new one.
+	"""
+
+	def __init__(self, name):
+		"""
+		:param name: the name of the group of calls, used for logging
+		:return:
+		"""
+		self.name = name
+		self.calls = 0  # Total number of calls
+		self.coalesced = 0  # Number of calls that shared the result of another in-flight call
+		self._in_flight = {}
+
+	def do(self, key, task):
+		"""
+		Run the given task, unless a task with the same key is already in flight
+		:param key: a hashable object identifying the call
+		:param task: a function without arguments returning a Future
+		:return: a Future with the result of the task (shared by all the concurrent callers with the same key)
+		"""
+		self.calls += 1
+		future = self._in_flight.get(key)
+		if future is not None:
+			self.coalesced += 1
+			logger.debug("{0}: call coalesced with an in-flight call".format(self.name))
+			return future
+
+		future = task()
+		self._in_flight[key] = future
+		future.add_done_callback(lambda f: self._in_flight.pop(key, None))
+		return future
+
+	def stats(self):
+		"""
+		Get the counters of this group of calls
+		:return: a dictionary with the number of calls, coalesced calls and calls currently in flight
+		"""
+		return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._in_flight)}
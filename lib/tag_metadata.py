@@ -0,0 +1,229 @@
+"""
+Module with the cache of the Tag metadata (names, descriptions and types) of each WebAccess Project.
+The composite web services (GetTagValue, GetDataLog and TagDetail of all Tags) need the Tag names of the Project
+before their own request, so caching them saves a TagList round trip on every call. The entries are parsed once and
+shared by the Json and XML web services: they are loaded from the Json TagList, updated with every TagList and
+TagDetail response that goes through the server, and refreshed in the background once older than
+WA_TAG_METADATA_TTL_SECONDS.
+"""
+from collections import OrderedDict
+import functools
+import logging
+import time
+from xml.etree import ElementTree
+from tornado import gen
+from lib.single_flight import SingleFlight
+from settings import settings
+import json
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+WA_TAG_METADATA_TTL_SECONDS = settings['WA_TAG_METADATA_TTL_SECONDS']
+WA_TAG_METADATA_MAX_STALE_SECONDS = settings['WA_TAG_METADATA_MAX_STALE_SECONDS']
+
+
+class TagMetadata(object):
+	"""
+	Class with the metadata of a Tag
+	"""
+
+	def __init__(self, name, description=None, tag_type=None):
+		"""
+		:param name: the name of the Tag
+		:param description: the description of the Tag, default - None (unknown)
+		:param tag_type: the type of the Tag, e.g. ANALOG, default - None (unknown)
+		:return:
+		"""
+		self.name = name
+		self.description = description
+		self.tag_type = tag_type
+
+
+class TagMetadataCache(object):
+	"""
+	Class to keep the Tags of each Project, with a time to live (TTL). Entries older than the TTL are still returned
+	(for up to max_stale more seconds) while they are refreshed in the background.
+	"""
+
+	def __init__(self, ttl, max_stale):
+		"""
+		:param ttl: the number of seconds the Tags of a Project are fresh
+		:param max_stale: the number of seconds after the TTL the Tags are still returned while being refreshed
+		:return:
+		"""
+		self.ttl = ttl
+		self.max_stale = max_stale
+		self.hits = 0
+		self.stale_hits = 0
+		self.misses = 0
+		self._projects = {}  # Project name -> (OrderedDict of Tag name -> TagMetadata, load time)
+		self._generation = 0  # Incremented by invalidate, so loads started before are not kept
+		self._refreshing = set()  # Projects being refreshed in the background
+		self._loads = SingleFlight("TagList")
+
+	@gen.coroutine
+	def get_tags(self, wa_headers, project_name, fetch_tag_list):
+		"""
+		Get the Tags of a Project, from the cache or from the WebAccess server
+		:param wa_headers: the headers with the credentials for the WebAccess server
+		:param project_name: the name of the Project
+		:param fetch_tag_list: a function called with the headers and the Project name, returning a Future with the Json
+		TagList response of the Project
+		:return: the list of TagMetadata of the Project
+		"""
+		entry = self._projects.get(project_name)
+		if entry is not None:
+			tags, load_time = entry
+			age = time.time() - load_time
+			if age < self.ttl:
+				self.hits += 1
+				raise gen.Return(tags.values())
+			elif age < self.ttl + self.max_stale:
+				self.stale_hits += 1
+				self._refresh(wa_headers, project_name, fetch_tag_list)
+				raise gen.Return(tags.values())
+
+		self.misses += 1
+		tags = yield self._load(wa_headers, project_name, fetch_tag_list)
+		raise gen.Return(tags)
+
+	def put_tag_list(self, project_name, tag_list, get_json=True):
+		"""
+		Replace the Tags of a Project with those of a TagList response, keeping the known types of the Tags
+		:param project_name: the name of the Project
+		:param tag_list: the TagList response of the Project (of all its Nodes), as a string
+		:param get_json: whether the response is Json (True) or XML (False), default - True
+		:return: the list of TagMetadata of the Project
+		"""
+		entry = self._projects.get(project_name)
+		known_tags = entry[0] if entry is not None else {}
+		tags = OrderedDict()
+		for tag in parse_tag_list(tag_list, get_json):
+			known_tag = known_tags.get(tag.name)
+			if known_tag is not None:
+				tag.tag_type = known_tag.tag_type
+			tags[tag.name] = tag
+
+		self._projects[project_name] = (tags, time.time())
+		return tags.values()
+
+	def put_tag_details(self, project_name, tag_detail, get_json=True):
+		"""
+		Update the descriptions and types of the cached Tags of a Project with those of a TagDetail response
+		:param project_name: the name of the Project
+		:param tag_detail: the TagDetail response, as a string
+		:param get_json: whether the response is Json (True) or XML (False), default - True
+		:return:
+		"""
+		entry = self._projects.get(project_name)
+		if entry is None:
+			return
+
+		tags = entry[0]
+		for tag_details in parse_tag_details(tag_detail, get_json):
+			tag = tags.get(tag_details.name)
+			if tag is not None:
+				tag.description = tag_details.description
+				tag.tag_type = tag_details.tag_type
+
+	def invalidate(self, project_name=None):
+		"""
+		Remove the Tags of a Project from the cache, so that they are loaded again on the next call
+		:param project_name: the name of the Project, default - None (all Projects)
+		:return:
+		"""
+		if project_name is None:
+			self._projects.clear()
+		else:
+			self._projects.pop(project_name, None)
+		self._generation += 1
+
+	def stats(self):
+		"""
+		Get the statistics of the cache
+		:return: a dictionary with the number of hits, stale hits, misses and cached Projects
+		"""
+		return {'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses,
+		        'projects': len(self._projects), 'refreshing': len(self._refreshing)}
+
+	@gen.coroutine
+	def _load(self, wa_headers, project_name, fetch_tag_list):
+		"""
+		Load the Tags of a Project from the WebAccess server. Concurrent loads with the same credentials share a single
+		TagList request.
+		"""
+		generation = self._generation
+		flight_key = (wa_headers.get("authorization"), project_name)
+		tag_list = yield self._loads.do(flight_key, functools.partial(fetch_tag_list, wa_headers, project_name))
+		if generation != self._generation:  # Invalidated while loading
+			raise gen.Return(parse_tag_list(tag_list))
+
+		raise gen.Return(self.put_tag_list(project_name, tag_list))
+
+	@gen.coroutine
+	def _refresh(self, wa_headers, project_name, fetch_tag_list):
+		"""
+		Load the Tags of a Project again in the background, keeping the current Tags if the load fails
+		"""
+		if project_name in self._refreshing:
+			return
+
+		self._refreshing.add(project_name)
+		try:
+			yield self._load(wa_headers, project_name, fetch_tag_list)
+		except Exception, e:
+			logger.warning("Tags of Project {0} could not be refreshed: {1}".format(project_name, e))
+		finally:
+			self._refreshing.discard(project_name)
+
+
+def parse_tag_list(tag_list, get_json=True):
+	"""
+	Parse a TagList response.
+	The Json response will look like this:
+	{"Result": {"Ret": 0, "Total": 2}, "Tags": [{"Name": "kw", "Description": "Description"}, ...]}
+	The XML response will look like this:
+	<TagList xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+		<Result><Ret>0</Ret><Total>2</Total></Result>
+		<Tags><Tag><Name>kw</Name><Description>Description</Description></Tag>...</Tags>
+	</TagList>
+	:param tag_list: the TagList response, as a string
+	:param get_json: whether the response is Json (True) or XML (False), default - True
+	:return: a list of TagMetadata, without types
+	"""
+	tags = []
+	if get_json:
+		json_tag_list = json.loads(tag_list)
+		if int(json_tag_list['Result']['Total']) > 0:
+			for tag in json_tag_list['Tags']:
+				tags.append(TagMetadata(tag['Name'], tag.get('Description')))
+	else:
+		xml_root = ElementTree.fromstring(tag_list)
+		if int(xml_root.find('Result').find('Total').text) > 0:
+			for tag in xml_root.iter('Tag'):
+				tags.append(TagMetadata(tag.findtext('Name'), tag.findtext('Description')))
+
+	return tags
+
+
+def parse_tag_details(tag_detail, get_json=True):
+	"""
+	Parse a TagDetail response with the NAME, DESCRP and TYPE attributes (see webaccess.get_tag_details)
+	:param tag_detail: the TagDetail response, as a string
+	:param get_json: whether the response is Json (True) or XML (False), default - True
+	:return: a list of TagMetadata
+	"""
+	tags = []
+	if get_json:
+		json_tag_detail = json.loads(tag_detail)
+		for tag in json_tag_detail.get('Tags') or []:
+			tags.append(TagMetadata(tag.get('NAME'), tag.get('DESCRP'), tag.get('TYPE')))
+	else:
+		xml_root = ElementTree.fromstring(tag_detail)
+		for tag in xml_root.iter('Tag'):
+			tags.append(TagMetadata(tag.findtext('NAME'), tag.findtext('DESCRP'), tag.findtext('TYPE')))
+
+	return tags
+
+
+cache = TagMetadataCache(WA_TAG_METADATA_TTL_SECONDS, WA_TAG_METADATA_MAX_STALE_SECONDS)
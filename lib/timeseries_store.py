@@ -0,0 +1,277 @@
+"""
+Module with a local on-disk store of the 15-minute readings of each Tag.
+The readings are kept in memory-mapped files of fixed-width typed values, one file per Tag per month, so that any
+reading is found by direct offset arithmetic.
+Each file has a small header, followed by an array of 2976 (31 days x 96) little-endian doubles with the values and an
+array of 2976 status bytes. A status byte tells whether its slot is empty (never stored), has a value, or was reported
+as missing by the WebAccess server ("#").
+The store is safe for one writer and many readers across processes: writers hold an exclusive lock on the file while
+writing, and every value is written before its status byte, so readers (which never lock) see either an empty slot or
+a complete reading.
+Only the most recently used files are kept open (mapped); files without the FILE_MAGIC header (e.g. truncated or of
+another format) are treated as not stored, and are created again when written.
+"""
+from collections import OrderedDict
+import datetime
+import errno
+import logging
+import mmap
+import os
+import struct
+import urllib
+
+try:
+	import fcntl
+except ImportError:  # Not available on Windows, where only a single process uses the store
+	fcntl = None
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+SLOT_MINUTES = 15  # Minutes of each reading
+SLOTS_PER_DAY = 24 * 60 / SLOT_MINUTES
+SLOTS_PER_FILE = 31 * SLOTS_PER_DAY
+FILE_MAGIC = "USTS0001"  # File format identifier and version
+HEADER_SIZE = 16
+VALUE_SIZE = struct.calcsize('<d')
+VALUES_OFFSET = HEADER_SIZE
+STATUS_OFFSET = VALUES_OFFSET + SLOTS_PER_FILE * VALUE_SIZE
+FILE_SIZE = STATUS_OFFSET + SLOTS_PER_FILE
+MAX_OPEN_FILES = 128  # Files kept mapped for reading (and as many for writing), least recently used are closed
+
+# Slot status values
+STATUS_EMPTY = '\x00'
+STATUS_VALUE = '\x01'
+STATUS_MISSING = '\x02'
+
+
+class TimeSeriesStore(object):
+	"""
+	Class to read and write the 15-minute readings of a set of Tags in a directory.
+	"""
+
+	def __init__(self, root_path, max_open_files=MAX_OPEN_FILES):
+		"""
+		:param root_path: the directory where the files of the store are kept
+		:param max_open_files: the number of files kept mapped for reading, and for writing, default - MAX_OPEN_FILES
+		:return:
+		"""
+		self.root_path = root_path
+		self.max_open_files = max_open_files
+		self._read_maps = OrderedDict()  # File path -> read-only mmap, least recently used first
+		self._write_maps = OrderedDict()  # File path -> (file, writable mmap), least recently used first
+
+	def read(self, series, start_time, slots):
+		"""
+		Read a range of readings of a series
+		:param series: a tuple of strings identifying the series, e.g. (project, node, data_type, tag_name)
+		:param start_time: the datetime of the first reading, aligned to SLOT_MINUTES
+		:param slots: the number of readings
+		:return: the list of readings, where each reading is a float value, MISSING (reported missing by the
+		WebAccess server) or None (not in the store)
+		"""
+		readings = []
+		for file_path, first_slot, file_slots in self._file_ranges(series, start_time, slots):
+			read_map = self._get_read_map(file_path)
+			if read_map is None:
+				readings.extend([None] * file_slots)
+				continue
+
+			values = struct.unpack_from('<%dd' % file_slots, read_map, VALUES_OFFSET + first_slot * VALUE_SIZE)
+			statuses = read_map[STATUS_OFFSET + first_slot:STATUS_OFFSET + first_slot + file_slots]
+			for value, status in zip(values, statuses):
+				if status == STATUS_VALUE:
+					readings.append(value)
+				elif status == STATUS_MISSING:
+					readings.append(MISSING)
+				else:
+					readings.append(None)
+
+		return readings
+
+	def write(self, series, start_time, readings):
+		"""
+		Write a range of readings of a series
+		:param series: a tuple of strings identifying the series, e.g. (project, node, data_type, tag_name)
+		:param start_time: the datetime of the first reading, aligned to SLOT_MINUTES
+		:param readings: the list of readings, where each reading is a float value or MISSING. Readings that are None
+		are skipped.
+		:return:
+		"""
+		position = 0
+		for file_path, first_slot, file_slots in self._file_ranges(series, start_time, len(readings)):
+			file_readings = readings[position:position + file_slots]
+			position += file_slots
+			if all(reading is None for reading in file_readings):
+				continue
+
+			write_file, write_map = self._get_write_map(file_path)
+			_lock(write_file)
+			try:
+				for slot, reading in enumerate(file_readings, first_slot):
+					if reading is None:
+						continue
+					if reading is MISSING:
+						write_map[STATUS_OFFSET + slot] = STATUS_MISSING
+					else:
+						struct.pack_into('<d', write_map, VALUES_OFFSET + slot * VALUE_SIZE, reading)
+						write_map[STATUS_OFFSET + slot] = STATUS_VALUE
+			finally:
+				_unlock(write_file)
+
+	def close(self):
+		"""
+		Close all the open files of the store
+		:return:
+		"""
+		for read_map in self._read_maps.values():
+			read_map.close()
+		for write_file, write_map in self._write_maps.values():
+			write_map.close()
+			write_file.close()
+		self._read_maps.clear()
+		self._write_maps.clear()
+
+	def _file_ranges(self, series, start_time, slots):
+		"""
+		Split a range of readings into the ranges of each monthly file
+		:return: a list of (file path, first slot in the file, number of slots) tuples
+		"""
+		file_ranges = []
+		while slots > 0:
+			month_days = (datetime.date(start_time.year + start_time.month / 12, start_time.month % 12 + 1, 1) -
+			              datetime.date(start_time.year, start_time.month, 1)).days
+			first_slot = (start_time.day - 1) * SLOTS_PER_DAY + \
+			             (start_time.hour * 60 + start_time.minute) / SLOT_MINUTES
+			file_slots = min(slots, month_days * SLOTS_PER_DAY - first_slot)
+			file_ranges.append((self._file_path(series, start_time), first_slot, file_slots))
+			start_time += datetime.timedelta(minutes=SLOT_MINUTES * file_slots)
+			slots -= file_slots
+
+		return file_ranges
+
+	def _file_path(self, series, month_time):
+		"""
+		Get the path of the file of a series for a given month
+		"""
+		directory = os.path.join(self.root_path, *[urllib.quote(str(part), safe='') for part in series])
+		return os.path.join(directory, month_time.strftime('%Y-%m') + ".dat")
+
+	def _get_read_map(self, file_path):
+		"""
+		Get the read-only mmap of a file, or None if the file does not exist yet (or is not a valid file of the store)
+		"""
+		read_map = self._read_maps.pop(file_path, None)
+		if read_map is None:
+			if not _is_valid_file(file_path):
+				return None
+			with open(file_path, 'rb') as read_file:
+				read_map = mmap.mmap(read_file.fileno(), FILE_SIZE, access=mmap.ACCESS_READ)
+			while len(self._read_maps) >= self.max_open_files:
+				self._read_maps.popitem(last=False)[1].close()
+
+		self._read_maps[file_path] = read_map  # Mark as most recently used
+		return read_map
+
+	def _get_write_map(self, file_path):
+		"""
+		Get the file and writable mmap of a file, creating the file if it does not exist yet (or replacing it if it is
+		not a valid file of the store)
+		"""
+		write_maps = self._write_maps.pop(file_path, None)
+		if write_maps is None:
+			if not _is_valid_file(file_path):
+				if os.path.exists(file_path):
+					logger.warning("Replacing invalid time series file {0}".format(file_path))
+					_create_file(file_path, replace=True)
+				else:
+					_create_file(file_path)
+			write_file = open(file_path, 'r+b')
+			write_maps = (write_file, mmap.mmap(write_file.fileno(), FILE_SIZE))
+			while len(self._write_maps) >= self.max_open_files:
+				evicted_file, evicted_map = self._write_maps.popitem(last=False)[1]
+				evicted_map.close()
+				evicted_file.close()
+
+		self._write_maps[file_path] = write_maps  # Mark as most recently used
+		return write_maps
+
+
+class _Missing(object):
+	"""
+	Marker for the readings reported as missing by the WebAccess server
+	"""
+
+	def __repr__(self):
+		return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def _is_valid_file(file_path):
+	"""
+	Check whether a file exists, has the size of the files of the store and starts with FILE_MAGIC
+	"""
+	try:
+		with open(file_path, 'rb') as store_file:
+			header = store_file.read(HEADER_SIZE)
+			store_file.seek(0, os.SEEK_END)
+			size = store_file.tell()
+	except IOError, e:
+		if e.errno != errno.ENOENT:
+			logger.warning("Time series file {0} cannot be read: {1}".format(file_path, e))
+		return False
+
+	if header[:len(FILE_MAGIC)] != FILE_MAGIC or size < FILE_SIZE:
+		logger.warning("Ignoring invalid time series file {0}".format(file_path))
+		return False
+	return True
+
+
+def _create_file(file_path, replace=False):
+	"""
+	Create an empty file of the store. The file is created with its full size under a temporary name and then linked to
+	its final name, which fails if another process created the file in the meantime (a rename would replace the file,
+	and the readings already written to it would be lost).
+	:param file_path: the path of the file
+	:param replace: whether an existing (invalid) file is replaced, default - False
+	"""
+	directory = os.path.dirname(file_path)
+	if not os.path.isdir(directory):
+		try:
+			os.makedirs(directory)
+		except OSError:  # Created by another process in the meantime
+			pass
+
+	temp_file_path = "{0}.{1}.tmp".format(file_path, os.getpid())
+	with open(temp_file_path, 'wb') as temp_file:
+		temp_file.write(FILE_MAGIC.ljust(HEADER_SIZE, '\x00'))
+		temp_file.write('\x00' * (FILE_SIZE - HEADER_SIZE))
+	try:
+		if replace:
+			os.rename(temp_file_path, file_path)
+			temp_file_path = None
+		elif hasattr(os, 'link'):
+			os.link(temp_file_path, file_path)
+		elif not os.path.exists(file_path):  # No hard links (Windows), where only a single process uses the store
+			os.rename(temp_file_path, file_path)
+			temp_file_path = None
+	except OSError, e:
+		if e.errno != errno.EEXIST:
+			raise
+		logger.debug("Time series file {0} created by another process".format(file_path))
+	else:
+		logger.debug("Created time series file {0}".format(file_path))
+	finally:
+		if temp_file_path is not None:
+			os.remove(temp_file_path)
+
+
+def _lock(locked_file):
+	if fcntl is not None:
+		fcntl.flock(locked_file.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock(locked_file):
+	if fcntl is not None:
+		fcntl.flock(locked_file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,154 @@
+"""
+Module with the scheduler of the requests to the WebAccess server (see webaccess_client.fetch).
+At most max_concurrent requests are sent at the same time. The others wait in a queue per priority class
+(interactive, comparison, export and prefetch), and each class can only use up to its own limit of the concurrent
+requests (a bulkhead), so a heavy export never takes all of them. A free slot goes to the first class (in priority
+order) with waiting requests and room under its limit. Within a class, the users take turns (round robin), so one user
+with many requests does not hold back the others.
+"""
+from collections import deque
+from collections import OrderedDict
+import functools
+import time
+from tornado import httpclient
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+# Priority classes, in priority order
+CLASS_INTERACTIVE = "interactive"
+CLASS_COMPARISON = "comparison"
+CLASS_EXPORT = "export"
+CLASS_PREFETCH = "prefetch"
+PRIORITY_CLASSES = (CLASS_INTERACTIVE, CLASS_COMPARISON, CLASS_EXPORT, CLASS_PREFETCH)
+
+
+class Waiter(object):
+	"""
+	Class with a request waiting for a slot
+	"""
+
+	def __init__(self, priority_class, user):
+		"""
+		:param priority_class: the priority class of the request
+		:param user: the key of the user of the request
+		:return:
+		"""
+		self.priority_class = priority_class
+		self.user = user
+		self.future = Future()
+		self.timeout = None
+		self.enqueue_time = time.time()
+
+
+class UpstreamScheduler(object):
+	"""
+	Class to limit the concurrent upstream requests, with priority classes and fair queuing between users
+	"""
+
+	def __init__(self, max_concurrent, class_limits, queue_timeout):
+		"""
+		:param max_concurrent: the maximum number of requests running at the same time
+		:param class_limits: a dictionary with the maximum number of running requests of each priority class (classes
+		not in it can use all of them)
+		:param queue_timeout: the maximum number of seconds a request waits for a slot
+		:return:
+		"""
+		self.max_concurrent = max_concurrent
+		self.class_limits = class_limits
+		self.queue_timeout = queue_timeout
+		self.running = 0
+		self.timeouts = 0
+		self._class_running = dict([(priority_class, 0) for priority_class in PRIORITY_CLASSES])
+		self._queues = OrderedDict([(priority_class, OrderedDict()) for priority_class in PRIORITY_CLASSES])
+		self._queued = dict([(priority_class, 0) for priority_class in PRIORITY_CLASSES])
+
+	def acquire(self, priority_class, user):
+		"""
+		Wait for a slot to send a request. Every acquired slot must be released with release().
+		:param priority_class: the priority class of the request (one of PRIORITY_CLASSES)
+		:param user: the key of the user of the request, for the fair queuing
+		:return: a Future that resolves when the request can be sent
+		:raise HTTPError: (in the Future) 599 if no slot was free within the queue timeout
+		"""
+		waiter = Waiter(priority_class, user)
+		self._queues[priority_class].setdefault(user, deque()).append(waiter)
+		self._queued[priority_class] += 1
+		self._dispatch()
+		if not waiter.future.done():
+			waiter.timeout = IOLoop.current().add_timeout(waiter.enqueue_time + self.queue_timeout,
+			                                              functools.partial(self._expire, waiter))
+		return waiter.future
+
+	def try_acquire(self, priority_class):
+		"""
+		Take a slot only if one is free right away and no request is waiting for it (e.g. for a hedged request, which
+		must not delay the others). The slot must be released with release().
+		:param priority_class: the priority class of the request (one of PRIORITY_CLASSES)
+		:return: True if the slot was taken
+		"""
+		if self.running >= self.max_concurrent or any(self._queued.values()) or \
+				self._class_running[priority_class] >= self.class_limits.get(priority_class, self.max_concurrent):
+			return False
+
+		self.running += 1
+		self._class_running[priority_class] += 1
+		return True
+
+	def release(self, priority_class):
+		"""
+		Release the slot of a finished request
+		:param priority_class: the priority class of the request
+		:return:
+		"""
+		self.running -= 1
+		self._class_running[priority_class] -= 1
+		self._dispatch()
+
+	def stats(self):
+		"""
+		Get the state of the scheduler
+		:return: a dictionary with the number of running and queued requests of each priority class, and the number of
+		requests that timed out in the queue
+		"""
+		return {'running': dict(self._class_running), 'queued': dict(self._queued), 'timeouts': self.timeouts}
+
+	def _dispatch(self):
+		"""
+		Start the waiting requests while there are free slots
+		"""
+		while self.running < self.max_concurrent:
+			for priority_class, users in self._queues.items():
+				if users and self._class_running[priority_class] < self.class_limits.get(priority_class,
+				                                                                         self.max_concurrent):
+					user, waiters = users.popitem(last=False)
+					waiter = waiters.popleft()
+					if waiters:  # The user goes to the end of the round robin
+						users[user] = waiters
+					self._start(waiter)
+					break
+			else:
+				return
+
+	def _start(self, waiter):
+		self.running += 1
+		self._class_running[waiter.priority_class] += 1
+		self._queued[waiter.priority_class] -= 1
+		if waiter.timeout is not None:
+			IOLoop.current().remove_timeout(waiter.timeout)
+		waiter.future.set_result(time.time() - waiter.enqueue_time)
+
+	def _expire(self, waiter):
+		"""
+		Remove a request that waited longer than the queue timeout
+		"""
+		users = self._queues[waiter.priority_class]
+		waiters = users.get(waiter.user)
+		if waiters is None or waiter not in waiters:
+			return
+
+		waiters.remove(waiter)
+		if not waiters:
+			del users[waiter.user]
+		self._queued[waiter.priority_class] -= 1
+		self.timeouts += 1
+		waiter.future.set_exception(httpclient.HTTPError(599, "Timeout waiting for a WebAccess request slot"))
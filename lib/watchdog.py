@@ -0,0 +1,150 @@
+"""
+Module with a watchdog that detects the callbacks blocking the IOLoop (e.g. a synchronous HTTP request or file scan).
+The IOLoop updates a deadline every WATCHDOG_INTERVAL_MS, and a background thread checks that it keeps doing so. When
+the IOLoop is more than WATCHDOG_STALL_THRESHOLD_MS late, the thread takes the stack of the IOLoop thread (the code
+blocking it) and the request being handled. Once the IOLoop runs again, the stall is counted in the metrics and logged
+as a single Json record with its duration.
+The watchdog also keeps a moving average of the lag of the IOLoop, used by the admission control (see lib.admission).
+A thread is used instead of the SIGALRM of IOLoop.set_blocking_signal_threshold, which would interrupt the blocking
+system calls themselves.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from lib import metrics
+from lib import request_timing
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+WATCHDOG_STALL_THRESHOLD_MS = settings['WATCHDOG_STALL_THRESHOLD_MS']
+WATCHDOG_INTERVAL_MS = settings['WATCHDOG_INTERVAL_MS']
+MAX_STACK_FRAMES = 40  # Innermost frames of the stack kept in the log
+LAG_SMOOTHING = 0.3  # Weight of the last measure in the moving average of the lag
+
+watchdog = None  # The Watchdog of the IOLoop of the process, if enabled
+
+
+class Stall(object):
+	"""
+	Class with what the IOLoop was running when a stall was detected
+	"""
+
+	def __init__(self, deadline, stack, timeline):
+		"""
+		:param deadline: the time the IOLoop should have run the watchdog callback
+		:param stack: the stack of the IOLoop thread, as returned by traceback.extract_stack
+		:param timeline: the RequestTimeline of the request being handled, or None
+		:return:
+		"""
+		self.deadline = deadline
+		self.stack = stack
+		self.timeline = timeline
+
+	def to_dict(self, seconds):
+		"""
+		Get the stall as a dictionary, e.g. for a structured log record
+		:param seconds: the duration of the stall
+		:return: a dictionary with the duration, the request and the stack (innermost frame last)
+		"""
+		stall = {'ms': round(seconds * 1000, 1),
+		         'stack': ["{0}:{1} {2}".format(file_name, line_number, function_name)
+		                   for file_name, line_number, function_name, line in self.stack[-MAX_STACK_FRAMES:]]}
+		if self.timeline is not None:
+			stall.update({'request_id': self.timeline.request_id, 'handler': self.timeline.handler_name,
+			              'route': self.timeline.route})
+		return stall
+
+
+class Watchdog(object):
+	"""
+	Class to detect the stalls of an IOLoop from a background thread
+	"""
+
+	def __init__(self, io_loop, threshold, interval):
+		"""
+		:param io_loop: the IOLoop, run by the thread calling start
+		:param threshold: the number of seconds the IOLoop can be late before it is considered stalled
+		:param interval: the number of seconds between the deadlines of the IOLoop (and between checks)
+		:return:
+		"""
+		self.io_loop = io_loop
+		self.threshold = threshold
+		self.interval = interval
+		self._lock = threading.Lock()
+		self._deadline = None
+		self._stall = None  # The stall being detected, reported when the IOLoop runs again
+		self._loop_thread_id = None
+		self.lag = 0.0  # Moving average of the lag of the IOLoop, in seconds
+
+	def start(self):
+		"""
+		Start watching the IOLoop. It must be called from the thread of the IOLoop.
+		:return:
+		"""
+		self._loop_thread_id = threading.current_thread().ident
+		self._schedule()
+		thread = threading.Thread(target=self._watch, name="IOLoopWatchdog")
+		thread.daemon = True
+		thread.start()
+
+	def _schedule(self):
+		with self._lock:
+			self._deadline = self.io_loop.time() + self.interval
+		self.io_loop.add_timeout(self._deadline, self._tick)
+
+	def _tick(self):
+		"""
+		Run by the IOLoop: report the stall detected since the previous deadline, if any
+		"""
+		with self._lock:
+			stall = self._stall
+			self._stall = None
+			lag = max(self.io_loop.time() - self._deadline, 0)
+		self.lag += (lag - self.lag) * LAG_SMOOTHING
+		if stall is not None:
+			self._report(stall, self.io_loop.time() - stall.deadline)
+		self._schedule()
+
+	def _watch(self):
+		"""
+		Run by the background thread: check that the IOLoop keeps meeting its deadlines
+		"""
+		while True:
+			time.sleep(self.interval)
+			with self._lock:
+				if self._stall is not None or self.io_loop.time() - self._deadline < self.threshold:
+					continue
+				frame = sys._current_frames().get(self._loop_thread_id)
+				stack = traceback.extract_stack(frame) if frame is not None else []
+				self._stall = Stall(self._deadline, stack, request_timing.current())
+
+	def _report(self, stall, seconds):
+		route = stall.timeline.route if stall.timeline is not None else None
+		metrics.loop_stalls.inc(route or "none")
+		metrics.loop_stall_duration.observe(seconds)
+		logger.warning("IOLoop stall: {0}".format(json.dumps(stall.to_dict(seconds), sort_keys=True)))
+
+
+def start_watchdog(io_loop):
+	"""
+	Start watching an IOLoop for stalls longer than WATCHDOG_STALL_THRESHOLD_MS, if enabled
+	:param io_loop: the IOLoop, run by the calling thread
+	:return:
+	"""
+	global watchdog
+
+	if WATCHDOG_STALL_THRESHOLD_MS is not None:
+		watchdog = Watchdog(io_loop, WATCHDOG_STALL_THRESHOLD_MS / 1000.0, WATCHDOG_INTERVAL_MS / 1000.0)
+		watchdog.start()
+
+
+def get_loop_lag():
+	"""
+	Get the moving average of the lag of the IOLoop
+	:return: the lag in seconds, or 0 if the watchdog is not enabled
+	"""
+	return watchdog.lag if watchdog is not None else 0.0
@@ -0,0 +1,300 @@
+"""
+Module to maintain the asynchronous HTTP client used to access the WebAccess web services.
+Every request to the WebAccess server goes through this module, so that no call blocks the IOLoop.
+The idempotent requests still running after the usual (e.g. 95th percentile) time of their web service are hedged: a
+duplicate is sent, and the first response is used. A circuit breaker makes the requests fail right away while the
+WebAccess server is down, instead of waiting for its timeout.
+"""
+from collections import deque
+import functools
+import logging
+import math
+import sys
+import time
+from tornado import gen
+from tornado.concurrent import Future
+from tornado import httpclient
+from tornado.ioloop import IOLoop
+from lib.circuit_breaker import CircuitBreaker
+from lib import metrics
+from lib import request_timing
+from lib.upstream_scheduler import UpstreamScheduler, CLASS_INTERACTIVE, CLASS_PREFETCH
+from settings import settings
+
+# Global variables
+logger = logging.getLogger('ushop.' + __name__)
+WA_MAX_CONNECTIONS = settings['WA_MAX_CONNECTIONS']
+WA_CONNECT_TIMEOUT_SECONDS = settings['WA_CONNECT_TIMEOUT_SECONDS']
+WA_REQUEST_TIMEOUT_SECONDS = settings['WA_REQUEST_TIMEOUT_SECONDS']
+WA_MAX_PARALLEL_REQUESTS = settings['WA_MAX_PARALLEL_REQUESTS']
+WA_ROOT_URL = settings['WA_ROOT_URL']
+WA_UPSTREAM_MAX_CONCURRENT = settings['WA_UPSTREAM_MAX_CONCURRENT']
+WA_UPSTREAM_CLASS_LIMITS = settings['WA_UPSTREAM_CLASS_LIMITS']
+WA_UPSTREAM_ROUTE_CLASSES = settings['WA_UPSTREAM_ROUTE_CLASSES']
+WA_HEDGE_PERCENTILE = settings['WA_HEDGE_PERCENTILE']
+WA_HEDGE_MIN_DELAY_MS = settings['WA_HEDGE_MIN_DELAY_MS']
+WA_HEDGE_MIN_SAMPLES = settings['WA_HEDGE_MIN_SAMPLES']
+WA_HEDGE_WINDOW_SIZE = settings['WA_HEDGE_WINDOW_SIZE']
+WA_BREAKER_FAILURE_THRESHOLD = settings['WA_BREAKER_FAILURE_THRESHOLD']
+WA_BREAKER_RESET_SECONDS = settings['WA_BREAKER_RESET_SECONDS']
+
+in_flight = 0  # Number of WebAccess requests in flight (including those waiting for a connection)
+latencies = {}  # web service name -> the times of its last WA_HEDGE_WINDOW_SIZE successful requests
+
+
+class HedgedRequest(object):
+	"""
+	Class to send a request to the WebAccess server holding a slot of the scheduler and, if it is hedged and still
+	running after the hedge delay, a duplicate of it (only if a slot is free right away). The first successful response
+	is used; the other request cannot be cancelled, so it finishes in the background and releases its slot then.
+	"""
+
+	def __init__(self, request, ws_name, priority_class, timeline, hedge_delay):
+		"""
+		:param request: the HTTPRequest to send
+		:param ws_name: the name of the web service, for the metrics
+		:param priority_class: the priority class of the request, whose slot is already acquired
+		:param timeline: the RequestTimeline of the current request, or None
+		:param hedge_delay: the number of seconds before the duplicate is sent, or None (not hedged)
+		:return:
+		"""
+		self.request = request
+		self.ws_name = ws_name
+		self.priority_class = priority_class
+		self.timeline = timeline
+		self.hedge_delay = hedge_delay
+		self.future = Future()
+		self._running = 0
+		self._hedged = False
+		self._hedge_timeout = None
+
+	def start(self):
+		"""
+		Send the request
+		:return: a Future with the first successful HTTPResponse, or the error of the last failed request
+		"""
+		self._send(False)
+		if self.hedge_delay is not None:
+			self._hedge_timeout = IOLoop.current().call_later(self.hedge_delay, self._hedge)
+		return self.future
+
+	def _hedge(self):
+		self._hedge_timeout = None
+		if self.future.done() or is_circuit_open() or not scheduler.try_acquire(self.priority_class):
+			return
+		self._hedged = True
+		self._send(True)
+
+	def _send(self, hedge):
+		self._running += 1
+		http_future = httpclient.AsyncHTTPClient().fetch(self.request)
+		http_future.add_done_callback(functools.partial(self._on_response, hedge, time.time()))
+
+	def _on_response(self, hedge, start_time, http_future):
+		"""
+		Record a finished request, and resolve the Future with its response if it is the first successful one (or with
+		its error if no other request is running)
+		"""
+		self._running -= 1
+		scheduler.release(self.priority_class)
+		elapsed = time.time() - start_time
+		metrics.upstream_duration.observe(elapsed, "webaccess", self.ws_name)
+
+		error = http_future.exception()
+		if error is None:
+			status = http_future.result().code
+			latencies.setdefault(self.ws_name, deque(maxlen=WA_HEDGE_WINDOW_SIZE)).append(elapsed)
+		else:
+			status = getattr(error, 'code', "error")  # HTTPError or socket error
+			metrics.upstream_errors.inc("webaccess", self.ws_name, status)
+		if self.timeline is not None:
+			self.timeline.add_upstream_call("webaccess", self.ws_name, elapsed, status)
+		if breaker is not None:
+			# Any response below 500 (e.g. a 401 for wrong credentials) shows that the WebAccess server is up
+			if error is None or 0 < getattr(error, 'code', 0) < 500:
+				breaker.record_success()
+			elif breaker.record_failure():
+				logger.warning("WebAccess circuit opened after {0} consecutive failures".format(breaker.failures))
+
+		if self.future.done() or (error is not None and self._running > 0):
+			return
+		if self._hedge_timeout is not None:
+			IOLoop.current().remove_timeout(self._hedge_timeout)
+			self._hedge_timeout = None
+		if self._hedged:
+			metrics.upstream_hedges.inc(self.ws_name, "none" if error is not None else "hedge" if hedge else "original")
+		if error is None:
+			self.future.set_result(http_future.result())
+		else:
+			self.future.set_exc_info(http_future.exc_info())
+
+
+def configure_http_client():
+	"""
+	Configure the AsyncHTTPClient implementation used for all WebAccess requests.
+	The curl client is preferred, since it keeps the connections to the WebAccess host alive and reuses them.
+	If pycurl is not installed, the simple client is used instead (one connection per request).
+	In both cases, the number of simultaneous connections is limited to WA_MAX_CONNECTIONS and any additional
+	request is queued until a connection is free.
+	:return:
+	"""
+	try:
+		import pycurl
+		httpclient.AsyncHTTPClient.configure("tornado.curl_httpclient.CurlAsyncHTTPClient",
+		                                     max_clients=WA_MAX_CONNECTIONS)
+		logger.debug("Using curl HTTP client (pycurl {0})".format(pycurl.version))
+	except ImportError:
+		httpclient.AsyncHTTPClient.configure(None, max_clients=WA_MAX_CONNECTIONS)
+		logger.debug("pycurl not found, using simple HTTP client")
+
+
+@gen.coroutine
+def fetch(url, headers, method='GET', body=None, idempotent=None):
+	"""
+	Fetch a url from the WebAccess server without blocking the IOLoop
+	:param url: the full url of the web service
+	:param headers: the headers to send to the WebAccess server
+	:param method: HTTP method to use, default - GET
+	:param body: HTTP request body for POST request, default - None
+	:param idempotent: whether the request can be sent twice (hedged), default - None (only GET requests)
+	:return: the response body as a string object
+	:raise HTTPError: 599 right away if the WebAccess circuit is open
+	"""
+	global in_flight
+
+	# The correlation id of the current request is forwarded, so the request can be found in the WebAccess logs
+	timeline = request_timing.current()
+	if timeline is not None:
+		headers = headers.copy()
+		headers[request_timing.REQUEST_ID_HEADER] = timeline.request_id
+
+	request = httpclient.HTTPRequest(url, method=method, headers=headers, body=body,
+	                                 connect_timeout=WA_CONNECT_TIMEOUT_SECONDS,
+	                                 request_timeout=WA_REQUEST_TIMEOUT_SECONDS)
+	ws_name = get_web_service_name(url)
+	priority_class = get_priority_class(timeline)
+	if breaker is not None and not breaker.allow_request():
+		metrics.upstream_errors.inc("webaccess", ws_name, "circuit_open")
+		raise httpclient.HTTPError(599, "WebAccess circuit open")
+	if idempotent is None:
+		idempotent = method == 'GET'
+
+	in_flight += 1
+	try:
+		# Wait for a slot of the scheduler
+		try:
+			queue_seconds = yield scheduler.acquire(priority_class, headers.get("authorization"))
+		except httpclient.HTTPError, e:
+			metrics.upstream_errors.inc("webaccess", ws_name, "queue_timeout")
+			raise e
+		metrics.upstream_queue_wait.observe(queue_seconds, priority_class)
+		request_timing.record("queue", queue_seconds)
+
+		hedge_delay = get_hedge_delay(ws_name) if idempotent else None
+		response = yield HedgedRequest(request, ws_name, priority_class, timeline, hedge_delay).start()
+	finally:
+		in_flight -= 1
+
+	raise gen.Return(response.body)
+
+
+def get_priority_class(timeline):
+	"""
+	Get the priority class of the WebAccess requests of a request (see lib.upstream_scheduler)
+	:param timeline: the RequestTimeline of the request, or None outside of a request
+	:return: the class of the route of the request in WA_UPSTREAM_ROUTE_CLASSES (interactive if not listed), or
+	prefetch outside of a request
+	"""
+	if timeline is None:
+		return CLASS_PREFETCH
+	return WA_UPSTREAM_ROUTE_CLASSES.get(timeline.route, CLASS_INTERACTIVE)
+
+
+def get_hedge_delay(ws_name):
+	"""
+	Get the time after which a request to a web service is hedged: the WA_HEDGE_PERCENTILE of the times of its last
+	successful requests, and at least WA_HEDGE_MIN_DELAY_MS
+	:param ws_name: the name of the web service
+	:return: the delay in seconds, or None if hedging is disabled or there are fewer than WA_HEDGE_MIN_SAMPLES times
+	"""
+	if WA_HEDGE_PERCENTILE is None:
+		return None
+	ws_latencies = latencies.get(ws_name)
+	if ws_latencies is None or len(ws_latencies) < WA_HEDGE_MIN_SAMPLES:
+		return None
+
+	ws_latencies = sorted(ws_latencies)
+	index = max(int(math.ceil(len(ws_latencies) * WA_HEDGE_PERCENTILE / 100.0)) - 1, 0)
+	return max(ws_latencies[index], WA_HEDGE_MIN_DELAY_MS / 1000.0)
+
+
+def is_circuit_open():
+	"""
+	Check whether the requests to the WebAccess server are failing right away (see CircuitBreaker)
+	:return: True if the circuit is open (or half open, probing the server)
+	"""
+	return breaker is not None and not breaker.is_closed()
+
+
+def get_web_service_name(url):
+	"""
+	Get the name of the WebAccess web service of a url, e.g. for the metrics
+	:param url: the full url of the web service, e.g. "http://host/WaWebService/Json/TagList/85"
+	:return: the name of the web service, e.g. "TagList", or "other" if the url is not under WA_ROOT_URL
+	"""
+	if not url.startswith(WA_ROOT_URL):
+		return "other"
+
+	path = url[len(WA_ROOT_URL):].split('?', 1)[0].split('/')
+	if path[0].lower() == "json":
+		path = path[1:]
+	return path[0] if path and path[0] else "other"
+
+
+def start_tasks(tasks, max_parallel=WA_MAX_PARALLEL_REQUESTS):
+	"""
+	Start a list of asynchronous tasks concurrently, with at most max_parallel of them in flight at the same time.
+	The returned Futures can be consumed in order while the following tasks are still running.
+	:param tasks: list of functions without arguments, each of them returning a Future
+	:param max_parallel: the maximum number of tasks running at the same time, default - WA_MAX_PARALLEL_REQUESTS
+	:return: a list with one Future for the result of each task, in the same order as the given tasks
+	"""
+
+	futures = [Future() for _ in tasks]
+	pending_tasks = iter(zip(tasks, futures))  # Shared by all workers, so every task is run exactly once
+
+	@gen.coroutine
+	def worker():
+		for task, future in pending_tasks:
+			try:
+				result = yield task()
+			except Exception:
+				future.set_exc_info(sys.exc_info())
+			else:
+				future.set_result(result)
+
+	for _ in range(min(max_parallel, len(tasks))):
+		worker()
+
+	return futures
+
+
+@gen.coroutine
+def gather(tasks, max_parallel=WA_MAX_PARALLEL_REQUESTS):
+	"""
+	Run a list of asynchronous tasks concurrently, with at most max_parallel of them in flight at the same time
+	:param tasks: list of functions without arguments, each of them returning a Future
+	:param max_parallel: the maximum number of tasks running at the same time, default - WA_MAX_PARALLEL_REQUESTS
+	:return: the list of task results, in the same order as the given tasks
+	"""
+
+	results = yield start_tasks(tasks, max_parallel)
+
+	raise gen.Return(results)
+
+
+configure_http_client()
+scheduler = UpstreamScheduler(min(WA_UPSTREAM_MAX_CONCURRENT, WA_MAX_CONNECTIONS), WA_UPSTREAM_CLASS_LIMITS,
+                              WA_REQUEST_TIMEOUT_SECONDS)
+breaker = CircuitBreaker("WebAccess", WA_BREAKER_FAILURE_THRESHOLD, WA_BREAKER_RESET_SECONDS) \
+	if WA_BREAKER_FAILURE_THRESHOLD is not None else None
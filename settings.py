@@ -13,10 +13,12 @@ define("host", default="localhost", help="app host", type=str)
 define("port", default=8888, help="run on the given port", type=int)
 define("config", default=None, help="tornado config file")
 define("debug", default=False, help="debug mode")
+define("workers", default=1, help="number of worker processes (0 - one per CPU)", type=int)
 tornado.options.parse_command_line()
 
 STATIC_ROOT = path(ROOT, 'static')
 TEMPLATE_ROOT = path(ROOT, 'templates')
+DATA_ROOT = os.environ.get('USHOP_DATA_ROOT', path(ROOT, 'data'))  # The time series store and the shared caches
 
 
 # Deployment Configuration
@@ -42,12 +44,15 @@ else:
 settings = {}
 settings['debug'] = DEPLOYMENT != DeploymentType.PRODUCTION or options.debug
 settings['static_path'] = STATIC_ROOT
-settings['cookie_secret'] = "your-cookie-secret"
+# Secret signing the cookies (e.g. the credentials sessions), from the environment so it is never in the source. The
+# server does not start with sessions enabled and no secret.
+settings['cookie_secret'] = os.environ.get('USHOP_COOKIE_SECRET')
 settings['xsrf_cookies'] = True
 settings['template_loader'] = tornado.template.Loader(TEMPLATE_ROOT)
 
 # UShop specific settings
-settings['WA_ROOT_URL'] = "http://211.23.50.153/WaWebService/"  # The WebAccess web services URL
+# The WebAccess web services URL (e.g. of a test server, in USHOP_WA_ROOT_URL)
+settings['WA_ROOT_URL'] = os.environ.get('USHOP_WA_ROOT_URL', "http://211.23.50.153/WaWebService/")
 settings['SA_ROOT_URL'] = "http://localhost:8080/webresources/"  # The SUSIAccess server web services URL
 
 '''
@@ -57,14 +62,118 @@ The variable mapping the power_meter_id to data tag will look like this: MAPPING
 '''
 settings['WA_TAG_NAMES'] = [["kw"], "kw"]
 
-settings['FILE_EXPORT_PATH'] = "static/exportfiles"  # Relative path where export files will be stored
+settings['FILE_EXPORT_PATH'] = "static/exportfiles"  # Path of the export files under ROOT (also their url path)
+settings['FILE_EXPORT_ROOT'] = path(ROOT, settings['FILE_EXPORT_PATH'])  # Absolute directory of the export files
 settings['FILE_DELETE_INTERVAL_HOURS'] = 1  # Interval to run delete file export scheduled task
 settings['FILE_EXPORT_LIFETIME_HOURS'] = 1  # Number of hours export files can last in the system
+settings['FILE_EXPORT_MAX_MB'] = 1024  # Disk space for export files (least recently downloaded files are deleted first)
+settings['EXPORT_MAX_JOBS'] = 2  # Maximum number of export jobs writing files at the same time
 
 # WebAccess web service settings
 settings['PROJECT_NAME'] = "85"
 settings['NODE_NAME'] = "energy"
 settings['DATA_TYPE'] = "3"  # The DataType value for power metering data - 0 (last), 1 (min), 2 (max), 3 (avg)
+settings['METER_VALUE_DECIMALS'] = 3  # Decimals the returned power metering values (sums, averages) are rounded to
+settings['HISTORY_MAX_AGE_SECONDS'] = 24 * 60 * 60  # Time clients keep the history responses of past (settled) ranges
+
+# WebAccess HTTP client settings
+settings['WA_MAX_CONNECTIONS'] = 10  # Size of the pool of (keep-alive) connections to the WebAccess server
+settings['WA_CONNECT_TIMEOUT_SECONDS'] = 20  # Timeout for establishing a connection to the WebAccess server
+settings['WA_REQUEST_TIMEOUT_SECONDS'] = 60  # Timeout for a whole WebAccess web service request
+settings['WA_MAX_PARALLEL_REQUESTS'] = 4  # Maximum number of concurrent WebAccess requests made by a single API call
+settings['WA_MAX_RECORDS_PER_REQUEST'] = 768  # Maximum number of records asked in a single GetDataLog request
+
+# WebAccess upstream scheduler settings (limits of each worker process, see lib.upstream_scheduler)
+settings['WA_UPSTREAM_MAX_CONCURRENT'] = 8  # Maximum WebAccess requests sent at the same time (up to WA_MAX_CONNECTIONS)
+# Maximum concurrent requests of each priority class (interactive, comparison, export and prefetch)
+settings['WA_UPSTREAM_CLASS_LIMITS'] = {
+    'interactive': 8,
+    'comparison': 6,
+    'export': 3,
+    'prefetch': 2,
+}
+# Priority class of the WebAccess requests of each route (see BaseHandler.get_metrics_route). Requests of other routes
+# are interactive, and those made outside of a request (e.g. the cache warming) are prefetch.
+settings['WA_UPSTREAM_ROUTE_CLASSES'] = {
+    'get_energy_consumption_history_comparison': 'comparison',
+    'get_energy_consumption_history_export': 'export',
+    'submit_energy_consumption_history_export': 'export',
+}
+
+# WebAccess hedged requests and circuit breaker settings (see lib.webaccess_client)
+settings['WA_HEDGE_PERCENTILE'] = 95  # Percentile of the web service times after which reads are hedged, None - off
+settings['WA_HEDGE_MIN_DELAY_MS'] = 200  # Minimum time before a duplicate request is sent
+settings['WA_HEDGE_MIN_SAMPLES'] = 20  # Times of a web service needed before its requests are hedged
+settings['WA_HEDGE_WINDOW_SIZE'] = 200  # Last times of each web service used to compute the percentile
+settings['WA_BREAKER_FAILURE_THRESHOLD'] = 5  # Consecutive failures that open the WebAccess circuit, None - disabled
+settings['WA_BREAKER_RESET_SECONDS'] = 30  # Time between the probes of the WebAccess server while the circuit is open
+
+# WebAccess DataLog cache settings
+settings['WA_DATALOG_CACHE_MAX_MB'] = 64  # Memory limit of the DataLog cache (least recently used windows are evicted)
+settings['WA_DATALOG_CACHE_CURRENT_TTL_SECONDS'] = 60  # Time a DataLog window touching the current time is cached
+
+# Credentials settings
+settings['CREDENTIALS_TTL_SECONDS'] = 600  # Time credentials accepted by the WebAccess Logon are trusted without a new Logon
+settings['CREDENTIALS_REJECTED_TTL_SECONDS'] = 30  # Time rejected credentials are refused without calling WebAccess
+settings['CREDENTIALS_SESSION_COOKIE'] = "ushop_session"  # Name of the signed session cookie, None - no sessions
+
+# Worker processes settings (see the --workers option)
+settings['WORKER_MAX_RESTARTS'] = 100  # Number of times the worker processes are restarted after exiting abnormally
+# Directory of the caches shared by the workers, None - not shared
+settings['SHARED_CACHE_PATH'] = path(DATA_ROOT, 'cache') if options.workers != 1 else None
+settings['SHARED_CACHE_MAX_MB'] = 256  # Disk limit of each shared cache (oldest entries are deleted first)
+settings['SHARED_CACHE_CLEANUP_MINUTES'] = 10  # Interval to delete the expired and oldest entries of the shared caches
+# The first worker runs the export jobs of all the workers, which forward them to this port of the loopback interface
+settings['EXPORT_WORKER_PORT'] = options.port + 1 if options.workers != 1 else None
+settings['EXPORT_WORKER_TIMEOUT_SECONDS'] = 600  # Time a forwarded export request (e.g. waiting for its file) can take
+
+# Response cache settings
+settings['RESPONSE_CACHE_MAX_MB'] = 32  # Memory limit of the serialized history responses (least recently used are evicted)
+
+# WebAccess Tag metadata cache settings
+settings['WA_TAG_METADATA_TTL_SECONDS'] = 300  # Time the Tags (names, descriptions and types) of a Project are fresh
+settings['WA_TAG_METADATA_MAX_STALE_SECONDS'] = 3600  # Time expired Tags are still used while refreshed in background
+
+# Metrics settings (see the /metrics endpoint)
+settings['METRICS_ENABLED'] = True  # Whether the counters and latency histograms are served on /metrics
+settings['METRICS_LOOP_LAG_INTERVAL_SECONDS'] = 1  # Interval to measure the delay of the IOLoop callbacks
+# The time of the request phases is sent in a Server-Timing header, except in the streamed responses (e.g. export
+# files), whose headers are sent before the request is done
+settings['SERVER_TIMING_ENABLED'] = True  # Whether the Server-Timing header is sent
+settings['SLOW_REQUEST_THRESHOLD_MS'] = 2000  # Longer requests are logged with their timeline, None - not logged
+
+# IOLoop watchdog settings
+settings['WATCHDOG_STALL_THRESHOLD_MS'] = 500  # Callbacks blocking the IOLoop longer are logged, None - no watchdog
+settings['WATCHDOG_INTERVAL_MS'] = 100  # Interval of the IOLoop deadlines checked by the watchdog
+
+# Admission control settings (requests over the limits get a 503 with a Retry-After header)
+settings['ADMISSION_MAX_LOOP_LAG_MS'] = 250  # Maximum lag of the IOLoop (measured by the watchdog), None - no limit
+settings['ADMISSION_MAX_UPSTREAM_IN_FLIGHT'] = 40  # Maximum WebAccess requests in flight or queued, None - no limit
+settings['ADMISSION_LOW_PRIORITY_FRACTION'] = 0.5  # Low priority routes are rejected at this fraction of the limits
+settings['ADMISSION_RETRY_AFTER_SECONDS'] = 5  # Rejected clients are asked to retry after 1 to 2 times this time
+# Priority of each route (see BaseHandler.get_metrics_route): 0 - never rejected, 1 - normal (default), 2 - rejected first
+settings['ADMISSION_ROUTE_PRIORITIES'] = {
+    'get_power_meter': 0,
+    'MetricsHandler': 0,
+    'ProfilerHandler': 0,
+    'IndexHandler': 0,
+    'get_export_job_status': 0,
+    'get_energy_consumption_history_export': 2,
+    'submit_energy_consumption_history_export': 2,
+}
+
+# Profiler settings
+settings['PROFILER_USERS'] = []  # WebAccess users allowed to profile the server on /debug/profile, [] - disabled
+
+# Local time series store settings
+settings['TS_STORE_PATH'] = path(DATA_ROOT, 'timeseries')  # Directory of the stored 15-minute readings of each Tag
+settings['TS_STORE_SETTLE_MINUTES'] = 60  # Readings are only stored once they are older than this number of minutes
+
+# Cache warming settings
+settings['WARM_WA_USERNAME'] = None  # WebAccess user used to warm the caches in the background, None - disabled
+settings['WARM_WA_PASSWORD'] = ""  # Password of the WARM_WA_USERNAME user
+settings['WARM_INTERVAL_MINUTES'] = 15  # Interval to refresh the latest readings of all Tags (one reading interval)
+settings['WARM_DELAY_SECONDS'] = 60  # Delay after each interval boundary, so WebAccess has logged the new reading
 
 SYSLOG_TAG = "ushop"
 SYSLOG_FACILITY = logging.handlers.SysLogHandler.LOG_LOCAL2
@@ -0,0 +1,36 @@
+"""
+The tests of the UShop server, run from the root directory with:
+python -m unittest discover -s tests -t .
+The modules of the server read their settings when they are imported, so the settings of the tests are set here,
+before any test module imports them: the WebAccess server is a mock server (see mock_webaccess) listening on
+WA_PORT while a test runs.
+"""
+import logging
+import os
+import socket
+import sys
+
+
+def unused_port():
+    """
+    :return: a free port of the loopback interface
+    """
+    sock = socket.socket()
+    try:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+WA_PORT = unused_port()
+os.environ['USHOP_WA_ROOT_URL'] = "http://127.0.0.1:{0}/WaWebService/".format(WA_PORT)
+os.environ.setdefault('USHOP_COOKIE_SECRET', "test-secret")
+
+argv = sys.argv
+sys.argv = sys.argv[:1]  # The arguments of the test runner are not options of the server
+try:
+    import settings
+finally:
+    sys.argv = argv
+logging.getLogger('ushop').setLevel(logging.WARNING)  # Only the problems of the server, not its debug log
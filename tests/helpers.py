@@ -0,0 +1,88 @@
+"""
+Helpers of the tests: test cases with the mock WebAccess server listening on WA_PORT, which also reset the state the
+server modules keep between requests (caches, credentials, upstream latencies), so every test starts like a new server
+with an empty time series store.
+"""
+import shutil
+import tempfile
+from tornado.httpserver import HTTPServer
+from tornado.testing import AsyncTestCase, AsyncHTTPTestCase
+from tests import WA_PORT
+from tests import mock_webaccess
+from app import UShopWebServer
+from lib import credentials
+from lib import datalog
+from lib import response_cache
+from lib import tag_metadata
+from lib import webaccess_client
+from lib.timeseries_store import TimeSeriesStore
+
+AUTHORIZATION = mock_webaccess.AUTHORIZATION  # The credentials accepted by the mock WebAccess server
+HEADERS = {"Authorization": AUTHORIZATION}
+
+
+class WebAccessTestMixin(object):
+    """
+    Start the mock WebAccess server (with a GetDataLog delay of data_log_delay seconds) and reset the server state
+    before each test. webaccess_calls has the number of calls to each web service.
+    """
+    data_log_delay = 0.0
+
+    def start_webaccess(self):
+        self.store_path = tempfile.mkdtemp()
+        credentials.cache = credentials.CredentialCache(credentials.CREDENTIALS_TTL_SECONDS,
+                                                        credentials.CREDENTIALS_REJECTED_TTL_SECONDS)
+        datalog.cache.local.clear()
+        datalog.store = TimeSeriesStore(self.store_path)
+        datalog.stored_windows.clear()
+        response_cache.cache.local.clear()
+        tag_metadata.cache.invalidate()
+        webaccess_client.latencies.clear()
+        if webaccess_client.breaker is not None:
+            webaccess_client.breaker.record_success()
+
+        webaccess_app = mock_webaccess.make_app(self.data_log_delay)
+        self.webaccess_calls = webaccess_app.settings['calls']
+        self.webaccess_server = HTTPServer(webaccess_app, io_loop=self.io_loop)
+        self.webaccess_server.listen(WA_PORT, "127.0.0.1")
+
+    def stop_webaccess(self):
+        self.webaccess_server.stop()
+        datalog.store_executor.submit(datalog.store.close).result()  # After the pending writes
+        shutil.rmtree(self.store_path, ignore_errors=True)
+
+
+class WebAccessTestCase(WebAccessTestMixin, AsyncTestCase):
+    """
+    Test case of the modules that send requests to the WebAccess server
+    """
+
+    def setUp(self):
+        super(WebAccessTestCase, self).setUp()
+        self.start_webaccess()
+
+    def tearDown(self):
+        self.stop_webaccess()
+        super(WebAccessTestCase, self).tearDown()
+
+
+class ServerTestCase(WebAccessTestMixin, AsyncHTTPTestCase):
+    """
+    Test case of the web services of the server, with fetch sending the credentials accepted by the mock WebAccess
+    server (unless other headers are given)
+    """
+
+    def get_app(self):
+        return UShopWebServer(autoreload=False)
+
+    def setUp(self):
+        super(ServerTestCase, self).setUp()
+        self.start_webaccess()
+
+    def tearDown(self):
+        self.stop_webaccess()
+        super(ServerTestCase, self).tearDown()
+
+    def fetch(self, path, **kwargs):
+        kwargs.setdefault('headers', HEADERS)
+        return super(ServerTestCase, self).fetch(path, **kwargs)
@@ -0,0 +1,117 @@
+"""
+A mock WebAccess server for the tests, answering the web services used by the UShop server with deterministic
+15-minute readings. Only the user "admin" with an empty password is accepted.
+Run it on its own (e.g. for a server started with USHOP_WA_ROOT_URL=http://127.0.0.1:9911/WaWebService/) with:
+python tests/mock_webaccess.py 9911 [GetDataLog delay in seconds]
+"""
+import base64
+import datetime
+import json
+import sys
+import time
+import tornado.ioloop
+from tornado import gen
+from tornado.web import RequestHandler, Application, url
+
+AUTHORIZATION = "Basic " + base64.b64encode("admin:")
+TAG_NAMES = ("kw", "kw1")
+
+
+def reading(tag_name, reading_time):
+    """
+    :return: the 15-minute reading of a Tag at a time
+    """
+    slot = int(time.mktime(reading_time.timetuple()) // 900)
+    return (slot % 7) + (1 if tag_name == "kw1" else 0)
+
+
+class WebAccessHandler(RequestHandler):
+    """
+    Handler of the WebAccess web services, counting the calls to each of them in the calls dictionary of the
+    application
+    """
+
+    def initialize(self, data_log_delay=0.0):
+        self.data_log_delay = data_log_delay
+
+    def check_xsrf_cookie(self):
+        pass
+
+    @gen.coroutine
+    def get(self, ws_name):
+        if (yield self.start(ws_name)):
+            if ws_name == "Logon":
+                self.write({"Result": {"Ret": 0, "Total": 0}})
+            elif ws_name == "TagList":
+                self.write({"Result": {"Ret": 0, "Total": 2},
+                            "Tags": [{"Name": tag_name, "Description": tag_name} for tag_name in TAG_NAMES]})
+            else:
+                self.write({})
+
+    @gen.coroutine
+    def post(self, ws_name):
+        if not (yield self.start(ws_name)):
+            return
+
+        body = json.loads(self.request.body)
+        if ws_name == "GetDataLog":
+            self.write(data_log(body))
+        elif ws_name == "GetTagValue":
+            self.write({"Result": {"Ret": 0, "Total": len(body['Tags'])},
+                        "Values": [{"Name": tag['Name'], "Value": 1, "Quality": 1} for tag in body['Tags']]})
+        elif ws_name == "TagDetail":
+            self.write({"Result": {"Ret": 0, "Total": len(body['Tags'])},
+                        "Tags": [{"NAME": tag['Name'], "DESCRP": "x", "TYPE": "ANALOG"} for tag in body['Tags']]})
+
+    @gen.coroutine
+    def start(self, ws_name):
+        """
+        Count the call and check the credentials
+        :return: True if the web service can be answered
+        """
+        calls = self.application.settings['calls']
+        calls[ws_name] = calls.get(ws_name, 0) + 1
+        if self.request.headers.get("Authorization") != AUTHORIZATION:
+            self.set_status(401)
+            raise gen.Return(False)
+
+        if ws_name == "GetDataLog" and self.data_log_delay:
+            yield gen.sleep(self.data_log_delay)
+        raise gen.Return(True)
+
+
+def data_log(body):
+    """
+    :return: the response of GetDataLog, with the average of the 15-minute readings of each interval (and "#" for the
+    intervals that have not started yet)
+    """
+    start_time = datetime.datetime.strptime(body['StartTime'], "%Y-%m-%d %H:%M:%S")
+    step = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400}[body['IntervalType'].upper()] * int(body['Interval'])
+    readings_per_step = max(1, step // 900)
+    now = datetime.datetime.now()
+    data_logs = []
+    for tag in body['Tags']:
+        values = []
+        for record in range(int(body['Records'])):
+            record_time = start_time + datetime.timedelta(seconds=step * record)
+            readings = [reading(tag['Name'], record_time + datetime.timedelta(seconds=900 * index))
+                        for index in range(readings_per_step)]
+            value = sum(readings) / float(readings_per_step)
+            values.append("#" if record_time > now else ("%d" % value if value == int(value) else repr(value)))
+        data_logs.append({"Name": tag['Name'], "Total": len(values), "StartTime": body['StartTime'], "Values": values})
+
+    return {"Result": {"Ret": 0, "Total": len(data_logs)}, "DataLog": data_logs}
+
+
+def make_app(data_log_delay=0.0):
+    """
+    :param data_log_delay: the number of seconds GetDataLog takes, default - 0.0
+    :return: the Application of the mock server (its settings['calls'] has the number of calls to each web service)
+    """
+    return Application([url(r"/WaWebService/Json/([A-Za-z]+).*", WebAccessHandler,
+                            dict(data_log_delay=data_log_delay))], calls={})
+
+
+if __name__ == "__main__":
+    make_app(float(sys.argv[2]) if len(sys.argv) > 2 else 0.0).listen(int(sys.argv[1]) if len(sys.argv) > 1 else 9911)
+    tornado.ioloop.IOLoop.instance().start()
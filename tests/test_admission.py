@@ -0,0 +1,101 @@
+"""
+Tests of the admission control of the server (lib.admission).
+"""
+import json
+import unittest
+from lib import admission
+from lib import watchdog
+from lib import webaccess_client
+from lib.admission import AdmissionController, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from tests.helpers import HEADERS, ServerTestCase
+
+DAY_VIEW = "/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=d&interval=60"
+DAY_EXPORT = "/get_energy_consumption_history_export?power_meter_id=0&date=05/03/2015&datarange=d&interval=15"
+
+
+class LaggingWatchdog(object):
+    lag = 0.0
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.watchdog = watchdog.watchdog
+        self.in_flight = webaccess_client.in_flight
+        watchdog.watchdog = LaggingWatchdog()
+        webaccess_client.in_flight = 0
+        self.controller = AdmissionController(0.2, 10, 0.5, 5)
+
+    def tearDown(self):
+        watchdog.watchdog = self.watchdog
+        webaccess_client.in_flight = self.in_flight
+
+    def check(self):
+        return [self.controller.check(priority) for priority in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)]
+
+    def test_admitted(self):
+        self.assertEqual(self.check(), [None, None, None])
+
+    def test_loop_lag(self):
+        watchdog.watchdog.lag = 0.15
+        self.assertEqual(self.check(), [None, None, admission.REASON_LOOP_LAG])
+        watchdog.watchdog.lag = 0.25
+        self.assertEqual(self.check(), [None, admission.REASON_LOOP_LAG, admission.REASON_LOOP_LAG])
+
+    def test_upstream_backlog(self):
+        webaccess_client.in_flight = 6
+        self.assertEqual(self.check(), [None, None, admission.REASON_UPSTREAM_BACKLOG])
+        webaccess_client.in_flight = 11
+        self.assertEqual(self.check(), [None, admission.REASON_UPSTREAM_BACKLOG, admission.REASON_UPSTREAM_BACKLOG])
+
+    def test_no_limits(self):
+        webaccess_client.in_flight = 100
+        watchdog.watchdog.lag = 10
+        self.assertEqual(AdmissionController(None, None, 0.5, 5).check(PRIORITY_LOW), None)
+
+    def test_retry_after_spread(self):
+        retry_afters = set(self.controller.get_retry_after() for i in range(100))
+        self.assertTrue(retry_afters.issubset(range(5, 11)))
+        self.assertGreater(len(retry_afters), 1)
+
+    def test_route_priority(self):
+        self.assertEqual(admission.get_route_priority("get_power_meter"), PRIORITY_HIGH)
+        self.assertEqual(admission.get_route_priority("get_energy_consumption_history_export"), PRIORITY_LOW)
+        self.assertEqual(admission.get_route_priority("get_energy_consumption_history"), PRIORITY_NORMAL)
+
+
+class AdmissionTest(ServerTestCase):
+
+    def setUp(self):
+        super(AdmissionTest, self).setUp()
+        self.in_flight = webaccess_client.in_flight
+
+    def tearDown(self):
+        webaccess_client.in_flight = self.in_flight
+        super(AdmissionTest, self).tearDown()
+
+    def overload(self, fraction):
+        webaccess_client.in_flight = int(admission.controller.max_upstream_in_flight * fraction) + 1
+
+    def test_overloaded(self):
+        self.overload(1.0)
+        response = self.fetch(DAY_VIEW)
+        self.assertEqual(response.code, 503)
+        self.assertIn(int(response.headers['Retry-After']), range(5, 11))
+        self.assertEqual(json.loads(response.body)['error_code'], "0007")
+        self.assertEqual(self.webaccess_calls, {})  # Not even a Logon
+
+    def test_low_priority_rejected_first(self):
+        self.overload(admission.controller.low_priority_fraction)
+        self.assertEqual(self.fetch(DAY_EXPORT).code, 503)
+        self.assertEqual(self.fetch(DAY_VIEW).code, 200)
+
+    def test_revalidation_admitted(self):
+        etag = self.fetch(DAY_VIEW).headers['Etag']
+        self.overload(1.0)
+        self.assertEqual(self.fetch(DAY_VIEW, headers=dict(HEADERS, **{"If-None-Match": etag})).code, 304)
+        self.assertEqual(self.fetch(DAY_VIEW).code, 200)  # Already serialized in the response cache
+
+
+if __name__ == "__main__":
+    unittest.main()
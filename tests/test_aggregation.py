@@ -0,0 +1,64 @@
+"""
+Tests of the aggregation of the 15-minute series (lib.aggregation), with and without NumPy.
+"""
+import math
+import unittest
+from lib import aggregation
+
+TAG_READINGS = {"kw": [1.0, 2.0, None, 4.0, None, None, None, None, 5.0],
+                "kw1": [0.5, None, 1.5, 2.5, 3.0, None, 1.0, None, None]}
+
+
+def to_lists(matrix):
+    """
+    :return: the rows of a matrix as lists, with None for the missing readings
+    """
+    return [[None if reading is None or math.isnan(reading) else reading for reading in row] for row in matrix]
+
+
+class AggregationTest(unittest.TestCase):
+    numpy = aggregation.numpy
+
+    def setUp(self):
+        self.installed_numpy = aggregation.numpy
+        aggregation.numpy = self.numpy
+        self.matrix = aggregation.build_matrix(TAG_READINGS, ["kw", "kw1"])
+
+    def tearDown(self):
+        aggregation.numpy = self.installed_numpy
+
+    def test_rollup_average(self):
+        self.assertEqual(to_lists(aggregation.rollup(self.matrix, 4, '3')),
+                         [[7.0 / 3, None, 5.0], [1.5, 2.0, None]])
+
+    def test_rollup_last_min_max(self):
+        self.assertEqual(to_lists(aggregation.rollup(self.matrix, 4, '0')), [[4.0, None, 5.0], [2.5, 1.0, None]])
+        self.assertEqual(to_lists(aggregation.rollup(self.matrix, 4, '1')), [[1.0, None, 5.0], [0.5, 1.0, None]])
+        self.assertEqual(to_lists(aggregation.rollup(self.matrix, 4, '2')), [[4.0, None, 5.0], [2.5, 3.0, None]])
+
+    def test_rollup_by_one(self):
+        self.assertEqual(to_lists(aggregation.rollup(self.matrix, 1, '3')), to_lists(self.matrix))
+
+    def test_sum_tags(self):
+        self.assertEqual(aggregation.sum_tags(self.matrix), [1.5, 2.0, 1.5, 6.5, 3.0, 0.0, 1.0, 0.0, 5.0])
+
+
+class AggregationWithoutNumPyTest(AggregationTest):
+    numpy = None
+
+
+class ValuesTest(unittest.TestCase):
+
+    def test_to_number(self):
+        self.assertEqual(aggregation.to_number(305.40000000000003), 305.4)
+        self.assertEqual(aggregation.to_number(2.0), 2)
+        self.assertIsInstance(aggregation.to_number(2.0), int)
+        self.assertEqual(aggregation.to_number(1.23456), round(1.23456, aggregation.METER_VALUE_DECIMALS))
+
+    def test_total_and_split(self):
+        self.assertEqual(aggregation.total([1.5, 2.5]), 4.0)
+        self.assertEqual(aggregation.split(range(5), 2), [[0, 1], [2, 3], [4]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+"""
+Tests of the circuit breaker of the WebAccess requests (lib.circuit_breaker) and of the hedged requests of
+lib.webaccess_client.
+"""
+from collections import deque
+import time
+import unittest
+from tornado import gen
+from tornado import httpclient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port, gen_test
+from tornado.web import Application, RequestHandler
+from handlers import webaccess
+from lib import credentials
+from lib import metrics
+from lib import webaccess_client
+from lib.circuit_breaker import CircuitBreaker, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN
+from tests import unused_port
+from tests.helpers import WebAccessTestCase
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker("test", 3, 60)
+
+    def open(self):
+        for i in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.assertFalse(self.breaker.record_failure())
+        self.assertFalse(self.breaker.record_failure())
+        self.assertTrue(self.breaker.record_failure())
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        self.assertFalse(self.breaker.is_closed())
+        self.assertEqual(self.breaker.stats()['opens'], 1)
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.record_failure())
+        self.assertTrue(self.breaker.is_closed())
+
+    def test_open_rejects_requests(self):
+        self.open()
+        self.assertFalse(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.stats()['rejections'], 2)
+
+    def test_probe_success_closes(self):
+        self.breaker.reset_timeout = 0
+        self.open()
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, STATE_HALF_OPEN)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.stats(), {'state': STATE_CLOSED, 'failures': 0, 'opens': 1, 'rejections': 0})
+
+    def test_probe_failure_reopens(self):
+        self.breaker.reset_timeout = 0.05
+        self.open()
+        time.sleep(0.06)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())  # Only one probe at a time
+        self.assertFalse(self.breaker.record_failure())
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        self.assertEqual(self.breaker.stats()['opens'], 1)
+        self.assertFalse(self.breaker.allow_request())
+
+
+class WebAccessBreakerTest(WebAccessTestCase):
+
+    def setUp(self):
+        super(WebAccessBreakerTest, self).setUp()
+        self.reset_timeout = webaccess_client.breaker.reset_timeout
+        webaccess_client.breaker.reset_timeout = 0.2
+        self.headers = credentials.basic_headers("admin", "")
+        self.down_url = "http://127.0.0.1:{0}/WaWebService/Json/Logon".format(unused_port())
+
+    def tearDown(self):
+        webaccess_client.breaker.reset_timeout = self.reset_timeout
+        webaccess_client.breaker.record_success()
+        super(WebAccessBreakerTest, self).tearDown()
+
+    @gen.coroutine
+    def open_circuit(self):
+        for i in range(webaccess_client.breaker.failure_threshold):
+            with self.assertRaises(Exception):
+                yield webaccess_client.fetch(self.down_url, self.headers)
+
+    @gen_test
+    def test_open_circuit_fails_fast(self):
+        yield self.open_circuit()
+        self.assertTrue(webaccess_client.is_circuit_open())
+        with self.assertRaises(httpclient.HTTPError) as context:
+            yield webaccess_client.fetch(webaccess.WA_ROOT_URL + "Json/Logon", self.headers)
+        self.assertEqual(context.exception.code, 599)
+        self.assertNotIn('Logon', self.webaccess_calls)
+
+    @gen_test
+    def test_probe_closes_circuit(self):
+        yield self.open_circuit()
+        yield gen.sleep(0.25)
+        yield webaccess_client.fetch(webaccess.WA_ROOT_URL + "Json/Logon", self.headers)
+        self.assertFalse(webaccess_client.is_circuit_open())
+        self.assertEqual(self.webaccess_calls['Logon'], 1)
+
+    @gen_test
+    def test_rejected_credentials_do_not_open_circuit(self):
+        for i in range(webaccess_client.breaker.failure_threshold):
+            with self.assertRaises(httpclient.HTTPError):
+                yield webaccess_client.fetch(webaccess.WA_ROOT_URL + "Json/Logon", credentials.basic_headers("bad", ""))
+        self.assertFalse(webaccess_client.is_circuit_open())
+
+
+class SlowFirstHandler(RequestHandler):
+    """
+    Handler answering its first request after slow_seconds, and the others right away
+    """
+
+    def initialize(self, calls, slow_seconds):
+        self.calls = calls
+        self.slow_seconds = slow_seconds
+
+    @gen.coroutine
+    def get(self):
+        yield self.answer()
+
+    @gen.coroutine
+    def post(self):
+        yield self.answer()
+
+    @gen.coroutine
+    def answer(self):
+        self.calls.append(self.request.method)
+        call = len(self.calls)
+        if call == 1:
+            yield gen.sleep(self.slow_seconds)
+        self.write("call {0}".format(call))
+
+
+class HedgedRequestTest(WebAccessTestCase):
+    slow_seconds = 0.6
+
+    def setUp(self):
+        super(HedgedRequestTest, self).setUp()
+        self.calls = []
+        sock, port = bind_unused_port()
+        self.server = HTTPServer(Application([(r"/.*", SlowFirstHandler,
+                                               dict(calls=self.calls, slow_seconds=self.slow_seconds))]),
+                                 io_loop=self.io_loop)
+        self.server.add_sockets([sock])
+        self.url = "http://127.0.0.1:{0}/slow".format(port)
+        # Usual time of the web service: the hedge delay is WA_HEDGE_MIN_DELAY_MS
+        webaccess_client.latencies['other'] = deque([0.01] * webaccess_client.WA_HEDGE_MIN_SAMPLES,
+                                                    maxlen=webaccess_client.WA_HEDGE_WINDOW_SIZE)
+
+    def tearDown(self):
+        self.server.stop()
+        super(HedgedRequestTest, self).tearDown()
+
+    def test_hedge_delay(self):
+        self.assertEqual(webaccess_client.get_hedge_delay('other'), webaccess_client.WA_HEDGE_MIN_DELAY_MS / 1000.0)
+        webaccess_client.latencies['other'].extend([5.0] * webaccess_client.WA_HEDGE_MIN_SAMPLES)
+        self.assertEqual(webaccess_client.get_hedge_delay('other'), 5.0)
+        self.assertIsNone(webaccess_client.get_hedge_delay('TagList'))  # Too few samples
+
+    @gen_test
+    def test_hedge_wins(self):
+        hedges = metrics.upstream_hedges._values.get(('other', 'hedge'), 0)
+        start_time = time.time()
+        body = yield webaccess_client.fetch(self.url, {})
+        self.assertLess(time.time() - start_time, self.slow_seconds)
+        self.assertEqual(body, "call 2")
+        self.assertEqual(metrics.upstream_hedges._values.get(('other', 'hedge'), 0), hedges + 1)
+        yield gen.sleep(self.slow_seconds)  # The original request releases its slot of the scheduler
+        self.assertEqual(len(self.calls), 2)
+
+    @gen_test
+    def test_post_not_hedged(self):
+        start_time = time.time()
+        body = yield webaccess_client.fetch(self.url, {}, 'POST', "{}")
+        self.assertGreaterEqual(time.time() - start_time, self.slow_seconds)
+        self.assertEqual(body, "call 1")
+        self.assertEqual(self.calls, ['POST'])
+
+
+if __name__ == "__main__":
+    unittest.main()
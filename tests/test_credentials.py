@@ -0,0 +1,110 @@
+"""
+Tests of the verification of the credentials with the WebAccess server (lib.credentials) and of the sessions.
+"""
+import base64
+import json
+import socket
+import unittest
+from tornado.testing import gen_test
+from handlers.base import CREDENTIALS_SESSION_COOKIE
+from lib import credentials
+from tests.helpers import AUTHORIZATION, ServerTestCase, WebAccessTestCase
+
+REJECTED_AUTHORIZATION = "Basic " + base64.b64encode("admin:wrong")
+DAY_VIEW = "/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=d&interval=60"
+
+
+class CredentialCacheTest(WebAccessTestCase):
+
+    @gen_test
+    def test_accepted_cached(self):
+        user_credentials = yield credentials.cache.authenticate(AUTHORIZATION)
+        self.assertEqual(user_credentials.username, "admin")
+        self.assertTrue(user_credentials.verified)
+        self.assertTrue(credentials.cache.is_verified(user_credentials.wa_headers))
+        cached_credentials = yield credentials.cache.authenticate(AUTHORIZATION)
+        self.assertIs(cached_credentials, user_credentials)
+        self.assertEqual(self.webaccess_calls['Logon'], 1)
+
+    @gen_test
+    def test_concurrent_logons_coalesced(self):
+        results = yield [credentials.cache.authenticate(AUTHORIZATION) for i in range(3)]
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(self.webaccess_calls['Logon'], 1)
+
+    @gen_test
+    def test_rejected_cached(self):
+        for i in range(2):
+            user_credentials = yield credentials.cache.authenticate(REJECTED_AUTHORIZATION)
+            self.assertIsNone(user_credentials)
+        self.assertEqual(self.webaccess_calls['Logon'], 1)
+        self.assertFalse(credentials.cache.is_verified(credentials.basic_headers("admin", "wrong")))
+
+    @gen_test
+    def test_invalid_header_rejected_without_logon(self):
+        user_credentials = yield credentials.cache.authenticate("Basic not base64!")
+        self.assertIsNone(user_credentials)
+        self.assertNotIn('Logon', self.webaccess_calls)
+
+    @gen_test
+    def test_unavailable_webaccess_not_cached(self):
+        self.webaccess_server.stop()
+        with self.assertRaises(socket.error):  # Not an HTTPError, nor a rejection
+            yield credentials.cache.authenticate(AUTHORIZATION)
+        self.assertFalse(credentials.cache.is_verified(credentials.basic_headers("admin", "")))
+
+    def test_digest_hides_credentials(self):
+        digest = credentials.cache.digest(AUTHORIZATION)
+        self.assertNotIn(AUTHORIZATION, digest)
+        self.assertNotEqual(digest, credentials.CredentialCache(60, 60).digest(AUTHORIZATION))  # Salted
+
+    @gen_test
+    def test_session(self):
+        user_credentials = yield credentials.cache.authenticate(AUTHORIZATION)
+        session_id = credentials.cache.get_session_id(user_credentials)
+        self.assertEqual(credentials.cache.get_session_id(user_credentials), session_id)
+        self.assertIs(credentials.cache.get_session(session_id), user_credentials)
+        self.assertIsNone(credentials.cache.get_session("unknown"))
+
+
+class AuthenticationTest(ServerTestCase):
+
+    def test_missing_credentials(self):
+        response = self.fetch(DAY_VIEW, headers={})
+        self.assertEqual(response.code, 401)
+        self.assertEqual(response.headers['WWW-Authenticate'], "Basic realm=Restricted")
+
+    def test_rejected_credentials(self):
+        for i in range(2):
+            response = self.fetch(DAY_VIEW, headers={"Authorization": REJECTED_AUTHORIZATION})
+            self.assertEqual(json.loads(response.body)['error_code'], "0005")
+        self.assertEqual(self.webaccess_calls['Logon'], 1)
+        self.assertNotIn('GetDataLog', self.webaccess_calls)
+
+    def test_unavailable_webaccess(self):
+        self.webaccess_server.stop()
+        response = self.fetch(DAY_VIEW)
+        self.assertEqual(response.code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(json.loads(response.body)['error_code'], "0001")
+
+    def test_session_cookie(self):
+        response = self.fetch(DAY_VIEW)
+        cookie = response.headers['Set-Cookie'].split(';', 1)[0]
+        self.assertTrue(cookie.startswith(CREDENTIALS_SESSION_COOKIE + "="))
+
+        response = self.fetch(DAY_VIEW, headers={"Cookie": cookie})
+        self.assertIn('energy_consumption_day', json.loads(response.body))
+        self.assertEqual(self.webaccess_calls['Logon'], 1)
+
+        # The credentials sent always win over the session
+        response = self.fetch(DAY_VIEW, headers={"Cookie": cookie, "Authorization": REJECTED_AUTHORIZATION})
+        self.assertEqual(json.loads(response.body)['error_code'], "0005")
+
+    def test_forged_session_cookie(self):
+        response = self.fetch(DAY_VIEW, headers={"Cookie": CREDENTIALS_SESSION_COOKIE + "=forged"})
+        self.assertEqual(response.code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Tests of the retrieval of the DataLog windows (lib.datalog) and of the day view built on them.
+"""
+import datetime
+import json
+import time
+import unittest
+from tornado.testing import gen_test
+from lib import credentials
+from lib import datalog
+from lib import request_timing
+from tests import mock_webaccess
+from tests.helpers import ServerTestCase, WebAccessTestCase
+
+DAY = datetime.datetime(2015, 5, 3)
+WINDOW = datetime.timedelta(hours=6)
+
+
+def expected_readings(start_time, readings):
+    """
+    :return: the 15-minute readings of the Tag kw of the mock WebAccess server
+    """
+    return [float(mock_webaccess.reading("kw", start_time + datetime.timedelta(minutes=15 * index)))
+            for index in range(readings)]
+
+
+class DataLogWindowsTest(WebAccessTestCase):
+    data_log_delay = 0.2
+
+    def setUp(self):
+        super(DataLogWindowsTest, self).setUp()
+        self.headers = credentials.basic_headers("admin", "")
+
+    def start_windows(self, window_start_times):
+        # Sent from an interactive request, whose WebAccess requests can all run at the same time
+        timeline = request_timing.RequestTimeline("test", "Test", "get_energy_consumption_history")
+        with request_timing.context(timeline):
+            return datalog.start_data_log_windows(self.headers, ["kw"], window_start_times, 'M', 15, 24, "3")
+
+    @gen_test
+    def test_contiguous_windows_in_one_request(self):
+        window_start_times = [DAY + WINDOW * index for index in range(4)]
+        windows = yield self.start_windows(window_start_times)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+        for window_start_time, window in zip(window_start_times, windows):
+            self.assertEqual(window["kw"].readings(), expected_readings(window_start_time, 24))
+
+    @gen_test
+    def test_separate_windows_fetched_concurrently(self):
+        window_start_times = [DAY + WINDOW * index for index in (0, 2, 4, 6)]
+        start_time = time.time()
+        windows = yield self.start_windows(window_start_times)
+        self.assertLess(time.time() - start_time, 2 * self.data_log_delay)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 4)
+        self.assertEqual([window["kw"].readings() for window in windows],
+                         [expected_readings(window_start_time, 24) for window_start_time in window_start_times])
+
+    @gen_test
+    def test_base_series(self):
+        tag_readings = yield datalog.get_base_series(self.headers, ["kw"], DAY, 96 + 10, "3")
+        self.assertEqual(tag_readings["kw"], expected_readings(DAY, 96 + 10))
+
+
+class DayViewTest(ServerTestCase):
+    data_log_delay = 0.2
+
+    def test_day_view(self):
+        start_time = time.time()
+        response = self.fetch("/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=d&"
+                              "interval=60")
+        self.assertLess(time.time() - start_time, 2 * self.data_log_delay)
+        result = json.loads(response.body)
+        readings = expected_readings(DAY, 96)
+        hourly = [sum(readings[index:index + 4]) / 4 for index in range(0, 96, 4)]
+        self.assertEqual(result['energy_consumption_day'], [{"time_0_24": hourly}])
+        self.assertEqual(result['sum'], sum(hourly))
+
+
+class MonthViewTest(ServerTestCase):
+    path = "/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=m&interval=1"
+
+    def assert_month(self, result):
+        readings = expected_readings(datetime.datetime(2015, 5, 1), 31 * 96)
+        daily = [sum(readings[index:index + 96]) / 96 for index in range(0, 31 * 96, 96)]
+        for value, expected_value in zip(result['energy_consumption_month'][0]['day_1_31'], daily):
+            self.assertAlmostEqual(value, expected_value, places=3)
+
+    def test_month_not_stored_in_one_request(self):
+        self.assert_month(json.loads(self.fetch(self.path).body))
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+
+    def test_stored_month_rolled_up(self):
+        headers = credentials.basic_headers("admin", "")
+        self.io_loop.run_sync(lambda: datalog.get_base_series(headers, ["kw"], datetime.datetime(2015, 5, 1), 31 * 96,
+                                                              "3"))
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 4)
+        self.assert_month(json.loads(self.fetch(self.path).body))
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
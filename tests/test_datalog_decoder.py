@@ -0,0 +1,71 @@
+"""
+Tests of the decoding of the GetDataLog responses (lib.datalog_decoder).
+"""
+import json
+import math
+import struct
+import unittest
+from lib import datalog_decoder
+from lib.datalog_decoder import DataLogSeries
+
+
+def data_log_string(tag_values):
+    return json.dumps({"Result": {"Ret": 0, "Total": len(tag_values)},
+                       "DataLog": [{"Name": tag_name, "Total": len(values), "StartTime": "2015-05-03 00:00:00",
+                                    "Values": values} for tag_name, values in sorted(tag_values.items())]})
+
+
+class DecodeDataLogTest(unittest.TestCase):
+
+    def test_all_values(self):
+        tag_series = datalog_decoder.decode_data_log(data_log_string({"kw": ["12.5", "13", "0"]}))
+        self.assertEqual(tag_series.keys(), ["kw"])
+        self.assertEqual(tag_series["kw"].readings(), [12.5, 13.0, 0.0])
+        self.assertEqual(list(tag_series["kw"].missing), [0, 0, 0])
+
+    def test_missing_mask(self):
+        tag_series = datalog_decoder.decode_data_log(data_log_string({"kw": ["1", "#", "2.5", "#"],
+                                                                      "kw1": ["#", "#"]}))
+        self.assertEqual(list(tag_series["kw"].missing), [0, 1, 0, 1])
+        self.assertEqual(tag_series["kw"].readings(), [1.0, None, 2.5, None])
+        self.assertTrue(math.isnan(tag_series["kw"].values[1]))
+        self.assertEqual(tag_series["kw1"].readings(), [None, None])
+
+    def test_non_finite_values_missing(self):
+        self.assertEqual(datalog_decoder.decode_values(["1", "nan", "inf", "-inf"]).readings(), [1.0, None, None, None])
+        self.assertEqual(datalog_decoder.decode_values(["#", "-Infinity", "2"]).readings(), [None, None, 2.0])
+        self.assertEqual(list(datalog_decoder.decode_values(["NaN", "3"]).missing), [1, 0])
+
+    def test_statistics(self):
+        before = datalog_decoder.stats()
+        data = data_log_string({"kw": ["1", "2"], "kw1": ["#"]})
+        datalog_decoder.decode_data_log(data)
+        after = datalog_decoder.stats()
+        self.assertEqual(after['values'] - before['values'], 3)
+        self.assertEqual(after['bytes'] - before['bytes'], len(data))
+
+
+class DataLogSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.series = datalog_decoder.decode_values(["1", "#", "3", "4"])
+
+    def test_slice(self):
+        part = self.series.slice(1, 3)
+        self.assertEqual(len(part), 2)
+        self.assertEqual(part.readings(), [None, 3.0])
+
+    def test_string_round_trip(self):
+        series = DataLogSeries.from_string(self.series.to_string())
+        self.assertEqual(series.readings(), [1.0, None, 3.0, 4.0])
+        self.assertEqual(list(series.missing), [0, 1, 0, 0])
+        self.assertEqual(DataLogSeries.from_string(DataLogSeries.to_string(series.slice(0, 0))).readings(), [])
+
+    def test_string_little_endian(self):
+        data = datalog_decoder.decode_values(["1.5", "#"]).to_string()
+        self.assertEqual(struct.unpack('<Id', data[:12]), (2, 1.5))
+        self.assertEqual(data[20:], "\x00\x01")
+
+
+if __name__ == "__main__":
+    unittest.main()
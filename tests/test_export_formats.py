@@ -0,0 +1,124 @@
+"""
+Tests of the file formats of the energy consumption exports (lib.export_formats).
+"""
+import calendar
+import datetime
+import gzip
+import json
+import math
+import struct
+import unittest
+import zlib
+from StringIO import StringIO
+from lib import export_formats
+from tests.helpers import HEADERS
+from tests.test_exports import ExportTestCase, MONTH_ARGUMENTS
+
+START_TIME = datetime.datetime(2015, 5, 3)
+TOTALS = [1.5, 2.0, 305.40000000000003]
+TAG_READINGS = {"kw": [1.0, 2.0, 300.0], "kw1": [0.5, None, 5.4]}
+
+
+def write_file(export_format, windows=2):
+    """
+    :return: the chunks of a file of windows x 3 readings at 15 minutes
+    """
+    chunks = [export_format.start(START_TIME, 15, ["kw", "kw1"])]
+    for window in range(windows):
+        chunks.append(export_format.window(START_TIME + datetime.timedelta(minutes=45 * window), 15, TOTALS,
+                                           TAG_READINGS))
+    chunks.append(export_format.finish())
+    return chunks
+
+
+class ExportFormatsTest(unittest.TestCase):
+
+    def test_csv(self):
+        self.assertEqual("".join(write_file(export_formats.get_export_format('csv'), 1)),
+                         "date,time,electricity consumption\n"
+                         "2015/05/03,00:00,1.5\n"
+                         "2015/05/03,00:15,2\n"
+                         "2015/05/03,00:30,305.4\n")
+
+    def test_ndjson(self):
+        lines = "".join(write_file(export_formats.get_export_format('ndjson'))).splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json.loads(lines[0]), {"date": "2015/05/03", "time": "00:00", "electricity_consumption": 1.5})
+        self.assertEqual(json.loads(lines[5])['time'], "01:15")
+
+    def test_csv_gz(self):
+        data = "".join(write_file(export_formats.get_export_format('csv_gz')))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(),
+                         "".join(write_file(export_formats.get_export_format('csv'))))
+
+    def test_flushed_windows_decompressed_as_received(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = write_file(export_formats.get_export_format('csv_gz', flush_windows=True))
+        self.assertEqual(decompressor.decompress(chunks[0] + chunks[1]).splitlines()[-1], "2015/05/03,00:30,305.4")
+
+    def test_binary(self):
+        data = "".join(write_file(export_formats.get_export_format('binary')))
+        magic, version, start_seconds, interval_seconds, columns = struct.unpack_from('<4sBqIH', data)
+        self.assertEqual((magic, version, interval_seconds, columns), ("USCE", 1, 900, 3))
+        self.assertEqual(start_seconds, calendar.timegm(START_TIME.timetuple()))
+
+        offset = struct.calcsize('<4sBqIH')
+        column_names = []
+        for column in range(columns):
+            length = struct.unpack_from('<H', data, offset)[0]
+            column_names.append(data[offset + 2:offset + 2 + length])
+            offset += 2 + length
+        self.assertEqual(column_names, ["total", "kw", "kw1"])
+
+        blocks = []
+        while offset < len(data):
+            readings = struct.unpack_from('<I', data, offset)[0]
+            blocks.append(struct.unpack_from('<%dd' % (readings * columns), data, offset + 4))
+            offset += 4 + readings * columns * 8
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(blocks[0][:6], tuple(TOTALS) + tuple(TAG_READINGS["kw"]))
+        self.assertTrue(math.isnan(blocks[0][7]))
+
+    def test_unknown_format(self):
+        self.assertIsNone(export_formats.get_export_format('xls'))
+
+    def test_file_type(self):
+        self.assertEqual(export_formats.get_file_type("a.csv"), ("text/csv; charset=utf-8", None))
+        self.assertEqual(export_formats.get_file_type("a.csv.gz"), ("text/csv; charset=utf-8", "gzip"))
+        self.assertEqual(export_formats.get_file_type("a.bin"), ("application/octet-stream", None))
+        self.assertEqual(export_formats.get_file_type("a.txt"), (None, None))
+
+
+class ExportFormatDownloadTest(ExportTestCase):
+
+    def export_link(self, export_format_name):
+        return self.fetch_json("/get_energy_consumption_history_export?format={0}&{1}".format(
+            export_format_name, MONTH_ARGUMENTS))['csv_file_link']
+
+    def test_compressed_download(self):
+        csv_body = self.fetch_link(self.export_link('csv')).body
+        link = self.export_link('csv_gz')
+        self.assertTrue(link.endswith(".csv.gz"))
+
+        response = self.fetch_link(link, headers=dict(HEADERS, **{"Accept-Encoding": "gzip"}),
+                                   decompress_response=False)
+        self.assertEqual(response.headers['Content-Encoding'], "gzip")
+        self.assertEqual(response.headers['Content-Type'], "text/csv; charset=utf-8")
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(response.body)).read(), csv_body)
+
+        response = self.fetch_link(link, decompress_response=False)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['Content-Type'], "application/gzip")
+
+    def test_ndjson_download(self):
+        response = self.fetch_link(self.export_link('ndjson'))
+        self.assertEqual(response.headers['Content-Type'], "application/x-ndjson; charset=utf-8")
+        self.assertEqual(len(response.body.splitlines()), 31 * 96)
+
+    def test_streamed_unknown_format(self):
+        result = self.fetch_json("/get_energy_consumption_history_export?stream=1&format=xls&" + MONTH_ARGUMENTS)
+        self.assertEqual(result['error_code'], "0006")
+
+
+if __name__ == "__main__":
+    unittest.main()
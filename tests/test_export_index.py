@@ -0,0 +1,112 @@
+"""
+Tests of the index of the export files (lib.export_index).
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from tornado.testing import AsyncTestCase, gen_test
+from lib import export_index
+from lib.export_index import ExportFileIndex
+from tests.test_exports import ExportTestCase
+
+
+class ExportFileIndexTest(AsyncTestCase):
+
+    def setUp(self):
+        super(ExportFileIndexTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.index = ExportFileIndex(self.directory, 60, 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        super(ExportFileIndexTest, self).tearDown()
+
+    def create_file(self, file_name, size, creation_time=None, add=True):
+        file_path = os.path.join(self.directory, file_name)
+        with open(file_path + ".tmp", 'wb') as export_file:
+            export_file.write("x" * size)
+        os.rename(file_path + ".tmp", file_path)  # Like the export jobs
+        if add:
+            self.index.add(file_name, size, creation_time, export_index.get_file_id(os.stat(file_path)))
+
+    def files(self):
+        export_index.executor.submit(lambda: None).result()  # After the pending deletions
+        return sorted(os.listdir(self.directory))
+
+    def test_expired_files_deleted(self):
+        self.create_file("old.csv", 1, time.time() - 61)
+        self.create_file("new.csv", 1)
+        self.assertFalse(self.index.contains("old.csv"))
+        self.assertTrue(self.index.contains("new.csv"))
+
+        self.index.cleanup().result()
+        self.assertEqual(self.files(), ["new.csv"])
+        self.assertEqual(self.index.stats()['expired_files'], 1)
+        self.assertEqual(self.index.stats()['files'], 1)
+
+    def test_least_recently_downloaded_evicted(self):
+        self.create_file("a.csv", 4)
+        self.create_file("b.csv", 4)
+        self.index.touch("a.csv")
+        self.create_file("c.csv", 4)
+        self.assertEqual(self.files(), ["a.csv", "c.csv"])
+        self.assertEqual(self.index.stats()['bytes'], 8)
+        self.assertEqual(self.index.stats()['evicted_files'], 1)
+
+    def test_new_file_larger_than_budget_kept(self):
+        self.create_file("a.csv", 4)
+        self.create_file("b.csv", 20)
+        self.assertEqual(self.files(), ["b.csv"])
+        self.assertTrue(self.index.contains("b.csv"))
+
+    def test_replaced_file_not_expired(self):
+        self.create_file("a.csv", 1, time.time() - 61)
+        self.create_file("a.csv", 2)  # Written again
+        self.index.cleanup().result()
+        self.assertEqual(self.files(), ["a.csv"])
+        self.assertEqual(self.index.stats()['bytes'], 2)
+
+    def test_queued_deletion_keeps_new_file(self):
+        self.create_file("a.csv", 1, time.time() - 61)
+        deleting = threading.Event()
+        export_index.executor.submit(deleting.wait)  # The deletion waits, while the file is exported again
+        cleanup_future = self.index.cleanup()
+        self.create_file("a.csv", 2)
+        deleting.set()
+        cleanup_future.result()
+        self.assertEqual(self.files(), ["a.csv"])
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, "a.csv")), 2)
+        self.assertTrue(self.index.contains("a.csv"))
+
+    @gen_test
+    def test_load(self):
+        self.create_file("a.csv", 1, add=False)
+        self.create_file("b.ndjson", 2, add=False)
+        self.create_file("a.csv.123.tmp", 1, add=False)
+        os.utime(os.path.join(self.directory, "a.csv.123.tmp"), (time.time() - 61, time.time() - 61))
+        self.create_file("notes.txt", 1, add=False)
+
+        yield self.index.load()
+        self.assertEqual(self.index.stats()['files'], 2)
+        self.assertEqual(self.index.stats()['bytes'], 3)
+        self.assertTrue(self.index.contains("b.ndjson"))
+        self.assertEqual(self.files(), ["a.csv", "b.ndjson", "notes.txt"])
+
+
+class ExportFileDownloadTest(ExportTestCase):
+
+    def test_download_marks_file_used(self):
+        links = [self.fetch_json("/get_energy_consumption_history_export?power_meter_id=0&date=05/0{0}/2015&"
+                                 "datarange=d&interval=15".format(day))['csv_file_link'] for day in (3, 4)]
+        file_names = [link.rsplit('/', 1)[1] for link in links]
+        self.assertEqual(list(export_index.index._files), file_names)
+
+        self.assertEqual(self.fetch_link(links[0]).code, 200)
+        self.assertEqual(list(export_index.index._files), file_names[::-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
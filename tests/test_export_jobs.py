@@ -0,0 +1,131 @@
+"""
+Tests of the queue of export jobs (lib.export_jobs) and of the export job web services.
+"""
+import json
+import os
+import time
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+from lib import export_index
+from lib import export_jobs
+from tests.test_exports import ExportTestCase, MONTH_ARGUMENTS
+
+
+class ExportJobQueueTest(AsyncTestCase):
+
+    def setUp(self):
+        super(ExportJobQueueTest, self).setUp()
+        self.export_files = set(os.listdir(export_index.FILE_EXPORT_ROOT))
+        export_index.index = export_index.ExportFileIndex(export_index.FILE_EXPORT_ROOT, 60, 1024 * 1024)
+        self.queue = export_jobs.ExportJobQueue(2)
+        self.runs = []
+        self.running = [0, 0]  # Running jobs, and the maximum of them
+
+    def tearDown(self):
+        for file_name in set(os.listdir(export_index.FILE_EXPORT_ROOT)) - self.export_files:
+            os.remove(os.path.join(export_index.FILE_EXPORT_ROOT, file_name))
+        super(ExportJobQueueTest, self).tearDown()
+
+    @gen.coroutine
+    def write_job(self, job):
+        self.runs.append(job.file_name)
+        self.running[0] += 1
+        self.running[1] = max(self.running)
+        yield gen.sleep(0.01)
+        with open(job.temp_path, 'wb') as export_file:
+            export_file.write(job.file_name)
+        self.running[0] -= 1
+
+    @gen.coroutine
+    def fail(self, job):
+        with open(job.temp_path, 'wb') as export_file:
+            export_file.write("incomplete")
+        raise ValueError("failed")
+
+    @gen_test
+    def test_job_written(self):
+        job = self.queue.submit("test_job.csv", self.write_job)
+        self.assertEqual(job.status, export_jobs.STATUS_RUNNING)
+        yield job.future
+        self.assertEqual(job.status, export_jobs.STATUS_DONE)
+        self.assertEqual(job.progress, 1.0)
+        with open(job.file_path, 'rb') as export_file:
+            self.assertEqual(export_file.read(), "test_job.csv")
+        self.assertFalse(os.path.exists(job.temp_path))
+        self.assertTrue(export_index.index.contains("test_job.csv"))
+        self.assertIs(self.queue.get(job.id), job)
+
+    @gen_test
+    def test_identical_jobs_deduplicated(self):
+        jobs = [self.queue.submit("test_job.csv", self.write_job) for i in range(3)]
+        self.assertEqual(len(set(job.id for job in jobs)), 1)
+        yield jobs[0].future
+        self.assertEqual(self.runs, ["test_job.csv"])
+
+    @gen_test
+    def test_running_jobs_limited(self):
+        jobs = [self.queue.submit("test_job_{0}.csv".format(i), self.write_job) for i in range(5)]
+        self.assertEqual(self.queue.stats(), {'queued': 3, 'running': 2, 'jobs': 5})
+        yield [job.future for job in jobs]
+        self.assertEqual(self.running[1], 2)
+        self.assertEqual(len(self.runs), 5)
+
+    @gen_test
+    def test_reusable_file_not_written_again(self):
+        job = self.queue.submit("test_job.csv", self.write_job, reusable=True)
+        yield job.future
+        reused_job = self.queue.submit("test_job.csv", self.write_job, reusable=True)
+        self.assertNotEqual(reused_job.id, job.id)
+        self.assertEqual(reused_job.status, export_jobs.STATUS_DONE)
+        self.assertEqual(self.runs, ["test_job.csv"])
+
+        yield self.queue.submit("test_job.csv", self.write_job).future  # Not reusable, e.g. with today's readings
+        self.assertEqual(self.runs, ["test_job.csv"] * 2)
+
+    @gen_test
+    def test_failed_job(self):
+        job = self.queue.submit("test_job.csv", self.fail)
+        yield job.future
+        self.assertEqual(job.status, export_jobs.STATUS_FAILED)
+        self.assertIsInstance(job.exception, ValueError)
+        self.assertFalse(os.path.exists(job.temp_path))
+        self.assertFalse(os.path.exists(job.file_path))
+        self.assertEqual(self.queue.stats()['running'], 0)
+
+    def test_file_name(self):
+        self.assertEqual(export_jobs.export_file_name(".csv", "kw", 1), export_jobs.export_file_name(".csv", "kw", 1))
+        self.assertNotEqual(export_jobs.export_file_name(".csv", "kw", 1),
+                            export_jobs.export_file_name(".csv", "kw", 2))
+        self.assertTrue(export_jobs.export_file_name(".csv.gz", "kw").endswith(".csv.gz"))
+
+
+class ExportJobWebServicesTest(ExportTestCase):
+
+    def test_submit_and_status(self):
+        result = self.fetch_json("/submit_energy_consumption_history_export?" + MONTH_ARGUMENTS)
+        self.assertIn(result['status'], (export_jobs.STATUS_QUEUED, export_jobs.STATUS_RUNNING))
+        same_result = self.fetch_json("/submit_energy_consumption_history_export?" + MONTH_ARGUMENTS)
+        self.assertEqual(same_result['job_id'], result['job_id'])
+
+        for i in range(100):
+            result = self.fetch_json("/get_export_job_status?job_id=" + result['job_id'])
+            if result['status'] == export_jobs.STATUS_DONE:
+                break
+            time.sleep(0.01)
+        self.assertEqual(result['status'], export_jobs.STATUS_DONE)
+        self.assertEqual(result['progress'], 1.0)
+        self.assertTrue(self.fetch_link(result['csv_file_link']).body.startswith("date,time,"))
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 4)
+
+    def test_unknown_job(self):
+        result = self.fetch_json("/get_export_job_status?job_id=unknown")
+        self.assertEqual(result['error_code'], "0006")
+
+    def test_unknown_format(self):
+        result = self.fetch_json("/submit_energy_consumption_history_export?format=xls&" + MONTH_ARGUMENTS)
+        self.assertEqual(result['error_code'], "0006")
+
+
+if __name__ == "__main__":
+    unittest.main()
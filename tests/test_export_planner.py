@@ -0,0 +1,31 @@
+"""
+Tests of the planning of the DataLog requests of long series (lib.export_planner).
+"""
+import datetime
+import unittest
+from lib import export_planner
+
+MONTH = datetime.datetime(2015, 5, 1)
+
+
+class PlanDataLogRequestsTest(unittest.TestCase):
+
+    def test_month_in_fewest_requests(self):
+        requests = export_planner.plan_data_log_requests(MONTH, 31 * 96, 15, 768)
+        self.assertEqual([records for start_time, records in requests], [768, 768, 768, 672])
+
+    def test_requests_are_contiguous(self):
+        requests = export_planner.plan_data_log_requests(MONTH, 31 * 96, 15, 768)
+        start_time = MONTH
+        for request_start_time, records in requests:
+            self.assertEqual(request_start_time, start_time)
+            start_time += datetime.timedelta(minutes=15 * records)
+        self.assertEqual(start_time, datetime.datetime(2015, 6, 1))
+
+    def test_short_series_in_one_request(self):
+        self.assertEqual(export_planner.plan_data_log_requests(MONTH, 96, 15, 768), [(MONTH, 96)])
+        self.assertEqual(export_planner.plan_data_log_requests(MONTH, 0, 15, 768), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
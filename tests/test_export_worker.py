@@ -0,0 +1,156 @@
+"""
+Tests of the export jobs with several worker processes: the server is started with --workers 2, so the requests of a
+job can reach any of them.
+"""
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.testing import AsyncTestCase, gen_test
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEADERS = {"Authorization": "Basic YWRtaW46"}  # admin, with an empty password
+EXPORT_ARGUMENTS = "power_meter_id=1&datarange=d&interval=15&date="
+
+
+def unused_port(count=1):
+    """
+    :return: a port of the loopback interface that is free, like the count - 1 ports after it
+    """
+    for attempt in range(100):
+        sockets = []
+        try:
+            sock = socket.socket()
+            sock.bind(("127.0.0.1", 0))
+            sockets.append(sock)
+            port = sock.getsockname()[1]
+            for offset in range(1, count):
+                sock = socket.socket()
+                sock.bind(("127.0.0.1", port + offset))
+                sockets.append(sock)
+            return port
+        except socket.error:
+            pass
+        finally:
+            for sock in sockets:
+                sock.close()
+
+    raise RuntimeError("No free ports")
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+
+    raise RuntimeError("Nothing listening on port {0}".format(port))
+
+
+class ExportWorkersTest(AsyncTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()  # The working directory, with the time series store and the shared caches
+        cls.log = open(os.path.join(cls.directory, "server.log"), "w")
+        webaccess_port = unused_port()
+        cls.port = unused_port(2)  # The port of the server, and of its export worker
+        env = dict(os.environ, USHOP_COOKIE_SECRET="test-secret", USHOP_DATA_ROOT=cls.directory,
+                   USHOP_WA_ROOT_URL="http://127.0.0.1:{0}/WaWebService/".format(webaccess_port))
+        cls.processes = [
+            subprocess.Popen([sys.executable, os.path.join(ROOT, "tests", "mock_webaccess.py"), str(webaccess_port),
+                              "1.0"],  # The export jobs take a second, so the identical ones overlap
+                             stdout=cls.log, stderr=subprocess.STDOUT),
+            subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py"), "--port={0}".format(cls.port),
+                              "--workers=2"], cwd=cls.directory, env=env, stdout=cls.log, stderr=subprocess.STDOUT,
+                             preexec_fn=os.setsid)]  # In its own process group, with its worker processes
+        cls.file_paths = set()
+        try:
+            wait_for_port(webaccess_port)
+            wait_for_port(cls.port)
+            wait_for_port(cls.port + 1)
+        except RuntimeError:
+            cls.tearDownClass()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        webaccess_process, server_process = cls.processes
+        webaccess_process.terminate()
+        webaccess_process.wait()
+        os.killpg(server_process.pid, signal.SIGTERM)
+        server_process.wait()
+        cls.log.close()
+        for file_path in cls.file_paths:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        shutil.rmtree(cls.directory)
+
+    @gen.coroutine
+    def get(self, uri):
+        """
+        Send a request on a new connection, so the requests are spread over the worker processes
+        :return: the Json result
+        """
+        http_client = AsyncHTTPClient(force_instance=True)
+        try:
+            response = yield http_client.fetch("http://127.0.0.1:{0}{1}".format(self.port, uri), headers=HEADERS)
+        finally:
+            http_client.close()
+        raise gen.Return(json.loads(response.body))
+
+    def add_file(self, result):
+        if 'csv_file_link' in result:
+            file_path = result['csv_file_link'].split('/', 3)[3]
+            self.file_paths.add(os.path.join(ROOT, file_path))
+
+    @gen_test(timeout=30)
+    def test_job_status_on_every_worker(self):
+        uri = "/submit_energy_consumption_history_export?" + EXPORT_ARGUMENTS + "05/03/2015"
+        results = yield [self.get(uri) for i in range(8)]
+        job_ids = set(result['job_id'] for result in results)
+        self.assertEqual(len(job_ids), 1)  # Identical exports share a job, whichever worker they reached
+
+        job_id = job_ids.pop()
+        for attempt in range(50):
+            results = yield [self.get("/get_export_job_status?job_id=" + job_id) for i in range(8)]
+            for result in results:
+                self.add_file(result)
+                self.assertNotIn('error_code', result)
+                self.assertEqual(result['job_id'], job_id)
+            if all(result['status'] == "done" for result in results):
+                break
+            yield gen.sleep(0.1)
+
+        self.assertEqual(results[0]['status'], "done")
+
+    @gen_test(timeout=30)
+    def test_export_link_on_every_worker(self):
+        uri = "/get_energy_consumption_history_export?" + EXPORT_ARGUMENTS + "05/04/2015"
+        results = yield [self.get(uri) for i in range(8)]
+        for result in results:
+            self.add_file(result)
+        self.assertEqual(len(set(result['csv_file_link'] for result in results)), 1)
+
+        http_client = AsyncHTTPClient(force_instance=True)
+        try:
+            for i in range(4):
+                response = yield http_client.fetch(results[0]['csv_file_link'].replace("localhost", "127.0.0.1"))
+                self.assertTrue(response.body.startswith("date,time,"))
+        finally:
+            http_client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
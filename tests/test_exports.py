@@ -0,0 +1,89 @@
+"""
+Tests of the export web services of the Power Metering API.
+"""
+import datetime
+import json
+import os
+import unittest
+from lib import export_index
+from lib import export_jobs
+from tests.helpers import ServerTestCase
+from tests.test_datalog import expected_readings
+
+MONTH_ARGUMENTS = "power_meter_id=0&date=05/03/2015&datarange=m&interval=15"
+
+
+class ExportTestCase(ServerTestCase):
+    """
+    Test case of the exports, which starts with no export jobs nor files, and deletes the files it writes
+    """
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.export_files = set(os.listdir(export_index.FILE_EXPORT_ROOT))
+        export_index.index = export_index.ExportFileIndex(export_index.FILE_EXPORT_ROOT,
+                                                          export_index.FILE_EXPORT_LIFETIME_HOURS * 60 * 60,
+                                                          export_index.FILE_EXPORT_MAX_MB * 1024 * 1024)
+        export_jobs.queue = export_jobs.ExportJobQueue(export_jobs.EXPORT_MAX_JOBS)
+
+    def tearDown(self):
+        for file_name in set(os.listdir(export_index.FILE_EXPORT_ROOT)) - self.export_files:
+            os.remove(os.path.join(export_index.FILE_EXPORT_ROOT, file_name))
+        super(ExportTestCase, self).tearDown()
+
+    def fetch_json(self, path, **kwargs):
+        response = self.fetch(path, **kwargs)
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def fetch_link(self, link, **kwargs):
+        """
+        Download an export file from its link (whose host is the one of the server options, not of the test server)
+        """
+        return self.fetch("/" + link.split('/', 3)[3], **kwargs)
+
+
+class MonthExportTest(ExportTestCase):
+
+    def test_month_export(self):
+        result = self.fetch_json("/get_energy_consumption_history_export?" + MONTH_ARGUMENTS)
+        # The 31 x 96 readings in the fewest GetDataLog requests of WA_MAX_RECORDS_PER_REQUEST
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 4)
+
+        lines = self.fetch_link(result['csv_file_link']).body.splitlines()
+        self.assertEqual(lines[0], "date,time,electricity consumption")
+        self.assertEqual(len(lines), 1 + 31 * 96)
+        readings = expected_readings(datetime.datetime(2015, 5, 1), 31 * 96)
+        for index in (0, 1, 95, 96, 31 * 96 - 1):
+            reading_time = datetime.datetime(2015, 5, 1) + datetime.timedelta(minutes=15 * index)
+            self.assertEqual(lines[1 + index], "{0},{1:g}".format(reading_time.strftime("%Y/%m/%d,%H:%M"),
+                                                                 readings[index]))
+
+
+class StreamedExportTest(ExportTestCase):
+
+    def test_streamed_export(self):
+        response = self.fetch("/get_energy_consumption_history_export?stream=1&" + MONTH_ARGUMENTS)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Transfer-Encoding'], "chunked")
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'attachment; filename="energy_consumption_201505.csv"')
+        self.assertIn('X-Request-ID', response.headers)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 4)
+        self.assertEqual(set(os.listdir(export_index.FILE_EXPORT_ROOT)), self.export_files)  # No file written
+
+        result = self.fetch_json("/get_energy_consumption_history_export?" + MONTH_ARGUMENTS)
+        self.assertEqual(response.body, self.fetch_link(result['csv_file_link']).body)
+
+    def test_streamed_day_export(self):
+        response = self.fetch("/get_energy_consumption_history_export?stream=1&power_meter_id=0&date=05/03/2015&"
+                              "datarange=d&interval=15")
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'attachment; filename="energy_consumption_20150503.csv"')
+        lines = response.body.splitlines()
+        self.assertEqual(len(lines), 1 + 96)
+        self.assertTrue(lines[1].startswith("2015/05/03,00:00,"))
+
+
+if __name__ == "__main__":
+    unittest.main()
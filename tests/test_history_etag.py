@@ -0,0 +1,56 @@
+"""
+Tests of the ETags and cache headers of the history web services of the Power Metering API.
+"""
+import datetime
+import unittest
+from tests.helpers import HEADERS, ServerTestCase
+
+DAY_VIEW = "/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=d&interval=60"
+
+
+class HistoryETagTest(ServerTestCase):
+
+    def test_closed_range_revalidated(self):
+        response = self.fetch(DAY_VIEW)
+        self.assertEqual(response.code, 200)
+        etag = response.headers['Etag']
+        self.assertEqual(response.headers['Cache-Control'], "max-age=86400, s-maxage=0")
+
+        response = self.fetch(DAY_VIEW, headers=dict(HEADERS, **{"If-None-Match": etag}))
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.headers['Etag'], etag)
+        self.assertEqual(response.headers['Cache-Control'], "max-age=86400, s-maxage=0")
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+
+    def test_etag_known_before_computing(self):
+        etag = self.fetch(DAY_VIEW).headers['Etag']
+        self.stop_webaccess()
+        self.start_webaccess()  # As a new server, with no cached DataLog windows nor responses
+        response = self.fetch(DAY_VIEW, headers=dict(HEADERS, **{"If-None-Match": etag}))
+        self.assertEqual(response.code, 304)
+        self.assertNotIn('GetDataLog', self.webaccess_calls)
+
+    def test_etag_of_each_response(self):
+        etag = self.fetch(DAY_VIEW).headers['Etag']
+        self.assertEqual(self.fetch(DAY_VIEW).headers['Etag'], etag)
+        self.assertNotEqual(self.fetch(DAY_VIEW + "&callback=f").headers['Etag'], etag)
+        self.assertNotEqual(self.fetch(DAY_VIEW.replace("05/03", "05/04")).headers['Etag'], etag)
+        self.assertNotEqual(self.fetch(DAY_VIEW.replace("interval=60", "interval=15")).headers['Etag'], etag)
+
+        response = self.fetch(DAY_VIEW, headers=dict(HEADERS, **{"If-None-Match": '"other"'}))
+        self.assertEqual(response.code, 200)
+
+    def test_open_range_not_revalidated(self):
+        today = datetime.date.today().strftime("%m/%d/%Y")
+        response = self.fetch(DAY_VIEW.replace("05/03/2015", today))
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers['Cache-Control'].startswith("private, max-age="))
+
+        # Only Tornado's ETag of the body, checked once the response has been written
+        response = self.fetch(DAY_VIEW.replace("05/03/2015", today),
+                              headers=dict(HEADERS, **{"If-None-Match": response.headers['Etag']}))
+        self.assertEqual(response.code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Tests of the memory-bounded LRU cache (lib.lru_cache) and of the cache of the DataLog windows built on it.
+"""
+import datetime
+import unittest
+from tornado import httpclient
+from tornado.testing import gen_test
+from lib import credentials
+from lib import datalog
+from lib.lru_cache import LRUCache
+from tests.helpers import WebAccessTestCase
+
+DAY = datetime.datetime(2015, 5, 3)
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache("Test", 10)
+
+    def test_least_recently_used_evicted(self):
+        self.cache.put("a", "A", 4)
+        self.cache.put("b", "B", 4)
+        self.assertEqual(self.cache.get("a"), "A")  # b is now the least recently used
+        self.cache.put("c", "C", 4)
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.get("a"), "A")
+        self.assertEqual(self.cache.get("c"), "C")
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 8)
+
+    def test_replaced_entry_size(self):
+        self.cache.put("a", "A", 4)
+        self.cache.put("a", "AA", 6)
+        self.assertEqual(self.cache.get("a"), "AA")
+        self.assertEqual(self.cache.stats()['bytes'], 6)
+
+    def test_value_larger_than_cache_not_kept(self):
+        self.cache.put("a", "A", 4)
+        self.cache.put("b", "B", 11)
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.get("a"), "A")
+
+    def test_expired_entry(self):
+        self.cache.put("a", "A", 4, ttl=0)
+        self.cache.put("b", "B", 4, ttl=60)
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertFalse(self.cache.contains("a"))
+        self.assertEqual(self.cache.get("a", stale=True), "A")
+        self.assertEqual(self.cache.get("b"), "B")
+        self.assertTrue(self.cache.contains("b"))
+
+    def test_hits_and_misses(self):
+        self.cache.put("a", "A", 4)
+        self.cache.get("a")
+        self.cache.get("b")
+        self.cache.contains("a")
+        self.assertEqual((self.cache.stats()['hits'], self.cache.stats()['misses']), (1, 1))
+
+
+class DataLogCacheTest(WebAccessTestCase):
+
+    def setUp(self):
+        super(DataLogCacheTest, self).setUp()
+        self.headers = credentials.basic_headers("admin", "")
+        self.current_ttl = datalog.WA_DATALOG_CACHE_CURRENT_TTL_SECONDS
+
+    def tearDown(self):
+        datalog.WA_DATALOG_CACHE_CURRENT_TTL_SECONDS = self.current_ttl
+        super(DataLogCacheTest, self).tearDown()
+
+    def start_windows(self, day):
+        return datalog.start_data_log_windows(self.headers, ["kw"], [day + datetime.timedelta(hours=6 * index)
+                                                                     for index in range(4)], 'M', 15, 24, "3")
+
+    @gen_test
+    def test_past_windows_cached(self):
+        first = yield self.start_windows(DAY)
+        second = yield self.start_windows(DAY)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+        self.assertEqual([window["kw"].readings() for window in first],
+                         [window["kw"].readings() for window in second])
+
+    @gen_test
+    def test_current_windows_expire(self):
+        datalog.WA_DATALOG_CACHE_CURRENT_TTL_SECONDS = 0
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        yield self.start_windows(today)
+        yield self.start_windows(today)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 2)
+
+    @gen_test
+    def test_unverified_credentials_not_served_from_cache(self):
+        yield self.start_windows(DAY)
+        self.headers = credentials.basic_headers("guest", "")
+        with self.assertRaises(httpclient.HTTPError):
+            yield self.start_windows(DAY)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
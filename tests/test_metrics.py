@@ -0,0 +1,80 @@
+"""
+Tests of the metrics of the server (lib.metrics) and of their Prometheus endpoint.
+"""
+import unittest
+from lib import metrics
+from tests.helpers import ServerTestCase
+
+DAY_VIEW = "/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=d&interval=60"
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = []
+
+    def tearDown(self):
+        for metric in self.metrics:
+            metrics.metrics.remove(metric)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def test_counter(self):
+        counter = self.add(metrics.Counter("test_total", "Test counter", ('route', 'status')))
+        counter.inc("a", 200)
+        counter.inc("a", 200, amount=2)
+        counter.inc('b"\\', 500)
+        self.assertEqual(counter.render(), ['# HELP test_total Test counter',
+                                            '# TYPE test_total counter',
+                                            'test_total{route="a",status="200"} 3',
+                                            'test_total{route="b\\"\\\\",status="500"} 1'])
+
+    def test_gauge(self):
+        gauge = self.add(metrics.Gauge("test_gauge", "Test gauge"))
+        gauge.set(0.25)
+        gauge.set(0.5)
+        self.assertEqual(gauge.render()[2:], ['test_gauge 0.5'])
+
+    def test_histogram(self):
+        histogram = self.add(metrics.Histogram("test_seconds", "Test histogram", ('route',), buckets=(0.1, 1.0)))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, "a")
+        self.assertEqual(histogram.render()[2:], ['test_seconds_bucket{route="a",le="0.1"} 2',
+                                                  'test_seconds_bucket{route="a",le="1.0"} 3',
+                                                  'test_seconds_bucket{route="a",le="+Inf"} 4',
+                                                  'test_seconds_count{route="a"} 4',
+                                                  'test_seconds_sum{route="a"} 2.65'])
+
+    def test_failed_collector_ignored(self):
+        gauge = self.add(metrics.Gauge("test_gauge", "Test gauge"))
+
+        def collector():
+            raise ValueError("failed")
+
+        metrics.add_collector(collector)
+        try:
+            gauge.set(1)
+            self.assertIn("test_gauge 1\n", metrics.render())
+        finally:
+            metrics.collectors.remove(collector)
+
+
+class MetricsEndpointTest(ServerTestCase):
+
+    def test_metrics(self):
+        self.fetch(DAY_VIEW)
+        response = self.fetch("/metrics")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], "text/plain; version=0.0.4; charset=utf-8")
+        lines = response.body.splitlines()
+        self.assertTrue(any(line.startswith('ushop_requests_total{route="get_energy_consumption_history",'
+                                            'method="GET",status="200"} ') for line in lines))
+        self.assertIn('ushop_upstream_circuit_state{state="closed"} 1', lines)
+        self.assertTrue(any(line.startswith('ushop_cache_hits_total{cache="DataLog",tier="local"}') for line in lines))
+        self.assertTrue(any(line.startswith('ushop_upstream_request_duration_seconds_count') for line in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Tests of the stack-sampling profiler (lib.profiler) and of its handler.
+"""
+import threading
+import time
+import unittest
+from handlers import profiler as profiler_handler
+from handlers.profiler import ProfilerHandler
+from lib import profiler
+from lib.profiler import StackSampler
+from tests.helpers import ServerTestCase
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+class StackSamplerTest(unittest.TestCase):
+
+    def test_sampled_stacks(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_loop, args=(stop,), name="busy thread")
+        thread.start()
+        try:
+            sampler = StackSampler(0.001).run(0.05)
+        finally:
+            stop.set()
+            thread.join()
+
+        self.assertGreater(sampler.samples, 0)
+        lines = sampler.collapsed().splitlines()
+        busy_lines = [line for line in lines if line.startswith("busy_thread;")]
+        self.assertTrue(busy_lines)
+        stack, count = busy_lines[0].rsplit(' ', 1)
+        self.assertIn("tests.test_profiler.busy_loop", stack.split(';'))
+        self.assertLessEqual(int(count), sampler.samples)
+        self.assertFalse([line for line in lines if "lib.profiler.run" in line])  # Not its own thread
+
+    def test_profile(self):
+        future = profiler.profile(0.02, 0)  # At least PROFILER_MIN_INTERVAL_SECONDS
+        self.assertTrue(profiler.is_running())
+        sampler = future.result()
+        self.assertEqual(sampler.interval, profiler.PROFILER_MIN_INTERVAL_SECONDS)
+        self.assertFalse(profiler.is_running())
+
+
+class ProfilerHandlerTest(ServerTestCase):
+
+    def get_app(self):
+        app = super(ProfilerHandlerTest, self).get_app()
+        app.add_handlers(r".*$", [(r"/debug/profile", ProfilerHandler)])
+        return app
+
+    def setUp(self):
+        super(ProfilerHandlerTest, self).setUp()
+        self.profiler_users = profiler_handler.PROFILER_USERS
+        profiler_handler.PROFILER_USERS = ["admin"]
+
+    def tearDown(self):
+        profiler_handler.PROFILER_USERS = self.profiler_users
+        super(ProfilerHandlerTest, self).tearDown()
+
+    def test_profile(self):
+        response = self.fetch("/debug/profile?seconds=0.05&interval_ms=5")
+        self.assertEqual(response.code, 200)
+        self.assertGreater(int(response.headers['X-Profile-Samples']), 0)
+        self.assertIn("MainThread;", response.body)
+
+    def test_not_allowed_user(self):
+        profiler_handler.PROFILER_USERS = ["other"]
+        self.assertEqual(self.fetch("/debug/profile?seconds=0.05").code, 403)
+
+    def test_invalid_arguments(self):
+        self.assertEqual(self.fetch("/debug/profile?seconds=x").code, 400)
+        self.assertEqual(self.fetch("/debug/profile?seconds=-1").code, 400)
+
+    def test_one_profile_at_a_time(self):
+        future = profiler.profile(0.1, 0.01)
+        try:
+            self.assertEqual(self.fetch("/debug/profile?seconds=0.05").code, 409)
+        finally:
+            future.result()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+Tests of the timelines of the requests (lib.request_timing), returned in the Server-Timing header.
+"""
+import json
+import logging
+import unittest
+from tornado import gen
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+from tornado.testing import AsyncTestCase, gen_test
+from handlers import base
+from lib import request_timing
+from lib.request_timing import RequestTimeline
+from tests.helpers import HEADERS, ServerTestCase
+
+DAY_VIEW = "/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=d&interval=60"
+
+
+class ListHandler(logging.Handler):
+    """
+    Logging handler keeping the records in a list
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class RequestTimelineTest(AsyncTestCase):
+
+    def test_server_timing(self):
+        timeline = RequestTimeline("id")
+        timeline.add_upstream_call("webaccess", "GetDataLog", 0.1, 200)
+        timeline.add_upstream_call("webaccess", "GetDataLog", 0.0234, 200)
+        timeline.record("decode", 0.002)
+        self.assertEqual(timeline.server_timing(0.2),
+                         'fetch;dur=123.4;desc="2 calls", decode;dur=2.0, total;dur=200.0')
+
+    def test_to_dict(self):
+        timeline = RequestTimeline("id")
+        timeline.add_upstream_call("webaccess", "Logon", 0.01, 401)
+        timeline_dict = timeline.to_dict()
+        self.assertEqual(timeline_dict['request_id'], "id")
+        self.assertEqual(timeline_dict['upstream_calls'],
+                         [{'upstream': "webaccess", 'web_service': "Logon", 'ms': 10.0, 'status': 401}])
+        self.assertEqual(timeline_dict['upstream_calls_total'], 1)
+
+    def test_request_id(self):
+        def request(request_id):
+            return HTTPServerRequest(uri="/", headers=HTTPHeaders({"X-Request-ID": request_id}))
+
+        self.assertEqual(request_timing.get_request_id(request("abc-123.x_y")), "abc-123.x_y")
+        self.assertNotEqual(request_timing.get_request_id(request("bad id\r\n")), "bad id\r\n")
+        self.assertEqual(len(request_timing.get_request_id(HTTPServerRequest(uri="/"))), 32)
+
+    @gen_test
+    def test_current_timeline_in_callbacks(self):
+        @gen.coroutine
+        def task():
+            yield gen.sleep(0.01)
+            with request_timing.phase("aggregate"):
+                pass
+
+        timeline = RequestTimeline("id")
+        with request_timing.context(timeline):
+            future = task()
+        self.assertIsNone(request_timing.current())
+        request_timing.record("decode", 1.0)  # Outside of a request, not recorded
+
+        yield future
+        self.assertEqual(timeline.phases.keys(), ["aggregate"])
+
+class ServerTimingTest(ServerTestCase):
+
+    def test_server_timing_header(self):
+        response = self.fetch(DAY_VIEW)
+        phases = [metric.split(';', 1)[0] for metric in response.headers['Server-Timing'].split(", ")]
+        self.assertEqual(phases[-1], "total")
+        self.assertTrue(set(["fetch", "decode", "serialize"]).issubset(phases))
+
+    def test_request_id(self):
+        response = self.fetch(DAY_VIEW, headers=dict(HEADERS, **{"X-Request-ID": "test-1"}))
+        self.assertEqual(response.headers['X-Request-ID'], "test-1")
+        self.assertEqual(len(self.fetch(DAY_VIEW).headers['X-Request-ID']), 32)
+
+    def test_slow_request_logged(self):
+        threshold = base.SLOW_REQUEST_THRESHOLD_MS
+        log_handler = ListHandler()
+        base.logger.addHandler(log_handler)
+        base.SLOW_REQUEST_THRESHOLD_MS = 0
+        try:
+            self.fetch(DAY_VIEW, headers=dict(HEADERS, **{"X-Request-ID": "test-slow"}))
+        finally:
+            base.SLOW_REQUEST_THRESHOLD_MS = threshold
+            base.logger.removeHandler(log_handler)
+
+        messages = [record.getMessage() for record in log_handler.records if record.levelno == logging.WARNING]
+        self.assertEqual(len(messages), 1)
+        slow_request = json.loads(messages[0].split("Slow request: ", 1)[1])
+        self.assertEqual(slow_request['request_id'], "test-slow")
+        self.assertEqual(slow_request['status'], 200)
+        self.assertEqual([call['web_service'] for call in slow_request['upstream_calls']], ["Logon", "GetDataLog"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Tests of the cache of the serialized responses (lib.response_cache) of the history web services.
+"""
+import gzip
+import json
+import unittest
+from StringIO import StringIO
+from lib import response_cache
+from lib.response_cache import CachedResponse
+from tests.helpers import HEADERS, ServerTestCase
+
+DAY_VIEW = "/get_energy_consumption_history?power_meter_id=0&date=05/03/2015&datarange=d&interval=15"
+
+
+def decompress(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+class CachedResponseTest(unittest.TestCase):
+
+    def test_small_response_not_compressed(self):
+        self.assertIsNone(CachedResponse('{"sum": 1}').gzip_body)
+
+    def test_large_response_compressed(self):
+        body = json.dumps({'values': range(1000)})
+        response = CachedResponse(body)
+        self.assertLess(len(response.gzip_body), len(body))
+        self.assertEqual(decompress(response.gzip_body), body)
+
+    def test_string_round_trip(self):
+        for body in ('{"sum": 1}', json.dumps({'values': range(1000)})):
+            response = CachedResponse.from_string(CachedResponse(body).to_string())
+            self.assertEqual(response.body, body)
+            self.assertEqual(response.gzip_body, CachedResponse(body).gzip_body)
+
+
+class ResponseCacheTest(ServerTestCase):
+
+    def fetch_gzip(self, path):
+        return self.fetch(path, headers=dict(HEADERS, **{"Accept-Encoding": "gzip"}), decompress_response=False)
+
+    def test_cached_response(self):
+        body = self.fetch(DAY_VIEW).body
+        hits = response_cache.cache.stats()['hits']
+        self.assertEqual(self.fetch(DAY_VIEW).body, body)
+        self.assertEqual(response_cache.cache.stats()['hits'], hits + 1)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+
+    def test_compressed_response(self):
+        body = self.fetch(DAY_VIEW).body
+        for i in range(2):  # Computed, then cached
+            response = self.fetch_gzip(DAY_VIEW)
+            self.assertEqual(response.headers['Content-Encoding'], "gzip")
+            self.assertEqual(response.headers['Vary'], "Accept-Encoding")
+            self.assertEqual(decompress(response.body), body)
+
+    def test_jsonp_response_not_compressed(self):
+        body = self.fetch(DAY_VIEW).body
+        response = self.fetch_gzip(DAY_VIEW + "&callback=f")
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.body, "f({0})".format(body))
+
+    def test_rejected_credentials_not_served(self):
+        self.fetch(DAY_VIEW)
+        hits = response_cache.cache.stats()['hits']
+        response = self.fetch(DAY_VIEW, headers={"Authorization": "Basic Z3Vlc3Q6"})
+        self.assertEqual(json.loads(response.body)['error_code'], "0005")
+        self.assertEqual(response_cache.cache.stats()['hits'], hits)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Tests of the scheduled tasks (lib.scheduled_tasks).
+"""
+import datetime
+import json
+import unittest
+from tornado.testing import gen_test
+from handlers import power_metering_api
+from lib import credentials
+from lib import datalog
+from lib import response_cache
+from lib import scheduled_tasks
+from tests.helpers import WebAccessTestCase
+
+
+class WarmCachesTest(WebAccessTestCase):
+
+    def setUp(self):
+        super(WarmCachesTest, self).setUp()
+        self.warm_username = scheduled_tasks.WARM_WA_USERNAME
+        scheduled_tasks.WARM_WA_USERNAME = "admin"
+
+    def tearDown(self):
+        scheduled_tasks.WARM_WA_USERNAME = self.warm_username
+        super(WarmCachesTest, self).tearDown()
+
+    def test_all_tag_names(self):
+        self.assertEqual(scheduled_tasks.get_all_tag_names(), ["kw"])
+
+    @gen_test
+    def test_month_served_from_caches(self):
+        yield scheduled_tasks.warm_caches(startup=True)
+        self.assertEqual(self.webaccess_calls['Logon'], 1)
+        warm_calls = self.webaccess_calls['GetDataLog']
+        self.assertGreater(warm_calls, 0)
+
+        month_start_time = datetime.datetime.combine(datetime.date.today(), datetime.time()).replace(day=1)
+        yield datalog.get_base_series(credentials.basic_headers("admin", ""), ["kw"], month_start_time,
+                                      31 * datalog.BASE_READINGS_PER_DAY, scheduled_tasks.DATA_TYPE)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], warm_calls)
+
+    @gen_test
+    def test_current_windows_refreshed(self):
+        yield scheduled_tasks.warm_caches(startup=True)
+        warm_calls = self.webaccess_calls['GetDataLog']
+        yield scheduled_tasks.warm_caches()
+        self.assertEqual(self.webaccess_calls['GetDataLog'], warm_calls + 1)  # Only the latest windows
+
+    @gen_test
+    def test_credentials_verified_on_every_run(self):
+        yield scheduled_tasks.warm_caches(startup=True)
+        warm_calls = self.webaccess_calls['GetDataLog']
+        credentials.cache = credentials.CredentialCache(credentials.CREDENTIALS_TTL_SECONDS,
+                                                        credentials.CREDENTIALS_REJECTED_TTL_SECONDS)  # Expired
+        yield scheduled_tasks.warm_caches()
+        self.assertEqual(self.webaccess_calls['Logon'], 2)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], warm_calls + 1)  # The rest from the store and the caches
+
+    @gen_test
+    def test_today_responses_cached(self):
+        yield scheduled_tasks.warm_caches(startup=True)
+        for interval in power_metering_api.TODAY_INTERVALS:
+            arguments = {'power_meter_id': ["1"], 'interval': [str(interval)]}
+            history_key, closed = power_metering_api.get_history_key(power_metering_api.TODAY_WS_NAME, arguments)
+            self.assertFalse(closed)
+            result = yield power_metering_api.get_energy_consumption_today(credentials.basic_headers("admin", ""),
+                                                                           ["kw"], interval)
+            self.assertEqual(response_cache.cache.get(history_key).body, json.dumps(result))
+
+    @gen_test
+    def test_rejected_credentials(self):
+        scheduled_tasks.WARM_WA_USERNAME = "guest"
+        yield scheduled_tasks.warm_caches()  # Logged, not raised
+        self.assertEqual(datalog.cache.stats()['entries'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests of the cache shared by the worker processes (lib.shared_cache).
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from lib import shared_cache
+from lib.shared_cache import SharedCache, TieredCache
+
+
+class SharedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SharedCache("Test", self.directory, 100)
+        self.other_cache = SharedCache("Test", self.directory, 100)  # As in another process
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_round_trip(self):
+        self.cache.put(("key", 1), "data").result()
+        self.assertEqual(self.other_cache.get(("key", 1)), ("data", None))
+        self.assertIsNone(self.other_cache.get(("key", 2)))
+        self.assertEqual(self.other_cache.stats(), {'hits': 1, 'misses': 1, 'errors': 0})
+
+    def test_ttl(self):
+        self.cache.put("key", "data", 60).result()
+        data, ttl = self.other_cache.get("key")
+        self.assertTrue(0 < ttl <= 60)
+        self.cache.put("key", "data", -1).result()
+        self.assertIsNone(self.other_cache.get("key"))
+
+    def test_invalid_entry(self):
+        with open(self.cache._path("key"), 'wb') as entry_file:
+            entry_file.write("not an entry of the shared cache")
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_cleanup(self):
+        self.cache.put("expired", "data", -1).result()
+        for i in range(3):
+            self.cache.put(i, "x" * 30).result()  # 46 bytes with the header
+            os.utime(self.cache._path(i), (time.time() - 10 + i, time.time() - 10 + i))
+        self.assertEqual(self.cache.cleanup(), 2)  # The expired entry, and the oldest one
+        self.assertEqual([self.cache.get(i) is not None for i in range(3)], [False, True, True])
+
+
+class TieredCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shared_cache_path = shared_cache.SHARED_CACHE_PATH
+        shared_cache.SHARED_CACHE_PATH = tempfile.mkdtemp()
+        self.cache = TieredCache("Test", 100, str, int)
+        self.other_cache = TieredCache("Test", 100, str, int)  # As in another process
+
+    def tearDown(self):
+        shutil.rmtree(shared_cache.SHARED_CACHE_PATH, ignore_errors=True)
+        shared_cache.SHARED_CACHE_PATH = self.shared_cache_path
+        shared_cache.caches.remove(self.cache)
+        shared_cache.caches.remove(self.other_cache)
+
+    def test_shared_with_other_processes(self):
+        self.cache.put("key", 12, 8, ttl=60)
+        shared_cache.executor.submit(lambda: None).result()  # After the pending writes
+        self.assertEqual(self.other_cache.get("key"), 12)
+        self.assertTrue(self.other_cache.contains("key"))  # Now in the cache of the process
+        self.assertEqual(self.other_cache.stats()['shared']['hits'], 1)
+
+    def test_deleted_from_process_only(self):
+        self.cache.put("key", 12, 8)
+        shared_cache.executor.submit(lambda: None).result()
+        self.cache.delete("key")
+        self.assertFalse(self.cache.contains("key"))
+        self.assertEqual(self.cache.get("key"), 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tests of the coalescing of identical in-flight calls (lib.single_flight) and of the WebAccess POST requests.
+"""
+import unittest
+from tornado import httpclient
+from tornado.concurrent import Future
+from tornado.testing import gen_test
+from handlers import webaccess
+from lib import credentials
+from lib.single_flight import SingleFlight
+from tests.helpers import WebAccessTestCase
+
+DATA_LOG_ARGUMENTS = dict(start_time="2015-05-03 00:00:00", interval_type='M', interval=15, records=4, data_type="3")
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight("Test")
+        self.futures = []
+
+    def task(self):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+    def test_concurrent_calls_coalesced(self):
+        first = self.flights.do("key", self.task)
+        second = self.flights.do("key", self.task)
+        self.assertIs(first, second)
+        self.assertEqual(len(self.futures), 1)
+        self.assertEqual(self.flights.stats(), {'calls': 2, 'coalesced': 1, 'in_flight': 1})
+
+        self.futures[0].set_result("result")
+        self.assertEqual(second.result(), "result")
+        self.assertEqual(self.flights.stats()['in_flight'], 0)
+
+    def test_different_keys_not_coalesced(self):
+        self.assertIsNot(self.flights.do("key", self.task), self.flights.do("other key", self.task))
+        self.assertEqual(len(self.futures), 2)
+
+    def test_call_after_completion_runs_again(self):
+        self.flights.do("key", self.task).set_result("result")
+        self.flights.do("key", self.task)
+        self.assertEqual(len(self.futures), 2)
+
+    def test_failure_not_kept(self):
+        self.flights.do("key", self.task).set_exception(ValueError())
+        self.assertFalse(self.flights.do("key", self.task).done())
+
+
+class WebAccessPostFlightsTest(WebAccessTestCase):
+    data_log_delay = 0.1
+
+    @gen_test
+    def test_identical_data_logs_coalesced(self):
+        headers = credentials.basic_headers("admin", "")
+        responses = yield [webaccess.get_data_log(headers, "85", tag_names=["kw"], **DATA_LOG_ARGUMENTS)
+                           for i in range(3)]
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+        self.assertEqual(responses[1:], responses[:-1])
+
+    @gen_test
+    def test_different_data_logs_not_coalesced(self):
+        headers = credentials.basic_headers("admin", "")
+        yield [webaccess.get_data_log(headers, "85", tag_names=["kw"], **DATA_LOG_ARGUMENTS),
+               webaccess.get_data_log(headers, "85", tag_names=["kw1"], **DATA_LOG_ARGUMENTS)]
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 2)
+
+    @gen_test
+    def test_credentials_never_share_responses(self):
+        admin = webaccess.get_data_log(credentials.basic_headers("admin", ""), "85", tag_names=["kw"],
+                                       **DATA_LOG_ARGUMENTS)
+        guest = webaccess.get_data_log(credentials.basic_headers("guest", ""), "85", tag_names=["kw"],
+                                       **DATA_LOG_ARGUMENTS)
+        yield admin
+        with self.assertRaises(httpclient.HTTPError):
+            yield guest
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
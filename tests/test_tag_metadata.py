@@ -0,0 +1,112 @@
+"""
+Tests of the cache of the Tag metadata (lib.tag_metadata) and of the WebAccess web services using it.
+"""
+import json
+import unittest
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+from handlers import webaccess
+from lib import credentials
+from lib import tag_metadata
+from lib.tag_metadata import TagMetadataCache
+from tests.helpers import WebAccessTestCase
+
+
+def tag_list(*tag_names):
+    return json.dumps({"Result": {"Ret": 0, "Total": len(tag_names)},
+                       "Tags": [{"Name": tag_name, "Description": tag_name.upper()} for tag_name in tag_names]})
+
+
+class TagMetadataCacheTest(AsyncTestCase):
+
+    def setUp(self):
+        super(TagMetadataCacheTest, self).setUp()
+        self.cache = TagMetadataCache(60, 60)
+        self.headers = credentials.basic_headers("admin", "")
+        self.tag_names = ["kw"]
+        self.fetches = []
+
+    def fetch_tag_list(self, wa_headers, project_name):
+        future = Future()
+        self.fetches.append(future)
+        self.io_loop.add_callback(future.set_result, tag_list(*self.tag_names))
+        return future
+
+    def get_tag_names(self):
+        return gen.maybe_future(self.cache.get_tags(self.headers, "85", self.fetch_tag_list))
+
+    def age(self, seconds):
+        tags, load_time = self.cache._projects["85"]
+        self.cache._projects["85"] = (tags, load_time - seconds)
+
+    @gen_test
+    def test_cached(self):
+        tags = yield self.get_tag_names()
+        self.assertEqual([(tag.name, tag.description) for tag in tags], [("kw", "KW")])
+        yield self.get_tag_names()
+        self.assertEqual(len(self.fetches), 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    @gen_test
+    def test_concurrent_loads_coalesced(self):
+        yield [self.get_tag_names() for i in range(3)]
+        self.assertEqual(len(self.fetches), 1)
+
+    @gen_test
+    def test_stale_refreshed_in_background(self):
+        yield self.get_tag_names()
+        self.age(90)
+        self.tag_names = ["kw", "kw1"]
+        tags = yield self.get_tag_names()
+        self.assertEqual([tag.name for tag in tags], ["kw"])  # Not waiting for the refresh
+        self.assertEqual(self.cache.stats()['stale_hits'], 1)
+
+        yield self.fetches[-1]
+        yield gen.moment
+        tags = yield self.get_tag_names()
+        self.assertEqual([tag.name for tag in tags], ["kw", "kw1"])
+        self.assertEqual(len(self.fetches), 2)
+
+    @gen_test
+    def test_expired_loaded_again(self):
+        yield self.get_tag_names()
+        self.age(121)
+        yield self.get_tag_names()
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    @gen_test
+    def test_invalidated_while_loading(self):
+        future = self.get_tag_names()
+        self.cache.invalidate()
+        tags = yield future
+        self.assertEqual([tag.name for tag in tags], ["kw"])
+        self.assertEqual(self.cache.stats()['projects'], 0)
+
+    def test_tag_details_kept(self):
+        self.cache.put_tag_list("85", tag_list("kw", "kw1"))
+        self.cache.put_tag_details("85", json.dumps({"Tags": [{"NAME": "kw", "DESCRP": "Meter", "TYPE": "ANALOG"}]}))
+        tags = self.cache.put_tag_list("85", tag_list("kw"))
+        self.assertEqual([(tag.name, tag.description, tag.tag_type) for tag in tags], [("kw", "KW", "ANALOG")])
+
+    def test_xml_tag_list(self):
+        tags = tag_metadata.parse_tag_list("<TagList><Result><Ret>0</Ret><Total>1</Total></Result><Tags><Tag>"
+                                           "<Name>kw</Name><Description>KW</Description></Tag></Tags></TagList>",
+                                           get_json=False)
+        self.assertEqual([(tag.name, tag.description) for tag in tags], [("kw", "KW")])
+
+
+class TagNamesTest(WebAccessTestCase):
+
+    @gen_test
+    def test_tag_list_fetched_once(self):
+        headers = credentials.basic_headers("admin", "")
+        for get_json in (True, False):
+            tag_names = yield webaccess.get_tag_names(headers, "85", get_json)
+            self.assertEqual(tag_names, ["kw", "kw1"])
+        yield webaccess.get_tag_values(headers, "85")
+        self.assertEqual(self.webaccess_calls['TagList'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
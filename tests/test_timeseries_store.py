@@ -0,0 +1,123 @@
+"""
+Tests of the on-disk store of the 15-minute readings (lib.timeseries_store) and of its use by lib.datalog.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from tornado.testing import gen_test
+from lib import credentials
+from lib import datalog
+from lib import timeseries_store
+from lib.timeseries_store import TimeSeriesStore, MISSING
+from tests.helpers import WebAccessTestCase
+from tests.test_datalog import expected_readings
+
+SERIES = ("85", "", "3", "kw")
+DAY = datetime.datetime(2015, 5, 3)
+
+
+class TimeSeriesStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.store = TimeSeriesStore(self.root_path, max_open_files=2)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root_path, ignore_errors=True)
+
+    def file_path(self, month_time):
+        return self.store._file_path(SERIES, month_time)
+
+    def test_round_trip(self):
+        self.store.write(SERIES, DAY, [1.5, MISSING, None, 4.0])
+        self.assertEqual(self.store.read(SERIES, DAY, 5), [1.5, MISSING, None, 4.0, None])
+
+    def test_not_stored(self):
+        self.assertEqual(self.store.read(SERIES, DAY, 3), [None] * 3)
+        self.store.write(SERIES, DAY, [None, None])
+        self.assertFalse(os.path.exists(self.file_path(DAY)))
+
+    def test_across_months(self):
+        start_time = datetime.datetime(2015, 4, 30, 23, 30)
+        self.store.write(SERIES, start_time, [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(self.store.read(SERIES, start_time, 4), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(self.store.read(SERIES, datetime.datetime(2015, 5, 1), 2), [3.0, 4.0])
+        self.assertTrue(os.path.exists(self.file_path(datetime.datetime(2015, 4, 1))))
+        self.assertTrue(os.path.exists(self.file_path(datetime.datetime(2015, 5, 1))))
+
+    def test_read_by_another_store(self):
+        self.store.write(SERIES, DAY, [1.0, 2.0])
+        reader = TimeSeriesStore(self.root_path)
+        try:
+            self.assertEqual(reader.read(SERIES, DAY, 2), [1.0, 2.0])
+            self.store.write(SERIES, DAY + datetime.timedelta(minutes=30), [3.0])
+            self.assertEqual(reader.read(SERIES, DAY, 3), [1.0, 2.0, 3.0])  # Through the shared mapping
+        finally:
+            reader.close()
+
+    def test_invalid_file_replaced(self):
+        file_path = self.file_path(DAY)
+        os.makedirs(os.path.dirname(file_path))
+        with open(file_path, 'wb') as invalid_file:
+            invalid_file.write("not a time series file")
+        self.assertEqual(self.store.read(SERIES, DAY, 1), [None])
+        self.store.write(SERIES, DAY, [1.0])
+        self.assertEqual(self.store.read(SERIES, DAY, 1), [1.0])
+        self.assertEqual(os.path.getsize(file_path), timeseries_store.FILE_SIZE)
+
+    def test_existing_file_not_replaced(self):
+        self.store.write(SERIES, DAY, [1.0])
+        timeseries_store._create_file(self.file_path(DAY))  # As another process creating it at the same time
+        self.assertEqual(self.store.read(SERIES, DAY, 1), [1.0])
+        self.assertEqual(os.listdir(os.path.dirname(self.file_path(DAY))), [os.path.basename(self.file_path(DAY))])
+
+    def test_open_files_bounded(self):
+        for month in range(1, 5):
+            self.store.write(SERIES, datetime.datetime(2015, month, 1), [float(month)])
+            self.assertEqual(self.store.read(SERIES, datetime.datetime(2015, month, 1), 1), [float(month)])
+        self.assertEqual(len(self.store._read_maps), 2)
+        self.assertEqual(len(self.store._write_maps), 2)
+        self.assertEqual(self.store.read(SERIES, datetime.datetime(2015, 1, 1), 1), [1.0])
+
+
+class DataLogStoreTest(WebAccessTestCase):
+
+    @gen_test
+    def test_settled_readings_read_from_store(self):
+        headers = credentials.basic_headers("admin", "")
+        yield datalog.get_base_series(headers, ["kw"], DAY, 96, "3")
+        datalog.store_executor.submit(lambda: None).result()  # After the pending writes
+        datalog.cache.local.clear()
+
+        tag_readings = yield datalog.get_base_series(headers, ["kw"], DAY, 96, "3")
+        self.assertEqual(tag_readings["kw"], expected_readings(DAY, 96))
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+
+    @gen_test
+    def test_settled_readings_written_once(self):
+        headers = credentials.basic_headers("admin", "")
+        now = datetime.datetime.now()
+        current_slot = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+        window_start_time = current_slot - datetime.timedelta(minutes=15 * 23)  # A window that is not over yet
+        written_slots = []
+        write = datalog.store.write
+
+        def store_write(series, start_time, readings):
+            written_slots.extend(start_time + datetime.timedelta(minutes=15 * i) for i in range(len(readings)))
+            write(series, start_time, readings)
+
+        datalog.store.write = store_write
+        for attempt in range(3):  # Served from the cache after the first one
+            yield datalog.start_base_windows(headers, ["kw"], [window_start_time], "3")
+            datalog.store_executor.submit(lambda: None).result()  # After the pending writes
+
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 1)
+        self.assertTrue(written_slots)
+        self.assertEqual(len(written_slots), len(set(written_slots)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests of the scheduler of the WebAccess requests (lib.upstream_scheduler).
+"""
+import unittest
+from tornado import gen
+from tornado import httpclient
+from tornado.testing import AsyncTestCase, gen_test
+from lib.upstream_scheduler import UpstreamScheduler, CLASS_INTERACTIVE, CLASS_EXPORT, CLASS_PREFETCH
+
+
+class UpstreamSchedulerTest(AsyncTestCase):
+
+    def setUp(self):
+        super(UpstreamSchedulerTest, self).setUp()
+        self.scheduler = UpstreamScheduler(2, {CLASS_EXPORT: 1}, 0.05)
+        self.started = []
+
+    def acquire(self, priority_class, user, name):
+        future = self.scheduler.acquire(priority_class, user)
+        future.add_done_callback(lambda f: f.exception() is None and self.started.append(name))
+        return future
+
+    def test_concurrent_requests_limited(self):
+        futures = [self.acquire(CLASS_INTERACTIVE, "a", i) for i in range(3)]
+        self.assertEqual([future.done() for future in futures], [True, True, False])
+        self.assertEqual(self.scheduler.stats()['queued'][CLASS_INTERACTIVE], 1)
+
+        self.scheduler.release(CLASS_INTERACTIVE)
+        self.assertTrue(futures[2].done())
+        self.assertEqual(self.scheduler.running, 2)
+
+    def test_class_limit(self):
+        futures = [self.acquire(CLASS_EXPORT, "a", i) for i in range(2)]
+        self.assertEqual([future.done() for future in futures], [True, False])
+        self.assertTrue(self.acquire(CLASS_INTERACTIVE, "a", "interactive").done())  # The slot left by the export
+
+    def test_priority_order(self):
+        self.acquire(CLASS_INTERACTIVE, "a", "first")
+        self.acquire(CLASS_INTERACTIVE, "a", "second")
+        self.acquire(CLASS_PREFETCH, "a", "prefetch")
+        self.acquire(CLASS_INTERACTIVE, "b", "interactive")
+        self.scheduler.release(CLASS_INTERACTIVE)
+        self.scheduler.release(CLASS_INTERACTIVE)
+        self.assertEqual(self.started, ["first", "second", "interactive", "prefetch"])
+
+    def test_users_take_turns(self):
+        self.acquire(CLASS_INTERACTIVE, "busy", "running 1")
+        self.acquire(CLASS_INTERACTIVE, "busy", "running 2")
+        for i in range(3):
+            self.acquire(CLASS_INTERACTIVE, "busy", "busy {0}".format(i))
+        self.acquire(CLASS_INTERACTIVE, "other", "other")
+        for i in range(4):
+            self.scheduler.release(CLASS_INTERACTIVE)
+        self.assertEqual(self.started[2:], ["busy 0", "other", "busy 1", "busy 2"])
+
+    @gen_test
+    def test_queue_timeout(self):
+        self.acquire(CLASS_INTERACTIVE, "a", 0)
+        self.acquire(CLASS_INTERACTIVE, "a", 1)
+        with self.assertRaises(httpclient.HTTPError) as context:
+            yield self.acquire(CLASS_INTERACTIVE, "a", 2)
+        self.assertEqual(context.exception.code, 599)
+        self.assertEqual(self.scheduler.stats()['timeouts'], 1)
+        self.assertEqual(self.scheduler.stats()['queued'][CLASS_INTERACTIVE], 0)
+
+        self.scheduler.release(CLASS_INTERACTIVE)
+        self.assertEqual(self.scheduler.running, 1)  # The expired request is not started
+
+    @gen_test
+    def test_started_request_not_expired(self):
+        self.acquire(CLASS_INTERACTIVE, "a", 0)
+        self.acquire(CLASS_INTERACTIVE, "a", 1)
+        future = self.acquire(CLASS_INTERACTIVE, "a", 2)
+        self.scheduler.release(CLASS_INTERACTIVE)
+        yield gen.sleep(0.1)
+        self.assertIsNone(future.exception())
+        self.assertEqual(self.scheduler.stats()['timeouts'], 0)
+
+    def test_try_acquire(self):
+        self.assertTrue(self.scheduler.try_acquire(CLASS_EXPORT))
+        self.assertFalse(self.scheduler.try_acquire(CLASS_EXPORT))  # Over the class limit
+        self.assertTrue(self.scheduler.try_acquire(CLASS_INTERACTIVE))
+        self.assertFalse(self.scheduler.try_acquire(CLASS_INTERACTIVE))  # No free slot
+
+        self.acquire(CLASS_PREFETCH, "a", "waiting")
+        self.scheduler.release(CLASS_EXPORT)
+        self.assertEqual(self.started, ["waiting"])  # Not left for try_acquire
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Tests of the watchdog of the IOLoop stalls (lib.watchdog).
+"""
+import json
+import logging
+import time
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+from lib import metrics
+from lib import request_timing
+from lib import watchdog
+from lib.request_timing import RequestTimeline
+from tests.test_request_timing import ListHandler
+
+
+def blocking_callback():
+    time.sleep(0.2)
+
+
+class WatchdogTest(AsyncTestCase):
+
+    def setUp(self):
+        super(WatchdogTest, self).setUp()
+        self.log_handler = ListHandler()
+        watchdog.logger.addHandler(self.log_handler)
+        self.watchdog = watchdog.Watchdog(self.io_loop, 0.05, 0.01)
+        self.watchdog.start()
+
+    def tearDown(self):
+        watchdog.logger.removeHandler(self.log_handler)
+        super(WatchdogTest, self).tearDown()
+
+    def stalls(self):
+        return [json.loads(record.getMessage().split("IOLoop stall: ", 1)[1]) for record in self.log_handler.records]
+
+    @gen_test
+    def test_stall_reported(self):
+        stalls = sum(metrics.loop_stalls._values.values())
+        with request_timing.context(RequestTimeline("test-stall", "TestHandler", "test_route")):
+            self.io_loop.add_callback(blocking_callback)
+        yield gen.sleep(0.3)
+
+        reported_stalls = self.stalls()
+        self.assertEqual(len(reported_stalls), 1)
+        stall = reported_stalls[0]
+        self.assertGreaterEqual(stall['ms'], 150)
+        self.assertEqual((stall['request_id'], stall['handler'], stall['route']),
+                         ("test-stall", "TestHandler", "test_route"))
+        self.assertTrue(stall['stack'][-1].endswith(" blocking_callback"))
+        self.assertEqual(sum(metrics.loop_stalls._values.values()), stalls + 1)
+        self.assertGreater(self.watchdog.lag, 0)
+
+    @gen_test
+    def test_no_stall(self):
+        yield gen.sleep(0.1)
+        self.assertEqual(self.stalls(), [])
+        self.assertLess(self.watchdog.lag, 0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
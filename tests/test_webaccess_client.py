@@ -0,0 +1,74 @@
+"""
+Tests of the non-blocking WebAccess client (lib.webaccess_client) and the WebAccess web services built on it.
+"""
+import json
+import time
+import unittest
+from tornado import gen
+from tornado import httpclient
+from tornado.testing import gen_test
+from handlers import webaccess
+from lib import credentials
+from lib import webaccess_client
+from tests.helpers import WebAccessTestCase
+
+DATA_LOG_REQUEST = json.dumps({"StartTime": "2015-05-03 00:00:00", "IntervalType": "M", "Interval": 15,
+                               "Records": 4, "Tags": [{"Name": "kw", "DataType": 3}]})
+
+
+class WebAccessClientTest(WebAccessTestCase):
+    data_log_delay = 0.3
+
+    def setUp(self):
+        super(WebAccessClientTest, self).setUp()
+        self.headers = credentials.basic_headers("admin", "")
+
+    @gen_test
+    def test_fetch_returns_body(self):
+        body = yield webaccess_client.fetch(webaccess.WA_ROOT_URL + "Json/TagList/85", self.headers)
+        self.assertEqual([tag['Name'] for tag in json.loads(body)['Tags']], ["kw", "kw1"])
+
+    @gen_test
+    def test_fetch_does_not_block(self):
+        url = webaccess.WA_ROOT_URL + "Json/GetDataLog/85"
+        start_time = time.time()
+        # Outside of a request, the requests have the prefetch priority class, which runs 2 at the same time
+        bodies = yield [webaccess_client.fetch(url, self.headers, 'POST', DATA_LOG_REQUEST) for i in range(2)]
+        self.assertLess(time.time() - start_time, 2 * self.data_log_delay)
+        self.assertEqual(len(set(bodies)), 1)
+        self.assertEqual(self.webaccess_calls['GetDataLog'], 2)
+
+    @gen_test
+    def test_fetch_raises_http_errors(self):
+        with self.assertRaises(httpclient.HTTPError) as context:
+            yield webaccess_client.fetch(webaccess.WA_ROOT_URL + "Json/Logon", credentials.basic_headers("bad", ""))
+        self.assertEqual(context.exception.code, 401)
+
+    @gen_test
+    def test_gather_keeps_order_and_limit(self):
+        running = [0, 0]  # Running tasks, and the maximum of them
+
+        @gen.coroutine
+        def task(result):
+            running[0] += 1
+            running[1] = max(running)
+            yield gen.sleep(0.01)
+            running[0] -= 1
+            raise gen.Return(result)
+
+        results = yield webaccess_client.gather([lambda i=i: task(i) for i in range(10)], max_parallel=3)
+        self.assertEqual(results, range(10))
+        self.assertEqual(running[1], 3)
+
+    @gen_test
+    def test_get_wa_web_service(self):
+        body = yield webaccess.get_wa_web_service(self.headers, "Logon")
+        self.assertEqual(json.loads(body)['Result']['Ret'], 0)
+
+    def test_web_service_name(self):
+        self.assertEqual(webaccess_client.get_web_service_name(webaccess.WA_ROOT_URL + "Json/TagList/85"), "TagList")
+        self.assertEqual(webaccess_client.get_web_service_name("http://example.com/TagList"), "other")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,15 +4,18 @@ Module to maintain all URL patterns used in this Tornado web server.
 These URLs must be imported into the main program and used in the tornado.web.Application initializer.
 """
 
-from tornado.web import url, StaticFileHandler
+from tornado.web import url
 from handlers.index_handler import IndexHandler
+from handlers.metrics import MetricsHandler
 from handlers.power_metering_api import PowerMeteringHandler
+from handlers.profiler import ProfilerHandler
+from handlers.static_file_handler import ExportFileDownloadedHandler, ExportFileHandler
 from handlers.susiaccess import SUSIAccessHandler
 from handlers.webaccess import WebAccessHandler
 from settings import settings
 
-# File export path
-FILE_EXPORT_PATH = settings['FILE_EXPORT_PATH']
+# File export directory
+FILE_EXPORT_ROOT = settings['FILE_EXPORT_ROOT']
 
 # Reusable regex expressions
 alphanumeric_regex = "[a-zA-Z0-9._-]+"
@@ -57,7 +60,14 @@ url_patterns = [
     url(r"/get_energy_consumption_history", PowerMeteringHandler),
 	# B12-1 - 用電趨勢（日）匯出 & B12-2 - 用電趨勢（月）匯出
     # Example: http://localhost:8888/get_energy_consumption_history_export?power_meter_id=id&date=d&datarange=r&intervaltype=i&interval=x
+    # Add &format=f to choose the file format (f: csv, csv_gz, ndjson or binary), default - csv
+    # Add &stream=1 to download the file directly (chunked) instead of getting a link to it
     url(r"/get_energy_consumption_history_export", PowerMeteringHandler),
+    # Export in the background: submit returns a job id, whose status (and file link, when done) can then be checked
+    # Example: http://localhost:8888/submit_energy_consumption_history_export?power_meter_id=id&date=d&datarange=r&interval=x
+    # Example: http://localhost:8888/get_export_job_status?job_id=j
+    url(r"/submit_energy_consumption_history_export", PowerMeteringHandler),
+    url(r"/get_export_job_status", PowerMeteringHandler),
 
     # B13 - 用電比較 (日比較) & B14 - 用電比較 (月比較)
     # Example: http://localhost:8888/get_energy_consumption_history_comparison?power_meter_id=id&date_1=d&date_2=d&datarange=r&intervaltype=i&interval=x
@@ -66,9 +76,25 @@ url_patterns = [
     # *** Serve static files ***
 	# Export files:
     # Example: http://localhost:8888/static/exportfiles/1260.csv
-    url(r"/static/exportfiles/(.*)", StaticFileHandler, {'path': FILE_EXPORT_PATH})
+    url(r"/static/exportfiles/(.*)", ExportFileHandler, {'path': FILE_EXPORT_ROOT})
 ]
 
+# **** Export worker (see export_worker) ****
+# The routes served on EXPORT_WORKER_PORT to the other worker processes, in addition to url_patterns
+export_worker_url_patterns = [
+    url(r"/export_file_downloaded/({0})".format(alphanumeric_regex), ExportFileDownloadedHandler),
+]
+
+# **** Metrics (Prometheus text format) ****
+# Example: http://localhost:8888/metrics
+if settings['METRICS_ENABLED']:
+    url_patterns.append(url(r"/metrics", MetricsHandler))
+
+# **** Sampling profiler (collapsed stacks, for flame graphs) ****
+# Example: http://localhost:8888/debug/profile?seconds=10&interval_ms=10
+if settings['PROFILER_USERS']:
+    url_patterns.append(url(r"/debug/profile", ProfilerHandler))
+
 # Append function URLs to root '/'
 for url_pattern in url_dictionary:
     url_patterns.append(url(r"/({0})".format(url_pattern), IndexHandler))
\ No newline at end of file